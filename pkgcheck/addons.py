@@ -15,12 +15,17 @@ from snakeoil.osutils import abspath, listdir_files, pjoin
 from snakeoil.sequences import iflatten_instance
 
 from pkgcheck import base
+# registers pickle support for profile data
+from pkgcheck import profile_cache
 
 demandload(
+    'multiprocessing',
     'os',
     'pkgcore.restrictions:packages,values',
-    'pkgcore.ebuild:misc,domain,profiles,repo_objs',
+    'pkgcore.ebuild:cpv,misc,domain,profiles,repo_objs',
     'pkgcore.log:logger',
+    'pkgcore.repository.util:SimpleTree',
+    'snakeoil:pickling',
 )
 
 
@@ -62,6 +67,73 @@ class ArchesAddon(base.Addon):
             """ % ", ".join(cls.default_arches))
 
 
+class QueryCache(object):
+    """Mapping of repo queries to their matches with least recently used eviction.
+
+    Entries are weighted by the number of packages they match (at least one)
+    and the least recently used ones get evicted once the total weight goes
+    over the limit.
+
+    :ivar hits: number of lookups of cached queries
+    :ivar misses: number of lookups of uncached queries
+    :ivar evictions: number of entries evicted due to the weight limit
+    """
+
+    def __init__(self, max_weight=None):
+        self.max_weight = max_weight
+        self.weight = 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            entry = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        # reinsert to mark it as the most recently used
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.weight -= old[1]
+        weight = max(1, len(value))
+        self._entries[key] = (value, weight)
+        self.weight += weight
+        if self.max_weight is None:
+            return
+        # an entry exceeding the limit by itself is kept until the next one
+        while self.weight > self.max_weight and len(self._entries) > 1:
+            self.weight -= self._entries.popitem(last=False)[1][1]
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.weight = 0
+
+    def __str__(self):
+        return 'query cache: %i hits, %i misses, %i evictions' % (
+            self.hits, self.misses, self.evictions)
+
+
+_missing = object()
+
+
 class QueryCacheAddon(base.Template):
 
     priority = 1
@@ -69,28 +141,46 @@ class QueryCacheAddon(base.Template):
     @staticmethod
     def mangle_argparser(parser):
         group = parser.add_argument_group('query caching')
+        group.add_argument(
+            '--query-cache-size', type=int, default=100000, metavar='MATCHES',
+            help='maximum number of package matches kept in the query cache '
+                 '(default: 100000, 0 for no limit)',
+            docs="""
+                Maximum number of package matches kept in the query cache
+                shared by all checks for the whole run. Each cached query
+                counts as the number of packages it matches (at least one),
+                the least recently used queries are dropped first once the
+                limit is reached. Set to 0 for no limit.
+            """)
         group.add_argument(
             '--reset-caching-per', dest='query_caching_freq',
-            choices=('version', 'package', 'category'), default='package',
-            help='control how often the cache is cleared '
-                 '(version, package or category)')
+            choices=('version', 'package', 'category'), default=None,
+            help='additionally clear the cache for every version, package '
+                 'or category (default: never)')
 
     @staticmethod
     def check_args(parser, namespace):
-        namespace.query_caching_freq = {
-            'version': base.versioned_feed,
-            'package': base.package_feed,
-            'category': base.repository_feed,
-            }[namespace.query_caching_freq]
+        if namespace.query_cache_size < 0:
+            parser.error('--query-cache-size must not be negative')
+        if namespace.query_caching_freq is not None:
+            namespace.query_caching_freq = {
+                'version': base.versioned_feed,
+                'package': base.package_feed,
+                'category': base.category_feed,
+                }[namespace.query_caching_freq]
 
     def __init__(self, options):
         base.Addon.__init__(self, options)
-        self.query_cache = {}
-        # XXX this should be logging debug info
+        self.query_cache = QueryCache(options.query_cache_size or None)
+        # only get fed (and thus clear the cache) if asked to
         self.feed_type = self.options.query_caching_freq
 
     def feed(self, item, reporter):
-        # XXX as should this.
+        self.query_cache.clear()
+
+    def feed_batch(self, items, reporter):
+        # The whole batch gets fed to other checks after this, so the cache
+        # can only be cleared per batch.
         self.query_cache.clear()
 
 
@@ -122,6 +212,127 @@ class profile_data(object):
         return immutable, enabled
 
 
+def _chunked_data_key(cdict):
+    """Return a hashable key equal for equal frozen ChunkedDataDict objects."""
+    return (tuple(cdict._global_settings),
+            frozenset((k, tuple(v)) for k, v in cdict._dict.iteritems()))
+
+
+def _provides_repo(cpvs):
+    """Return a repo of package.provided entries like profiles create them."""
+    d = {}
+    for cpvstr in cpvs:
+        pkg = cpv.versioned_CPV(cpvstr)
+        d.setdefault(pkg.category, {}).setdefault(
+            pkg.package, []).append(pkg.fullver)
+    parent = profiles.PkgProvidedParent()
+    repo = SimpleTree(
+        d, pkg_klass=partial(profiles.PkgProvided, parent),
+        livefs=True, frozen=True, repo_id='provided')
+    parent._parent_repo = repo
+    if not d:
+        # the vast majority of profiles don't provide anything, skip the
+        # restriction matching for them
+        repo.match = repo.itermatch = lambda *args, **kwargs: iter(())
+        repo.has_match = lambda *args, **kwargs: False
+    return repo
+
+
+class _LoadedProfile(object):
+    """Profile data created in a worker process, see :obj:`_create_profiles`.
+
+    Provides the profile attributes used by :obj:`ProfileAddon`.
+    """
+
+    __slots__ = (
+        'path', 'arch', 'deprecated', 'masks', 'unmasks', 'iuse_effective',
+        'masked_use', 'stable_masked_use', 'forced_use', 'stable_forced_use',
+        'provided', '_provides_repo',
+    )
+
+    def __init__(self, profile):
+        for attr in self.__slots__[:-2]:
+            setattr(self, attr, getattr(profile, attr))
+        self.provided = tuple(pkg.cpvstr for pkg in profile.provides_repo)
+        self._provides_repo = None
+
+    @property
+    def provides_repo(self):
+        if self._provides_repo is None:
+            self._provides_repo = _provides_repo(self.provided)
+        return self._provides_repo
+
+    def __getstate__(self):
+        return dict((attr, getattr(self, attr)) for attr in self.__slots__[:-1])
+
+    def __setstate__(self, state):
+        for attr, value in state.iteritems():
+            setattr(self, attr, value)
+        self._provides_repo = None
+
+
+# profiles object to create profiles from, set before forking the workers off
+_profiles_obj = None
+
+
+def _create_profile(profile_path):
+    try:
+        profile = _profiles_obj.create_profile(profile_path)
+    except profiles.ProfileError as e:
+        return pickling.dumps((e.path, e.filename, str(e.error)), -1)
+    try:
+        return pickling.dumps(_LoadedProfile(profile), -1)
+    except Exception:
+        # errors parsing the profile data or data pickle can't handle, leave
+        # it up to the parent so failures happen the same as when serial
+        return None
+
+
+def _create_profiles(profiles_obj, profile_paths, jobs=1):
+    """Yield (profile path, profile) pairs for the given profiles.
+
+    ProfileError instances are yielded in place of the profiles failing to
+    be created. Profiles are created in parallel using the given number of
+    processes, in which case the bulk of them are :obj:`_LoadedProfile`
+    instances carrying their fully parsed data.
+    """
+    global _profiles_obj
+
+    profile_paths = list(profile_paths)
+    if jobs <= 1 or len(profile_paths) <= 1:
+        for profile_path in profile_paths:
+            try:
+                yield profile_path, profiles_obj.create_profile(profile_path)
+            except profiles.ProfileError as e:
+                yield profile_path, e
+        return
+
+    _profiles_obj = profiles_obj
+    pool = multiprocessing.Pool(min(jobs, len(profile_paths)))
+    try:
+        results = pool.map(_create_profile, profile_paths)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        _profiles_obj = None
+
+    for profile_path, data in zip(profile_paths, results):
+        if data is not None:
+            try:
+                data = pickling.loads(data)
+            except Exception:
+                data = None
+        if data is None:
+            try:
+                data = profiles_obj.create_profile(profile_path)
+            except profiles.ProfileError as e:
+                data = e
+        elif isinstance(data, tuple):
+            data = profiles.ProfileError(*data)
+        yield profile_path, data
+
+
 class ProfileAddon(base.Addon):
 
     required_addons = (ArchesAddon,)
@@ -162,6 +373,16 @@ class ProfileAddon(base.Addon):
                 respectively. Therefore, to only scan all stable profiles
                 pass the 'stable' argument to --profiles.
             """)
+        group.add_argument(
+            '--profile-cache', metavar='FILE',
+            help='store the set up profile data in FILE for later runs',
+            docs="""
+                Store the profile data set up for the selected arches and
+                profiles in FILE and reuse it on later runs, skipping the
+                expensive profile creation as long as the profiles trees and
+                the arch and profile selection didn't change. The file is
+                created if it doesn't exist yet.
+            """)
 
     @staticmethod
     def check_args(parser, namespace):
@@ -209,6 +430,29 @@ class ProfileAddon(base.Addon):
 
         profile_paths = enabled.difference(disabled)
 
+        namespace.profile_snapshot = None
+        if namespace.profile_cache:
+            profiles_dirs = [profiles_obj.profile_base]
+            if not profiles_dir:
+                profiles_dirs.extend(
+                    repo.config.profiles_base
+                    for repo in namespace.target_repo.trees
+                    if repo.config.profiles_base != profiles_obj.profile_base)
+            selection = (
+                sorted(profile_paths), namespace.profiles is not None,
+                namespace.profiles_ignore_deprecated,
+                getattr(namespace, 'arches', None),
+                getattr(namespace, 'selected_arches', None) is None)
+            namespace.profile_cache_key = profile_cache.fingerprint(
+                profiles_dirs, selection)
+            namespace.profile_snapshot = profile_cache.load(
+                namespace.profile_cache, namespace.profile_cache_key)
+            if namespace.profile_snapshot is not None:
+                # no need to create the profiles, everything required is
+                # part of the snapshot
+                namespace.arch_profiles = {}
+                return
+
         # We hold onto the profiles as we're going, due to the fact that
         # profile nodes are weakly cached; hold onto all for this loop, avoids
         # a lot of reparsing at the expense of slightly more memory usage
@@ -216,14 +460,13 @@ class ProfileAddon(base.Addon):
         cached_profiles = []
 
         arch_profiles = defaultdict(list)
-        for profile_path in profile_paths:
-            try:
-                p = profiles_obj.create_profile(profile_path)
-            except profiles.ProfileError as e:
+        for profile_path, p in _create_profiles(
+                profiles_obj, profile_paths, getattr(namespace, 'jobs', 1)):
+            if isinstance(p, profiles.ProfileError):
                 # Only throw errors if the profile was selected by the user, bad
                 # repo profiles will be caught during repo metadata scans.
                 if namespace.profiles is not None:
-                    parser.error('invalid profile: %r: %s' % (e.path, e.error))
+                    parser.error('invalid profile: %r: %s' % (p.path, p.error))
                 continue
             if namespace.profiles_ignore_deprecated and p.deprecated:
                 continue
@@ -245,29 +488,34 @@ class ProfileAddon(base.Addon):
             self.desired_arches = set(self.official_arches)
 
         self.global_insoluble = set()
-        profile_filters = {}
-        self.keywords_filter = {}
-
+        snapshot = getattr(options, 'profile_snapshot', None)
+        if snapshot is None:
+            snapshot = self._snapshot(options)
+            if getattr(options, 'profile_cache', None):
+                profile_cache.save(
+                    options.profile_cache, options.profile_cache_key, snapshot)
+        self._load_snapshot(snapshot)
+
+    def _snapshot(self, options):
+        """Collapse the data required from the selected profiles.
+
+        The returned data is what :obj:`pkgcheck.profile_cache` persists, so
+        it's kept free of the per run caches shared between profiles.
+        """
+        arch_profiles = {}
         chunked_data_cache = {}
 
         for k in self.desired_arches:
             if k.lstrip("~") not in self.desired_arches:
                 continue
             stable_key = k.lstrip("~")
-            unstable_key = "~" + stable_key
-            stable_r = packages.PackageRestriction("keywords",
-                values.ContainmentMatch(stable_key))
-            unstable_r = packages.PackageRestriction("keywords",
-                values.ContainmentMatch(stable_key, unstable_key))
 
             default_masked_use = tuple(set(x for x in self.official_arches
                                            if x != stable_key))
 
-            profile_filters.update({stable_key: [], unstable_key: []})
+            entries = arch_profiles[stable_key] = []
 
             for profile_name, profile in options.arch_profiles.get(k, []):
-                vfilter = domain.generate_filter(profile.masks, profile.unmasks)
-
                 immutable_flags = profile.masked_use.clone(unfreeze=True)
                 immutable_flags.add_bare_global((), default_masked_use)
                 immutable_flags.optimize(cache=chunked_data_cache)
@@ -288,6 +536,60 @@ class ProfileAddon(base.Addon):
                 stable_enabled_flags.optimize(cache=chunked_data_cache)
                 stable_enabled_flags.freeze()
 
+                provided = tuple(pkg.cpvstr for pkg in profile.provides_repo)
+
+                entries.append((
+                    profile_name, provided, profile.masks, profile.unmasks,
+                    profile.iuse_effective,
+                    stable_immutable_flags, stable_enabled_flags,
+                    immutable_flags, enabled_flags))
+
+        # group profiles sharing the same use data by index, hashing the
+        # collapsed use data instead of comparing it against every group
+        evaluate_groups = {}
+        for stable_key, entries in arch_profiles.iteritems():
+            for key, flags in ((stable_key, slice(5, 7)),
+                               ("~" + stable_key, slice(7, 9))):
+                similar = OrderedDict()
+                for i, entry in enumerate(entries):
+                    fingerprint = tuple(_chunked_data_key(x) for x in entry[flags])
+                    similar.setdefault(fingerprint, []).append(i)
+                evaluate_groups[key] = list(similar.itervalues())
+
+        return arch_profiles, evaluate_groups
+
+    def _load_snapshot(self, snapshot):
+        arch_profiles, evaluate_groups = snapshot
+        profile_filters = {}
+        keywords_filter = {}
+        # profiles with the same masks and unmasks share their visibility
+        # filters, so visibility only gets evaluated once per distinct set
+        visibility_classes = {}
+
+        for stable_key, entries in arch_profiles.iteritems():
+            unstable_key = "~" + stable_key
+            stable_r = packages.PackageRestriction("keywords",
+                values.ContainmentMatch(stable_key))
+            unstable_r = packages.PackageRestriction("keywords",
+                values.ContainmentMatch(stable_key, unstable_key))
+
+            profile_filters.update({stable_key: [], unstable_key: []})
+            vfilters = {}
+            for key in (stable_key, unstable_key):
+                visibility_classes[key] = OrderedDict()
+
+            for (profile_name, provided, masks, unmasks, iuse_effective,
+                    stable_immutable_flags, stable_enabled_flags,
+                    immutable_flags, enabled_flags) in entries:
+                provides_repo = _provides_repo(provided)
+                try:
+                    stable_vfilter, unstable_vfilter = vfilters[(masks, unmasks)]
+                except KeyError:
+                    vfilter = domain.generate_filter(masks, unmasks)
+                    stable_vfilter, unstable_vfilter = vfilters[(masks, unmasks)] = (
+                        packages.AndRestriction(vfilter, stable_r),
+                        packages.AndRestriction(vfilter, unstable_r))
+
                 # used to interlink stable/unstable lookups so that if
                 # unstable says it's not visible, stable doesn't try
                 # if stable says something is visible, unstable doesn't try.
@@ -301,45 +603,44 @@ class ProfileAddon(base.Addon):
                 # stable cache is usable for unstable, but not vice versa.
                 # unstable insoluble is usable for stable, but not vice versa
 
-                profile_filters[stable_key].append(profile_data(
+                stable_profile = profile_data(
                     profile_name, stable_key,
-                    profile.provides_repo,
-                    packages.AndRestriction(vfilter, stable_r),
-                    profile.iuse_effective,
+                    provides_repo,
+                    stable_vfilter,
+                    iuse_effective,
                     stable_immutable_flags, stable_enabled_flags,
                     stable_cache,
-                    ProtectedSet(unstable_insoluble)))
+                    ProtectedSet(unstable_insoluble))
+                profile_filters[stable_key].append(stable_profile)
+                visibility_classes[stable_key].setdefault(
+                    (masks, unmasks), []).append(stable_profile)
 
-                profile_filters[unstable_key].append(profile_data(
+                unstable_profile = profile_data(
                     profile_name, unstable_key,
-                    profile.provides_repo,
-                    packages.AndRestriction(vfilter, unstable_r),
-                    profile.iuse_effective,
+                    provides_repo,
+                    unstable_vfilter,
+                    iuse_effective,
                     immutable_flags, enabled_flags,
                     ProtectedSet(stable_cache),
-                    unstable_insoluble))
+                    unstable_insoluble)
+                profile_filters[unstable_key].append(unstable_profile)
+                visibility_classes[unstable_key].setdefault(
+                    (masks, unmasks), []).append(unstable_profile)
 
-            self.keywords_filter[stable_key] = stable_r
-            self.keywords_filter[unstable_key] = packages.PackageRestriction(
+            keywords_filter[stable_key] = stable_r
+            keywords_filter[unstable_key] = packages.PackageRestriction(
                 "keywords",
                 values.ContainmentMatch(unstable_key))
 
-        profile_evaluate_dict = {}
-        for key, profile_list in profile_filters.iteritems():
-            similar = profile_evaluate_dict[key] = []
-            for profile in profile_list:
-                for existing in similar:
-                    if existing[0].masked_use == profile.masked_use and \
-                            existing[0].forced_use == profile.forced_use:
-                        existing.append(profile)
-                        break
-                else:
-                    similar.append([profile])
-
-        self.profile_evaluate_dict = profile_evaluate_dict
         self.keywords_filter = OrderedDict(
-            (k, self.keywords_filter[k])
-            for k in sorted(self.keywords_filter))
+            (k, keywords_filter[k]) for k in sorted(keywords_filter))
+        self.profile_evaluate_dict = dict(
+            (key, [[profile_filters[key][i] for i in group] for group in groups])
+            for key, groups in evaluate_groups.iteritems())
+        self.visibility_classes = dict(
+            (key, [(profiles[0].visible, frozenset(profiles))
+                   for profiles in classes.itervalues()])
+            for key, classes in visibility_classes.iteritems())
         self.profile_filters = profile_filters
 
     def identify_profiles(self, pkg):
@@ -350,8 +651,14 @@ class ProfileAddon(base.Addon):
             profile_grps = self.profile_evaluate_dict.get(key)
             if profile_grps is None:
                 continue
+            visible = set()
+            for match, profiles in self.visibility_classes[key]:
+                if match(pkg):
+                    visible.update(profiles)
+            if not visible:
+                continue
             for profiles in profile_grps:
-                l2 = [x for x in profiles if x.visible(pkg)]
+                l2 = [x for x in profiles if x in visible]
                 if not l2:
                     continue
                 l.append(l2)
@@ -371,24 +678,37 @@ class EvaluateDepSetAddon(base.Template):
     feed_type = base.versioned_feed
     priority = 1
 
+    # maximum number of evaluated depsets kept around
+    evaluated_cache_size = 10000
+
     def __init__(self, options, profiles):
         base.Addon.__init__(self, options)
         self.pkg_evaluate_depsets_cache = {}
         self.pkg_profiles_cache = {}
+        # (depset, attr, element class, immutable flags, enabled flags) ->
+        # evaluated depset, kept for the whole run since versions of a
+        # package (and often packages of the same category) tend to share
+        # most of their dependencies
+        self.evaluated_cache = OrderedDict()
         self.profiles = profiles
 
     def feed(self, item, reporter):
         self.pkg_evaluate_depsets_cache.clear()
         self.pkg_profiles_cache.clear()
 
+    def feed_batch(self, items, reporter):
+        # caches are keyed by package, so they just hold the entire batch
+        self.pkg_evaluate_depsets_cache.clear()
+        self.pkg_profiles_cache.clear()
+
     def collapse_evaluate_depset(self, pkg, attr, depset):
         depset_profiles = self.pkg_evaluate_depsets_cache.get((pkg, attr))
         if depset_profiles is None:
-            depset_profiles = self.identify_common_depsets(pkg, depset)
+            depset_profiles = self.identify_common_depsets(pkg, attr, depset)
             self.pkg_evaluate_depsets_cache[(pkg, attr)] = depset_profiles
         return depset_profiles
 
-    def identify_common_depsets(self, pkg, depset):
+    def identify_common_depsets(self, pkg, attr, depset):
         profile_grps = self.pkg_profiles_cache.get(pkg, None)
         if profile_grps is None:
             profile_grps = self.profiles.identify_profiles(pkg)
@@ -402,9 +722,120 @@ class EvaluateDepSetAddon(base.Template):
             immutable, enabled = profiles[0].identify_use(pkg, diuse)
             collapsed.setdefault((immutable, enabled), []).extend(profiles)
 
-        return [(depset.evaluate_depset(k[1], tristate_filter=k[0]), v)
+        depset_str = str(depset)
+        return [(self.evaluate_depset(depset, depset_str, attr, *k), v)
                 for k, v in collapsed.iteritems()]
 
+    def evaluate_depset(self, depset, depset_str, attr, immutable, enabled):
+        """Return a depset evaluated for the given use flags, memoized.
+
+        Equal strings parse differently depending on the attribute they were
+        taken from (e.g. SRC_URI vs dependencies), so those are part of the
+        cache key along with the element class.
+        """
+        key = (depset_str, attr, depset.element_class, immutable, enabled)
+        evaluated = self.evaluated_cache.pop(key, None)
+        if evaluated is None:
+            evaluated = depset.evaluate_depset(enabled, tristate_filter=immutable)
+            while len(self.evaluated_cache) >= self.evaluated_cache_size:
+                self.evaluated_cache.popitem(last=False)
+        # (re)insert as the most recently used
+        self.evaluated_cache[key] = evaluated
+        return evaluated
+
+
+class KeywordMatrix(object):
+    """Keyword states of a sequence of package versions.
+
+    Every version gets a bitset of arches per keyword state, bit i standing
+    for the i-th arch known to the :obj:`KeywordsAddon` the matrix was
+    created by. Arches missing from all of a version's bitsets aren't
+    keyworded by it at all.
+
+    :ivar pkgs: the versions, in the order they were passed in
+    :ivar stable: bitsets of the stable keywords of each version
+    :ivar unstable: bitsets of the unstable (~arch) keywords of each version
+    :ivar disabled: bitsets of the disabled (-arch) keywords of each version
+    """
+
+    __slots__ = ('pkgs', 'stable', 'unstable', 'disabled')
+
+    def __init__(self, pkgs, rows):
+        self.pkgs = pkgs
+        if rows:
+            self.stable, self.unstable, self.disabled = zip(*rows)
+        else:
+            self.stable = self.unstable = self.disabled = ()
+
+
+class KeywordsAddon(base.Addon):
+    """Encode the keywords of package versions as arch bitsets.
+
+    Shared between the stabilization checks, so each package's keywords only
+    get parsed once and comparing them across arches boils down to integer
+    operations in place of per arch set operations and restriction matches.
+    """
+
+    def __init__(self, options, *args):
+        base.Addon.__init__(self, options)
+        # bit index -> arch name
+        self.arches = []
+        # arch name -> bit
+        self._bits = {}
+        # KEYWORDS -> (stable, unstable, disabled) bitsets
+        self._keywords = {}
+        self._pkgs = self._matrix = None
+
+    def _bit(self, arch):
+        bit = self._bits.get(arch)
+        if bit is None:
+            bit = self._bits[arch] = 1 << len(self.arches)
+            self.arches.append(arch)
+        return bit
+
+    def mask(self, arches):
+        """Return the bitset of arches, ignoring ~ and - prefixes."""
+        bits = 0
+        for arch in arches:
+            bits |= self._bit(arch.lstrip("~-"))
+        return bits
+
+    def names(self, bits):
+        """Return the sorted names of the arches in a bitset."""
+        names = []
+        while bits:
+            lowest = bits & -bits
+            names.append(self.arches[lowest.bit_length() - 1])
+            bits ^= lowest
+        return sorted(names)
+
+    def encode(self, keywords):
+        """Return the (stable, unstable, disabled) bitsets of keywords."""
+        row = self._keywords.get(keywords)
+        if row is None:
+            stable = unstable = disabled = 0
+            for keyword in keywords:
+                if keyword[0] == "~":
+                    unstable |= self._bit(keyword[1:])
+                elif keyword[0] == "-":
+                    disabled |= self._bit(keyword[1:])
+                else:
+                    stable |= self._bit(keyword)
+            row = self._keywords[keywords] = (stable, unstable, disabled)
+        return row
+
+    def matrix(self, pkgs):
+        """Return the :obj:`KeywordMatrix` of a sequence of versions.
+
+        The matrix of the last sequence is kept around, so checks fed the
+        same package share it.
+        """
+        if pkgs is not self._pkgs:
+            self._matrix = KeywordMatrix(
+                pkgs, [self.encode(pkg.keywords) for pkg in pkgs])
+            self._pkgs = pkgs
+        return self._matrix
+
 
 class StableCheckAddon(base.Template):
 
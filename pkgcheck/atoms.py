@@ -0,0 +1,93 @@
+# License: BSD/GPL2
+
+"""Process-wide cache of parsed atoms.
+
+The same atoms get created over and over across a run, e.g. for ebuild file
+names, package references in metadata.xml files and dependencies stripped of
+their USE deps. Atoms are immutable, so parsing each distinct string once and
+sharing the resulting instances saves both the parsing and the memory of
+duplicate instances.
+"""
+
+from collections import OrderedDict
+
+from pkgcore.ebuild.atom import MalformedAtom, atom
+
+
+def _strip_use(inst):
+    if '=*' == inst.op:
+        s = '=%s*' % inst.cpvstr
+    else:
+        s = inst.op + inst.cpvstr
+    if inst.blocks:
+        s = '!' + s
+        if not inst.blocks_temp_ignorable:
+            s = '!' + s
+    if inst.slot:
+        s += ':%s' % inst.slot
+    return atom(s)
+
+
+class AtomCache(object):
+    """Bounded mappings of strings to atoms and atoms to USE-stripped atoms.
+
+    Each mapping holds at most max_size entries, the least recently used
+    ones get evicted first.
+
+    :ivar hits: number of lookups of cached entries
+    :ivar misses: number of lookups of uncached entries
+    :ivar evictions: number of entries evicted due to the size limit
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.hits = self.misses = self.evictions = 0
+        self._atoms = OrderedDict()
+        self._stripped = OrderedDict()
+
+    def __len__(self):
+        return len(self._atoms) + len(self._stripped)
+
+    def _lookup(self, entries, key, create):
+        try:
+            value = entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            try:
+                value = create(key)
+            except MalformedAtom as e:
+                # invalid strings are just as likely to be repeated
+                value = e
+            if self.max_size is not None:
+                while len(entries) >= self.max_size:
+                    entries.popitem(last=False)
+                    self.evictions += 1
+        else:
+            self.hits += 1
+        # (re)insert as the most recently used
+        entries[key] = value
+        if isinstance(value, MalformedAtom):
+            raise value
+        return value
+
+    def atom(self, s):
+        """Return the atom for a string, see :obj:`pkgcore.ebuild.atom.atom`."""
+        return self._lookup(self._atoms, s, atom)
+
+    def strip_use(self, inst):
+        """Return an atom with its USE deps removed."""
+        if not inst.use:
+            return inst
+        return self._lookup(self._stripped, inst, _strip_use)
+
+    def clear(self):
+        self._atoms.clear()
+        self._stripped.clear()
+
+    def __str__(self):
+        return 'atom cache: %i hits, %i misses, %i evictions' % (
+            self.hits, self.misses, self.evictions)
+
+
+# shared by everything in the process
+cache = AtomCache(max_size=100000)
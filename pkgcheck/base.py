@@ -13,6 +13,13 @@ but do not rely on that either.
 Feed types have to match exactly. Scopes are ordered: they define a
 minimally accepted scope, and for transforms the output scope is
 identical to the input scope.
+
+The repository feed is streamed: instead of being handed the entire repo
+at once, sinks get fed each chunk of it (a tuple of package versions
+covering one or more complete packages) as it arrives. Their start() and
+finish() methods mark the beginning and end of the repo, so anything
+needing the whole repo has to gather what it needs while being fed and
+report from finish().
 """
 
 from operator import attrgetter
@@ -21,6 +28,7 @@ from pkgcore.config import ConfigHint
 from snakeoil.demandload import demandload
 
 demandload(
+    'heapq',
     'itertools:chain',
     'logging',
     're',
@@ -111,9 +119,53 @@ class Template(Addon):
     def feed(self, item, reporter):
         raise NotImplementedError
 
+    def feed_batch(self, items, reporter):
+        """Feed a sequence of items at once.
+
+        Batches always consist of complete packages (usually an entire
+        category worth). This default feeds each item separately, checks
+        doing a lot of per item work can override it to avoid the overhead;
+        overrides have to log and skip items raising exceptions the same way
+        so one broken package doesn't abort the check for the entire batch.
+        """
+        for item in items:
+            try:
+                self.feed(item, reporter)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception:
+                logging.exception('check %r raised', self)
+
     def finish(self, reporter):
         """Do cleanup and omit final results here."""
 
+    # Checks that gather state over the whole run but can combine the state
+    # gathered over separate parts of the input set this and implement
+    # partial_state()/merge_state(), allowing them to be run over shards.
+    mergeable = False
+
+    def partial_state(self):
+        """Return the state gathered from the items fed since start().
+
+        Must be picklable. Only called for mergeable checks.
+        """
+        raise NotImplementedError(self.partial_state)
+
+    def merge_state(self, state):
+        """Merge state returned by partial_state() into this instance.
+
+        Merging has to be associative so the order and grouping of shards
+        doesn't matter; finish() is called to report once everything has
+        been merged.
+        """
+        raise NotImplementedError(self.merge_state)
+
+    # Version and package scope checks whose results for a package only
+    # depend on the files in its directory, the eclasses it inherits and the
+    # arch/profile selection set this, allowing their results to be reused
+    # for unchanged packages (see pkgcheck.result_cache).
+    cacheable = False
+
 
 class Transform(object):
     """Base class for a feed type transformer.
@@ -134,6 +186,11 @@ class Transform(object):
     def feed(self, item, reporter):
         raise NotImplementedError
 
+    def feed_batch(self, items, reporter):
+        """Feed a sequence of items at once, see :obj:`Template.feed_batch`."""
+        for item in items:
+            self.feed(item, reporter)
+
     def finish(self, reporter):
         """Clean up."""
         self.child.finish(reporter)
@@ -350,6 +407,15 @@ class CheckRunner(object):
             except Exception:
                 logging.exception('check %r raised', check)
 
+    def feed_batch(self, items, reporter):
+        for check in self.checks:
+            try:
+                check.feed_batch(items, reporter)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception:
+                logging.exception('check %r raised', check)
+
     def finish(self, reporter):
         for check in self.checks:
             try:
@@ -373,6 +439,113 @@ class CheckRunner(object):
             sorted(str(check) for check in self.checks)))
 
 
+# Plans are cached based on the signatures of what's being plugged together,
+# sinks and sources with the same feed type and scope are interchangeable.
+_plan_cache = {}
+
+
+def _shortest_paths(source, transforms):
+    """Find the cheapest way to reach every feed type from a source.
+
+    :return: mapping of reachable feed types to (cost, transform used to
+        reach the feed type or None for the source's feed type)
+    """
+    paths = {source.feed_type: (source.cost, None)}
+    queue = [(source.cost, 0, source.feed_type)]
+    feed_to_transforms = {}
+    for i, transform in enumerate(transforms):
+        if transform.scope <= source.scope:
+            feed_to_transforms.setdefault(transform.source, []).append(
+                (i, transform))
+    done = set()
+    while queue:
+        cost, _, feed_type = heapq.heappop(queue)
+        if feed_type in done:
+            continue
+        done.add(feed_type)
+        for i, transform in feed_to_transforms.get(feed_type, ()):
+            new_cost = cost + transform.cost
+            current = paths.get(transform.dest)
+            if current is None or new_cost < current[0]:
+                paths[transform.dest] = (new_cost, transform)
+                heapq.heappush(queue, (new_cost, i + 1, transform.dest))
+    return paths
+
+
+def _plan(sinks, transforms, sources, debug):
+    """Determine which sources and transforms to use for which sinks.
+
+    Every source gets the shortest path to each feed type it can reach
+    determined, using only transforms suited for the source's scope. If a
+    single source can reach all sinks the cheapest of those is used,
+    otherwise sources are picked greedily until all reachable sinks are
+    covered. Paths from a source to the sinks it drives are combined into a
+    tree, only using the shortest path to each feed type keeps them loop free.
+
+    :return: sequence of indices of unreachable sinks,
+        sequence of (source index, transforms used, sink indices) tuples
+    """
+    paths = [_shortest_paths(source, transforms) for source in sources]
+
+    def reachable(sink, i):
+        return (sink.feed_type in paths[i] and
+                sink.scope <= sources[i].scope)
+
+    bad_sinks = []
+    good_sinks = []
+    for i, sink in enumerate(sinks):
+        if any(reachable(sink, j) for j in xrange(len(sources))):
+            good_sinks.append(i)
+        else:
+            bad_sinks.append(i)
+    if not good_sinks:
+        return bad_sinks, ()
+
+    def tree(i, sink_indices):
+        """Return the transforms and cost of a source driving some sinks."""
+        used = set()
+        cost = sources[i].cost
+        for feed_type in set(sinks[x].feed_type for x in sink_indices):
+            transform = paths[i][feed_type][1]
+            while transform is not None and transform not in used:
+                used.add(transform)
+                cost += transform.cost
+                transform = paths[i][transform.source][1]
+        # keep the original transform order so pipelines are deterministic
+        return tuple(x for x in transforms if x in used), cost
+
+    # Use a single pipeline if possible, even if using multiple would be
+    # cheaper overall.
+    best = None
+    for i in xrange(len(sources)):
+        if all(reachable(sinks[x], i) for x in good_sinks):
+            used, cost = tree(i, good_sinks)
+            if debug is not None:
+                debug('single pipe from %r costs %r', sources[i], cost)
+            if best is None or cost < best[1]:
+                best = ((i, used, good_sinks), cost)
+    if best is not None:
+        return bad_sinks, (best[0],)
+
+    plan = []
+    remaining = list(good_sinks)
+    while remaining:
+        best = None
+        for i in xrange(len(sources)):
+            covered = [x for x in remaining if reachable(sinks[x], i)]
+            if not covered:
+                continue
+            used, cost = tree(i, covered)
+            # prefer covering more sinks, then the cheaper pipeline
+            if best is None or (-len(covered), cost) < best[0]:
+                best = ((-len(covered), cost), (i, used, covered))
+        if debug is not None:
+            debug('using pipe %r for %r', sources[best[1][0]], best[1][2])
+        plan.append(best[1])
+        remaining = [x for x in remaining if x not in best[1][2]]
+    return bad_sinks, tuple(plan)
+
+
 def plug(sinks, transforms, sources, debug=None):
     """Plug together a pipeline.
 
@@ -388,174 +561,42 @@ def plug(sinks, transforms, sources, debug=None):
         missing sources/transforms of the right type),
         a sequence of (source, consumer) tuples.
     """
-
-    # This is not optimized to deal with huge numbers of sinks,
-    # sources and transforms, but that should not matter (although it
-    # may be necessary to handle a lot of sinks a bit better at some
-    # point, which should be fairly easy since we only care about
-    # their type and scope).
-
     assert sinks
 
-    feed_to_transforms = {}
-    for transform in transforms:
-        feed_to_transforms.setdefault(transform.source, []).append(transform)
-
-    # Map from typename to best scope
-    best_scope = {}
-    for source in sources:
-        # (not particularly clever, if we get a ton of sources this
-        # should be optimized to do less duplicate work).
-        reachable = set()
-        todo = set([source.feed_type])
-        while todo:
-            feed_type = todo.pop()
-            reachable.add(feed_type)
-            for transform in feed_to_transforms.get(feed_type, ()):
-                if transform.scope <= source.scope and \
-                        transform.dest not in reachable:
-                    todo.add(transform.dest)
-        for feed_type in reachable:
-            scope = best_scope.get(feed_type)
-            if scope is None or scope < source.scope:
-                best_scope[feed_type] = source.scope
-
-    # Throw out unreachable sinks.
-    good_sinks = []
-    bad_sinks = []
-    for sink in sinks:
-        scope = best_scope.get(sink.feed_type)
-        if scope is None or sink.scope > scope:
-            bad_sinks.append(sink)
-        else:
-            good_sinks.append(sink)
-
-    if not good_sinks:
-        # No point in continuing.
-        return bad_sinks, ()
-
-    # Throw out all sources with a scope lower than the least required scope.
-    # Does not check transform requirements, may not be very useful.
-    lowest_required_scope = min(sink.scope for sink in good_sinks)
-    highest_required_scope = max(sink.scope for sink in good_sinks)
-    sources = list(s for s in sources if s.scope >= lowest_required_scope)
-    if not sources:
-        # No usable sources, abort.
-        return bad_sinks + good_sinks, ()
-
-    # All types we need to reach.
-    sink_types = set(sink.feed_type for sink in good_sinks)
-
-    # Map from scope, source typename to cheapest source.
+    # Only keep the cheapest source per scope and feed type.
     source_map = {}
     for new_source in sources:
         current_source = source_map.get((new_source.scope,
                                          new_source.feed_type))
         if current_source is None or current_source.cost > new_source.cost:
             source_map[new_source.scope, new_source.feed_type] = new_source
-
-    # Tuples of (visited_types, source, transforms, price)
-    pipes = set()
-    unprocessed = set(
-        (frozenset((source.feed_type,)), source, frozenset(), source.cost)
-        for source in source_map.itervalues())
-    if debug is not None:
-        for pipe in unprocessed:
-            debug('initial: %r', pipe)
-
-    # If we find a single pipeline driving all sinks we want to use it.
-    # List of tuples of source, transforms.
-    pipes_to_run = None
-    best_cost = None
-    while unprocessed:
-        next = unprocessed.pop()
-        if next in pipes:
-            continue
-        pipes.add(next)
-        visited, source, trans, cost = next
-        if visited >= sink_types:
-            # Already reaches all sink types. Check if it is usable as
-            # single pipeline:
-            if best_cost is None or cost < best_cost:
-                pipes_to_run = [(source, trans)]
-                best_cost = cost
-            # No point in growing this further: it already reaches everything.
-            continue
-        if best_cost is not None and best_cost <= cost:
-            # No point in growing this further.
-            continue
-        for transform in transforms:
-            if source.scope >= transform.scope and \
-                    transform.source in visited and \
-                    transform.dest not in visited:
-                unprocessed.add((
-                    visited.union((transform.dest,)), source,
-                    trans.union((transform,)), cost + transform.cost))
-                if debug is not None:
-                    debug(
-                        'growing %r for %r with %r', trans, source, transform)
-
-    if pipes_to_run is None:
-        # No single pipe will drive everything, try combining pipes.
-        # This is pretty stupid but effective. Map sources to
-        # pipelines they drive, try combinations of sources (using a
-        # source more than once in a combination makes no sense since
-        # we also have the "combined" pipeline in pipes).
-        source_to_pipes = {}
-        for visited, source, trans, cost in pipes:
-            source_to_pipes.setdefault(source, []).append(
-                (visited, trans, cost))
-        unprocessed = set(
-            (visited, frozenset([source]), ((source, trans),), cost)
-            for visited, source, trans, cost in pipes)
-        done = set()
-        while unprocessed:
-            next = unprocessed.pop()
-            if next in done:
-                continue
-            done.add(next)
-            visited, sources, seq, cost = next
-            if visited >= sink_types:
-                # This combination reaches everything.
-                if best_cost is None or cost < best_cost:
-                    pipes_to_run = seq
-                    best_cost = cost
-                # No point in growing this further.
-            if best_cost is not None and best_cost <= cost:
-                # No point in growing this further.
-                continue
-            for source, source_pipes in source_to_pipes.iteritems():
-                if source not in sources:
-                    for new_visited, trans, new_cost in source_pipes:
-                        unprocessed.add((
-                            visited.union(new_visited),
-                            sources.union([source]),
-                            seq + ((source, trans),),
-                            cost + new_cost))
-
-    # Just an assert since unreachable sinks should have been thrown away.
-    assert pipes_to_run, 'did not find a solution?'
-
-    good_sinks.sort(key=attrgetter('priority'))
-
-    def build_transform(scope, feed_type, transforms):
+    sources = [source for source in sources
+               if source_map[source.scope, source.feed_type] is source]
+
+    key = (tuple((sink.feed_type, sink.scope) for sink in sinks),
+           frozenset(transforms),
+           tuple((source.feed_type, source.scope, source.cost)
+                 for source in sources))
+    plan = _plan_cache.get(key)
+    if plan is None:
+        plan = _plan_cache[key] = _plan(sinks, transforms, sources, debug)
+    elif debug is not None:
+        debug('using cached plan %r', plan)
+    bad_sinks, pipes = plan
+
+    def build_transform(feed_type, transforms, good_sinks):
         children = list(
-            # Note this relies on the cheapest pipe not having
-            # any "loops" in its transforms.
-            trans(build_transform(scope, trans.dest, transforms))
-            for trans in transforms
-            if trans.source == feed_type and trans.scope <= scope)
-        # Hacky: we modify this in place.
-        for i in reversed(xrange(len(good_sinks))):
-            sink = good_sinks[i]
-            if sink.feed_type == feed_type and sink.scope <= source.scope:
-                children.append(sink)
-                del good_sinks[i]
+            trans(build_transform(trans.dest, transforms, good_sinks))
+            for trans in transforms if trans.source == feed_type)
+        # Highest priority sinks first.
+        children.extend(reversed(
+            [sink for sink in good_sinks if sink.feed_type == feed_type]))
         return CheckRunner(children)
 
-    result = list(
-        (source, build_transform(source.scope, source.feed_type, transforms))
-        for source, transforms in pipes_to_run)
-
-    assert not good_sinks, 'sinks left: %r' % (good_sinks,)
-    return bad_sinks, result
+    result = []
+    for i, used, sink_indices in pipes:
+        good_sinks = sorted(
+            (sinks[x] for x in sink_indices), key=attrgetter('priority'))
+        result.append((sources[i], build_transform(
+            sources[i].feed_type, used, good_sinks)))
+    return [sinks[i] for i in bad_sinks], result
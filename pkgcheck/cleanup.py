@@ -34,6 +34,7 @@ class RedundantVersionReport(Template):
     """
 
     feed_type = package_feed
+    cacheable = True
     known_results = (RedundantVersion,)
 
     def feed(self, pkgset, reporter):
@@ -34,6 +34,7 @@ class BadInsIntoCheck(base.Template):
     """checking ebuild for bad insinto usage"""
 
     feed_type = base.ebuild_feed
+    cacheable = True
     _bad_insinto = None
     _bad_etc = ("conf", "env", "init", "pam")
     _bad_cron = ("hourly", "daily", "weekly", "d")
@@ -25,6 +25,7 @@ class DeprecatedEAPI(Warning):
 class DeprecatedEAPIReport(Template):
 
     feed_type = versioned_feed
+    cacheable = True
     known_results = (DeprecatedEAPI,)
 
     __doc__ = "scan for deprecated EAPIs"
@@ -61,6 +62,7 @@ class DeprecatedEclass(Warning):
 class DeprecatedEclassReport(Template):
 
     feed_type = versioned_feed
+    cacheable = True
     known_results = (DeprecatedEclass,)
 
     blacklist = ImmutableDict({
@@ -1,8 +1,7 @@
 # Copyright: 2006 Brian Harring <ferringb@gmail.com>
 # License: BSD/GPL2
 
-from collections import defaultdict
-
+from pkgcheck.addons import KeywordsAddon
 from pkgcheck.base import Template, package_feed, versioned_feed, Warning
 
 
@@ -27,39 +26,37 @@ class DroppedKeywordsReport(Template):
     """scan pkgs for keyword dropping across versions"""
 
     feed_type = package_feed
+    cacheable = True
+    required_addons = (KeywordsAddon,)
     known_results = (DroppedKeyword,)
 
-    def __init__(self, options):
+    def __init__(self, options, keywords):
         Template.__init__(self, options)
-        self.arches = frozenset(options.arches)
+        self.keywords = keywords
+        self.arches = keywords.mask(options.arches)
 
     def feed(self, pkgset, reporter):
+        matrix = self.keywords.matrix(pkgset)
         # We need to skip live ebuilds otherwise they're flagged. Currently, we
         # assume live ebuilds have versions matching *9999*.
-        pkgset = [pkg for pkg in pkgset if "9999" not in pkg.version]
+        rows = [(pkg, stable | unstable, disabled)
+                for pkg, stable, unstable, disabled in zip(
+                    pkgset, matrix.stable, matrix.unstable, matrix.disabled)
+                if "9999" not in pkg.version]
 
-        if len(pkgset) <= 1:
+        if len(rows) <= 1:
             return
 
-        lastpkg = pkgset[-1]
-        state = set(x.lstrip("~") for x in lastpkg.keywords)
-        arches = set(self.arches)
-        dropped = defaultdict(list)
+        lastpkg, state, state_disabled = rows[-1]
+        arches = self.arches
         # pretty simple; pull the last keywords, walk backwards
         # the difference (ignoring unstable/stable) should be empty;
         # if it is, report; meanwhile, add the new arch in, and continue
-        for pkg in reversed(pkgset):
-            oldstate = set(x.lstrip("~") for x in pkg.keywords)
-            for key in oldstate.difference(state):
-                if key.startswith("-"):
-                    continue
-                elif "-%s" % key in state:
-                    continue
-                elif key in arches:
-                    dropped[lastpkg].append(key)
-                    arches.discard(key)
-            state = oldstate
+        for pkg, keyworded, disabled in reversed(rows[:-1]):
+            dropped = keyworded & ~state & ~state_disabled & arches
+            if dropped:
+                reporter.add_report(
+                    DroppedKeyword(lastpkg, self.keywords.names(dropped)))
+                arches &= ~dropped
+            state, state_disabled = keyworded, disabled
             lastpkg = pkg
-
-        for pkg in dropped.iterkeys():
-            reporter.add_report(DroppedKeyword(pkg, dropped[pkg]))
@@ -0,0 +1,195 @@
+# License: BSD/GPL2
+
+"""Persistent index of the eclasses inherited by each package of a repo.
+
+Finding the packages inheriting an eclass normally requires loading the
+metadata of every package in the repo. The index stores the eclasses
+inherited by each version along with the size and modification time of its
+ebuild and metadata cache entry, so updating it only needs to reload the
+metadata of versions that changed since.
+
+Content hashes of all eclasses available to the repo are stored as well,
+making it possible to tell which eclasses were edited since they were last
+recorded as a baseline and thus the minimal set of packages affected by those
+edits. The baseline only moves forward when asked to, so saving the rest of
+the index doesn't lose track of changes that haven't been dealt with yet.
+"""
+
+import errno
+import os
+
+from pkgcore.package.errors import MetadataException
+from snakeoil.demandload import demandload
+
+demandload(
+    'hashlib',
+    'pkgcore.ebuild.cpv:versioned_CPV',
+    'pkgcore.restrictions:packages',
+    'snakeoil:pickling',
+    'snakeoil.osutils:listdir_files,pjoin',
+)
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except EnvironmentError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+class EclassIndex(object):
+    """Mapping of eclasses to the packages inheriting them.
+
+    :ivar reloaded: number of versions whose metadata got loaded by the
+        last update
+    """
+
+    format_version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.reloaded = 0
+        # cpvstr -> (ebuild and cache entry stats, inherited eclasses)
+        self._versions = {}
+        # eclass name -> content hash
+        self._eclasses = {}
+        # eclass hashes of the baseline, None if it was never saved
+        self._saved_eclasses = None
+        # eclass path -> (mtime, size, content hash)
+        self._file_hashes = {}
+        # eclass name -> package keys, built on demand
+        self._packages = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickling.load(f)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        except Exception:
+            # corrupted or written by an incompatible version, start over
+            return
+        version, versions, eclasses, file_hashes = data
+        if version != self.format_version:
+            return
+        self._versions = versions
+        self._packages = None
+        self._eclasses = self._saved_eclasses = eclasses
+        self._file_hashes = file_hashes
+
+    def save(self, advance=True):
+        """Write the index out.
+
+        :param advance: make the current eclasses the baseline
+            :obj:`changed_eclasses` compares against, otherwise the baseline
+            is kept as is. A new index always gets the current eclasses as
+            its baseline.
+        """
+        if advance or self._saved_eclasses is None:
+            baseline = self._eclasses
+        else:
+            baseline = self._saved_eclasses
+        data = (self.format_version, self._versions, baseline,
+                self._file_hashes)
+        tmp = '%s.%i' % (self.path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickling.dump(data, f, -1)
+        os.rename(tmp, self.path)
+        self._saved_eclasses = baseline
+
+    def _file_hash(self, path):
+        st = _stat(path)
+        if st is None:
+            return None
+        cached = self._file_hashes.get(path)
+        if cached is not None and cached[:2] == st:
+            return cached[2]
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        self._file_hashes[path] = st + (digest,)
+        return digest
+
+    def update(self, repo):
+        """Bring the index up to date with the current state of a repo."""
+        cache_dir = pjoin(repo.location, 'metadata', 'md5-cache')
+        versions = {}
+        self.reloaded = 0
+        for pkg in repo.itermatch(packages.AlwaysTrue):
+            stats = (_stat(pkg.path), _stat(pjoin(cache_dir, pkg.cpvstr)))
+            entry = self._versions.get(pkg.cpvstr)
+            # without a stat for the ebuild there's no telling if it changed
+            if entry is None or entry[0] != stats or stats[0] is None:
+                try:
+                    inherited = tuple(pkg.inherited)
+                except MetadataException:
+                    # broken packages get reported by the scan itself
+                    inherited = ()
+                entry = (stats, inherited)
+                self.reloaded += 1
+            versions[pkg.cpvstr] = entry
+        self._versions = versions
+        self._packages = None
+
+        # eclasses of repos later in the list override earlier ones
+        eclasses = {}
+        file_hashes = {}
+        for tree in getattr(repo, 'trees', (repo,)):
+            eclass_dir = pjoin(tree.location, 'eclass')
+            try:
+                names = listdir_files(eclass_dir)
+            except EnvironmentError:
+                continue
+            for name in names:
+                if not name.endswith('.eclass'):
+                    continue
+                path = pjoin(eclass_dir, name)
+                digest = self._file_hash(path)
+                if digest is not None:
+                    eclasses[name[:-len('.eclass')]] = digest
+                    file_hashes[path] = self._file_hashes[path]
+        self._eclasses = eclasses
+        # drop removed eclasses
+        self._file_hashes = file_hashes
+
+    def changed_eclasses(self):
+        """Return the eclasses added, removed or edited since the baseline.
+
+        Nothing is considered changed for a newly created index.
+        """
+        if self._saved_eclasses is None:
+            return frozenset()
+        names = set(self._eclasses).union(self._saved_eclasses)
+        return frozenset(
+            name for name in names
+            if self._eclasses.get(name) != self._saved_eclasses.get(name))
+
+    def inheriting(self, eclasses):
+        """Return the keys of the packages inheriting any of the given eclasses."""
+        if self._packages is None:
+            self._packages = {}
+            for cpvstr, (_stats, inherited) in self._versions.iteritems():
+                key = versioned_CPV(cpvstr).key
+                for eclass in inherited:
+                    self._packages.setdefault(eclass, set()).add(key)
+        return frozenset().union(
+            *[self._packages.get(eclass, ()) for eclass in eclasses])
+
+    def restrict(self, repo, eclasses):
+        """Return a restriction matching the packages inheriting eclasses.
+
+        :return: a restriction or None if no packages inherit them.
+        """
+        keys = self.inheriting(eclasses)
+        if not keys:
+            return None
+        return packages.OrRestriction(*[
+            repo.path_restrict(pjoin(repo.location, key))
+            for key in sorted(keys)])
+
+    def __str__(self):
+        return 'eclass index: %i versions, %i reloaded' % (
+            len(self._versions), self.reloaded)
@@ -6,3 +6,7 @@
 
 class ReporterInitError(Exception):
     """Raise this if a reporter factory fails."""
+
+
+class GitError(Exception):
+    """Raise this if querying git for changes fails."""
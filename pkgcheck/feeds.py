@@ -3,12 +3,21 @@
 
 """Feed classes: pass groups of packages to other addons."""
 
+from collections import deque
+from itertools import chain, groupby, islice
 from operator import attrgetter
 
-from pkgcore.restrictions import util
+from pkgcore.restrictions import packages, util, values
+from snakeoil.demandload import demandload
 
 from pkgcheck import base
 
+demandload(
+    'time',
+    'multiprocessing.pool:ThreadPool',
+    'snakeoil.osutils:pjoin',
+)
+
 
 class VersionToEbuild(base.Transform):
     """Convert from just a package to a (package, list_of_lines) tuple."""
@@ -21,6 +30,10 @@ class VersionToEbuild(base.Transform):
     def feed(self, pkg, reporter):
         self.child.feed((pkg, tuple(pkg.ebuild.text_fileobj())), reporter)
 
+    def feed_batch(self, pkgs, reporter):
+        self.child.feed_batch(
+            [(pkg, tuple(pkg.ebuild.text_fileobj())) for pkg in pkgs], reporter)
+
 
 class EbuildToVersion(base.Transform):
     """Convert (package, list_of_lines) to just package."""
@@ -33,6 +46,9 @@ class EbuildToVersion(base.Transform):
     def feed(self, pair, reporter):
         self.child.feed(pair[0], reporter)
 
+    def feed_batch(self, pairs, reporter):
+        self.child.feed_batch([pair[0] for pair in pairs], reporter)
+
 
 class _Collapse(base.Transform):
     """Collapse the input into tuples with a function returning the same val.
@@ -60,6 +76,17 @@ class _Collapse(base.Transform):
             self.chunk = [pkg]
             self.key = key
 
+    def feed_batch(self, pkgs, reporter):
+        # Batches are made up of complete categories, so anything left over
+        # from single feeds is complete and nothing spills into the next one.
+        if self.chunk is not None:
+            self.child.feed(tuple(self.chunk), reporter)
+            self.chunk = None
+            self.key = None
+        chunks = [tuple(g) for k, g in groupby(pkgs, self.keyfunc)]
+        if chunks:
+            self.child.feed_batch(chunks, reporter)
+
     def finish(self, reporter):
         # Deal with empty runs.
         if self.chunk is not None:
@@ -90,18 +117,17 @@ class VersionToCategory(_Collapse):
 
 
 class _PackageOrCategoryToRepo(base.Transform):
+    """Stream package or category chunks to repository feed sinks.
 
-    def start(self):
-        base.Transform.start(self)
-        self.repo = []
+    Nothing is buffered here, see the repository feed notes in
+    :obj:`pkgcheck.base` for what sinks get fed.
+    """
 
     def feed(self, item, reporter):
-        self.repo.append(item)
+        self.child.feed(item, reporter)
 
-    def finish(self, reporter):
-        self.child.feed(self.repo, reporter)
-        base.Transform.finish(self, reporter)
-        self.repo = None
+    def feed_batch(self, items, reporter):
+        self.child.feed_batch(items, reporter)
 
 
 class PackageToRepo(_PackageOrCategoryToRepo):
@@ -142,6 +168,17 @@ class PackageToCategory(base.Transform):
             self.chunk = list(item)
             self.category = category
 
+    def feed_batch(self, items, reporter):
+        # see _Collapse.feed_batch
+        if self.chunk is not None:
+            self.child.feed(tuple(self.chunk), reporter)
+            self.chunk = None
+            self.category = None
+        chunks = [tuple(chain.from_iterable(g))
+                  for k, g in groupby(items, lambda x: x[0].category)]
+        if chunks:
+            self.child.feed_batch(chunks, reporter)
+
     def finish(self, reporter):
         if self.chunk is not None:
             self.child.feed(tuple(self.chunk), reporter)
@@ -150,6 +187,124 @@ class PackageToCategory(base.Transform):
         self.chunk = None
 
 
+def category_batches(pkgs):
+    """Split a stream of packages into lists of packages per category.
+
+    These are what pipelines get fed using their feed_batch() methods.
+    """
+    for category, batch in groupby(pkgs, attrgetter('category')):
+        yield list(batch)
+
+
+def _pkg_paths(pkg):
+    """Return the paths of the files a package's metadata and ebuild text get
+    loaded from.
+
+    Resolving these may set attributes on the package, so this has to happen
+    in the main thread.
+    """
+    paths = [pkg.path]
+    for cache in getattr(pkg._parent, '_cache', None) or ():
+        location = getattr(cache, 'location', None)
+        if location is not None:
+            paths.append(pjoin(location, pkg.cpvstr))
+    return paths
+
+
+def _warm_paths(paths):
+    """Pull files into the OS caches.
+
+    Only the raw files are read, parsing is left to the main thread since
+    regenerating metadata or setting package attributes isn't thread-safe.
+    """
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                while f.read(65536):
+                    pass
+        except EnvironmentError:
+            # missing cache entries and the like get dealt with later on
+            pass
+
+
+class Prefetcher(object):
+    """Warm up packages in background threads ahead of them being fed.
+
+    The files to warm up for each package are determined in the main thread,
+    the threads only get handed what paths returns for it. Failures while
+    warming up a package are ignored, it gets fed regardless.
+
+    :ivar window: number of packages to keep prefetched ahead of the
+        currently fed one, 0 disables prefetching.
+    :ivar hits: number of packages already warmed up when they were needed
+    :ivar stalls: number of packages that had to be waited on
+    :ivar stall_time: total seconds spent waiting on stalled packages
+    """
+
+    def __init__(self, window, threads=4, paths=_pkg_paths, warm=_warm_paths):
+        self.window = window
+        self.threads = max(1, min(window, threads))
+        self.paths = paths
+        self.warm = warm
+        self.hits = self.stalls = 0
+        self.stall_time = 0.0
+        self._pool = None
+
+    def __call__(self, pkgs):
+        """Return an iterator over pkgs, prefetching ahead of it."""
+        if not self.window:
+            return iter(pkgs)
+        if self._pool is None:
+            self._pool = ThreadPool(self.threads)
+        return self._prefetch(iter(pkgs))
+
+    def _submit(self, pkg):
+        return pkg, self._pool.apply_async(self.warm, (self.paths(pkg),))
+
+    def _prefetch(self, pkgs):
+        pending = deque(self._submit(pkg) for pkg in islice(pkgs, self.window))
+        while pending:
+            pkg, result = pending.popleft()
+            if result.ready():
+                self.hits += 1
+            else:
+                self.stalls += 1
+                start = time.time()
+                result.wait()
+                self.stall_time += time.time() - start
+            for next_pkg in islice(pkgs, 1):
+                pending.append(self._submit(next_pkg))
+            yield pkg
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __str__(self):
+        return ('prefetched %i packages: %i hits, %i stalls (%.2fs stalled)'
+                % (self.hits + self.stalls, self.hits, self.stalls,
+                   self.stall_time))
+
+
+def restriction_scope(limiter):
+    """Return the scope of the packages matched by a restriction."""
+    for scope, attrs in ((base.version_scope, ['fullver', 'version', 'rev']),
+                         (base.package_scope, ['package']),
+                         (base.category_scope, ['category'])):
+        if any(util.collect_package_restrictions(limiter, attrs)):
+            return scope
+    return base.repository_scope
+
+
+def _key_restrict(key):
+    category, package = key.split('/', 1)
+    return packages.AndRestriction(
+        packages.PackageRestriction('category', values.StrExactMatch(category)),
+        packages.PackageRestriction('package', values.StrExactMatch(package)))
+
+
 class RestrictedRepoSource(object):
 
     feed_type = base.versioned_feed
@@ -158,13 +313,133 @@ class RestrictedRepoSource(object):
     def __init__(self, repo, limiter):
         self.repo = repo
         self.limiter = limiter
-        for scope, attrs in ((base.version_scope, ['fullver', 'version', 'rev']),
-                             (base.package_scope, ['package']),
-                             (base.category_scope, ['category'])):
-            if any(util.collect_package_restrictions(limiter, attrs)):
-                self.scope = scope
-                return
-        self.scope = base.repository_scope
+        self.scope = restriction_scope(limiter)
 
     def feed(self):
         return self.repo.itermatch(self.limiter, sorter=sorted)
+
+    def itertargets(self):
+        """Yield (target restriction, packages) pairs in feed order."""
+        yield self.limiter, self.feed()
+
+    def shards(self):
+        """Split the source into independent chunks, one per category.
+
+        Only categories the limiter can match get a shard.
+        """
+        if self.scope == base.repository_scope:
+            return sorted(self.repo.categories)
+        category = getattr(self.limiter, 'category', None)
+        if category is not None:
+            return [category] if category in self.repo.categories else []
+        # no package metadata is needed to match these
+        return sorted(set(
+            pkg.category for pkg in self.repo.itermatch(self.limiter)))
+
+    def shard_feed(self, category):
+        """Return the part of feed() inside the given category."""
+        restrict = packages.AndRestriction(
+            self.limiter,
+            packages.PackageRestriction('category', values.StrExactMatch(category)))
+        return self.repo.itermatch(restrict, sorter=sorted)
+
+
+class CombinedRepoSource(object):
+    """Feed the packages matched by multiple limiters in a single pass.
+
+    Limiters matching a single package key (plain atoms) are indexed by
+    that key and combined into a single target per key. Every package is
+    only fed once, with all its versions matched by any of the limiters,
+    in the first target matching it.
+    """
+
+    feed_type = base.versioned_feed
+    cost = 10
+
+    def __init__(self, repo, limiters):
+        self.repo = repo
+        self.scope = min(restriction_scope(x) for x in limiters)
+
+        by_key = {}
+        self._unkeyed = []
+        groups = []
+        for limiter in limiters:
+            key = getattr(limiter, 'key', None)
+            if key is None:
+                self._unkeyed.append(limiter)
+                groups.append((None, [limiter]))
+            elif key in by_key:
+                by_key[key].append(limiter)
+            else:
+                by_key[key] = [limiter]
+                groups.append((key, by_key[key]))
+        self._by_key = by_key
+        self.targets = tuple(
+            l[0] if len(l) == 1 else packages.OrRestriction(*l)
+            for key, l in groups)
+        self._groups = groups
+        self._keys = None
+        if not self._unkeyed:
+            self._unkeyed_restrict = None
+        elif len(self._unkeyed) == 1:
+            self._unkeyed_restrict = self._unkeyed[0]
+        else:
+            self._unkeyed_restrict = packages.OrRestriction(*self._unkeyed)
+
+    def _unkeyed_matches(self):
+        """Return the sorted package keys matched by each unkeyed limiter.
+
+        The repo is only walked once for all of them.
+        """
+        matches = [[] for limiter in self._unkeyed]
+        if self._unkeyed_restrict is not None:
+            for pkg in self.repo.itermatch(
+                    self._unkeyed_restrict, sorter=sorted):
+                for keys, limiter in zip(matches, self._unkeyed):
+                    if (not keys or keys[-1] != pkg.key) and limiter.match(pkg):
+                        keys.append(pkg.key)
+        return matches
+
+    def _target_keys(self):
+        """Return the package keys to feed for each target, deduplicated."""
+        if self._keys is None:
+            unkeyed = iter(self._unkeyed_matches())
+            seen = set()
+            self._keys = []
+            for key, limiters in self._groups:
+                matches = [key] if key is not None else next(unkeyed)
+                keys = []
+                for key in matches:
+                    if key not in seen:
+                        seen.add(key)
+                        keys.append(key)
+                self._keys.append(keys)
+        return self._keys
+
+    def _iter_key(self, key):
+        restricts = list(self._by_key.get(key, ()))
+        if self._unkeyed_restrict is not None:
+            restricts.append(self._unkeyed_restrict)
+        if len(restricts) == 1:
+            restrict = restricts[0]
+        else:
+            restrict = packages.OrRestriction(*restricts)
+        for pkg in self.repo.itermatch(_key_restrict(key), sorter=sorted):
+            if restrict.match(pkg):
+                yield pkg
+
+    def shards(self):
+        return range(len(self.targets))
+
+    def shard_feed(self, index):
+        return chain.from_iterable(
+            self._iter_key(key) for key in self._target_keys()[index])
+
+    def feed(self):
+        return chain.from_iterable(
+            self.shard_feed(i) for i in self.shards())
+
+    def itertargets(self):
+        """Yield (target restriction, packages) pairs in feed order."""
+        for i, target in enumerate(self.targets):
+            yield target, self.shard_feed(i)
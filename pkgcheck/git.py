@@ -0,0 +1,464 @@
+# License: BSD/GPL2
+
+"""Git support: find changed packages and read repositories from git objects.
+
+:obj:`GitTree` provides the packages of a repository at any git revision,
+reading ebuilds, Manifests, metadata.xml files and md5-cache entries straight
+from the object database through a single persistent ``git cat-file --batch``
+process, so no checkout is needed. Metadata can't be regenerated without a
+checkout, packages missing a valid md5-cache entry fail to load their metadata.
+Entries are validated against the ebuild and the eclasses of the repo itself,
+eclasses of master repos aren't available.
+"""
+
+import os
+
+from pkgcore.ebuild import ebuild_src, repo_objs
+from pkgcore.package import metadata
+from pkgcore.package.errors import MetadataException
+from pkgcore.repository import prototype
+from snakeoil.compatibility import is_py3k
+from snakeoil.demandload import demandload
+from snakeoil.mappings import ImmutableDict
+
+from pkgcheck.errors import GitError
+
+demandload(
+    'hashlib',
+    'subprocess',
+    'threading',
+    'pkgcore.ebuild:digest,restricts',
+    'pkgcore.ebuild.cpv:versioned_CPV',
+    'pkgcore.ebuild.errors:InvalidCPV',
+    'pkgcore.restrictions:packages',
+    'snakeoil:data_source',
+    'snakeoil.osutils:pjoin',
+)
+
+
+def _run_git(location, *args):
+    """Run a git command inside location returning its NUL separated output."""
+    try:
+        proc = subprocess.Popen(
+            ('git',) + args, cwd=location,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except EnvironmentError as e:
+        raise GitError('failed running git: %s' % (e,))
+    stdout, stderr = proc.communicate()
+    if proc.returncode:
+        raise GitError('git %s failed: %s' % (
+            args[0], stderr.decode('utf-8', 'replace').strip()))
+    paths = [x for x in stdout.split(b'\0') if x]
+    if is_py3k:
+        paths = [x.decode('utf-8') for x in paths]
+    return paths
+
+
+def changed_paths(location, ref, rev=None):
+    """Return the paths relative to location differing from a git ref.
+
+    If no revision to compare against is given this covers changes in the
+    working tree whether they're committed, staged or not, and files unknown
+    to git.
+    """
+    if rev is not None:
+        return _run_git(
+            location, 'diff', '--name-only', '-z', '--relative',
+            '--no-renames', ref, rev, '--')
+    paths = _run_git(
+        location, 'diff', '--name-only', '-z', '--relative', '--no-renames',
+        ref, '--')
+    paths.extend(_run_git(
+        location, 'ls-files', '-z', '--others', '--exclude-standard'))
+    return paths
+
+
+def changed_restrict(repo, ref, rev=None, index=None):
+    """Return a restriction matching the packages changed since a git ref.
+
+    Packages inheriting a changed eclass are included. Changes outside of
+    package directories and eclasses are ignored.
+
+    :param rev: revision to compare to, defaults to the working tree. repo
+        should be a :obj:`GitTree` of that revision if given.
+    :param index: up to date :obj:`pkgcheck.eclass_index.EclassIndex` used
+        to find the packages inheriting changed eclasses instead of loading
+        the metadata of all packages.
+    :return: a restriction or None if no packages changed.
+    """
+    keys = set()
+    eclasses = set()
+    for path in changed_paths(repo.location, ref, rev):
+        parts = path.split('/')
+        if len(parts) == 2 and parts[0] == 'eclass' and \
+                parts[1].endswith('.eclass'):
+            eclasses.add(parts[1][:-len('.eclass')])
+        elif len(parts) > 2 and parts[0] in repo.categories:
+            keys.add('/'.join(parts[:2]))
+
+    if eclasses and index is not None:
+        keys.update(index.inheriting(eclasses))
+    elif eclasses:
+        for pkg in repo.itermatch(packages.AlwaysTrue):
+            if pkg.key in keys:
+                continue
+            try:
+                if eclasses.intersection(pkg.inherited):
+                    keys.add(pkg.key)
+            except MetadataException:
+                # the metadata checks will complain if it gets scanned
+                pass
+
+    restricts = []
+    for key in sorted(keys):
+        if rev is None:
+            if not os.path.isdir(pjoin(repo.location, key)):
+                continue
+        elif key.split('/')[1] not in repo.packages.get(key.split('/')[0], ()):
+            continue
+        restricts.append(repo.path_restrict(pjoin(repo.location, key)))
+    if not restricts:
+        # nothing left to check, e.g. only packages got removed
+        return None
+    return packages.OrRestriction(*restricts)
+
+
+class CatFile(object):
+    """Read objects of a git repository through ``git cat-file --batch``.
+
+    A single process is kept running for all reads, forked processes (like
+    parallel workers) start their own. Reads are serialized so prefetching
+    threads can share it.
+    """
+
+    def __init__(self, location):
+        self.location = location
+        self._proc = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _process(self):
+        if self._proc is None or self._pid != os.getpid():
+            try:
+                self._proc = subprocess.Popen(
+                    ('git', 'cat-file', '--batch'), cwd=self.location,
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            except EnvironmentError as e:
+                raise GitError('failed running git: %s' % (e,))
+            self._pid = os.getpid()
+        return self._proc
+
+    def read(self, spec):
+        """Return the object matching a spec like REV:PATH.
+
+        :return: (object id, object type, data) tuple or None if there's no
+            such object
+        """
+        if not isinstance(spec, bytes):
+            spec = spec.encode('utf-8')
+        with self._lock:
+            return self._read(spec)
+
+    def _read(self, spec):
+        proc = self._process()
+        proc.stdin.write(spec + b'\n')
+        proc.stdin.flush()
+        header = proc.stdout.readline()
+        if not header:
+            self._proc = None
+            raise GitError('git cat-file exited unexpectedly')
+        if header.endswith((b' missing\n', b' ambiguous\n')):
+            return None
+        oid, kind, size = header.split()
+        data = proc.stdout.read(int(size))
+        # objects are followed by a newline
+        proc.stdout.read(1)
+        return oid.decode('ascii'), kind.decode('ascii'), data
+
+    def close(self):
+        if self._proc is not None and self._pid == os.getpid():
+            self._proc.stdin.close()
+            self._proc.wait()
+        self._proc = None
+
+
+def _parse_tree(data, oid_size):
+    """Return the (name, is a tree) pairs of a raw git tree object."""
+    entries = []
+    i = 0
+    while i < len(data):
+        end = data.index(b'\0', i)
+        mode, name = data[i:end].split(b' ', 1)
+        if is_py3k:
+            name = name.decode('utf-8')
+        entries.append((name, mode == b'40000'))
+        i = end + 1 + oid_size
+    return entries
+
+
+class _MetadataXml(repo_objs.MetadataXml):
+    """metadata.xml read from a git object, missing files have no entries."""
+
+    __slots__ = ()
+
+    def __init__(self, source):
+        repo_objs.MetadataXml.__init__(self, source)
+        if source is None:
+            self._maintainers = ()
+            self._local_use = ImmutableDict()
+            self._longdescription = None
+
+
+class _PackageFactory(metadata.factory):
+
+    child_class = ebuild_src.package
+
+    # fetchables get generated without mirror expansion
+    mirrors = {}
+    default_mirrors = None
+
+    def new_package(self, *args):
+        inst = self._cached_instances.get(args)
+        if inst is None:
+            shared = self._parent_repo._get_shared_pkg_data(args[0], args[1])
+            inst = self._cached_instances[args] = self.child_class(
+                shared, self, *args)
+        return inst
+
+    def _ebuild_relpath(self, pkg):
+        return '%s/%s/%s-%s.ebuild' % (
+            pkg.category, pkg.package, pkg.package, pkg.fullver)
+
+    def get_ebuild_src(self, pkg):
+        data = self._parent_repo.read_file(self._ebuild_relpath(pkg))
+        if data is None:
+            raise KeyError(pkg.cpvstr)
+        return data_source.text_data_source(data.decode('utf8'))
+
+    def _get_ebuild_path(self, pkg):
+        return pjoin(self._parent_repo.location, self._ebuild_relpath(pkg))
+
+    def _get_ebuild_mtime(self, pkg):
+        return self._parent_repo.ebuild_mtime(self._ebuild_relpath(pkg))
+
+    def _get_metadata(self, pkg, ebp=None, force_regen=False):
+        repo = self._parent_repo
+        entry = repo.read_file('metadata/md5-cache/%s' % (pkg.cpvstr,))
+        if entry is None:
+            raise MetadataException(pkg, 'data', 'no md5-cache entry')
+        if is_py3k:
+            entry = entry.decode('utf8')
+        data = {}
+        for line in entry.splitlines():
+            key, sep, value = line.partition('=')
+            if sep:
+                data[key] = value
+        ebuild = repo.read_file(self._ebuild_relpath(pkg)) or b''
+        if data.pop('_md5_', None) != hashlib.md5(ebuild).hexdigest():
+            raise MetadataException(pkg, 'data', 'stale md5-cache entry')
+        eclasses = data.pop('_eclasses_', '').split('\t')
+        if len(eclasses) > 1:
+            eclasses = dict(zip(eclasses[::2], eclasses[1::2]))
+            # same as pkgcore's md5-cache, entries are only valid as long as
+            # the inherited eclasses didn't change
+            for name, chksum in eclasses.iteritems():
+                if repo.eclass_md5(name) != chksum:
+                    raise MetadataException(
+                        pkg, 'data', 'stale md5-cache entry')
+            data['_eclasses_'] = eclasses
+        return data
+
+
+class GitTree(prototype.tree):
+    """Read-only ebuild repository at a git revision, see the module docs.
+
+    Repo wide settings (config, licenses, masters and the eclass cache)
+    aren't read from the revision, they're taken from base_repo, the repo of
+    the working tree.
+
+    :ivar commit: id of the commit the revision resolved to
+    :ivar commit_time: committer timestamp of that commit
+    """
+
+    frozen_settable = False
+    frozen = True
+
+    def __init__(self, location, rev, repo_id=None, base_repo=None):
+        self.location = location
+        self.rev = rev
+        self.base_repo = base_repo
+        self.repo_id = repo_id if repo_id is not None else location
+        self.git = CatFile(location)
+        commit = self.git.read('%s^{commit}' % (rev,))
+        if commit is None:
+            raise GitError('unknown revision: %r' % (rev,))
+        self.commit = commit[0]
+        self.commit_time = 0
+        for line in commit[2].split(b'\n'):
+            if line.startswith(b'committer '):
+                self.commit_time = int(line.rsplit(None, 2)[1])
+                break
+            elif not line:
+                break
+        self._shared_pkg_cache = {}
+        self._ebuild_mtimes = None
+        self._eclass_md5s = {}
+        self.package_class = _PackageFactory(self)
+        prototype.tree.__init__(self)
+
+    config = property(lambda self: self._base_attr('config'))
+    licenses = property(lambda self: self._base_attr('licenses'))
+    masters = property(lambda self: self._base_attr('masters'))
+    eclass_cache = property(lambda self: self._base_attr('eclass_cache'))
+
+    @property
+    def trees(self):
+        return tuple(self.masters) + (self,)
+
+    def _base_attr(self, attr):
+        if self.base_repo is None:
+            raise AttributeError(attr)
+        return getattr(self.base_repo, attr)
+
+    def read_file(self, path):
+        """Return the contents of a file in the repo or None if missing."""
+        obj = self.git.read('%s:%s' % (self.commit, path))
+        if obj is None or obj[1] != 'blob':
+            return None
+        return obj[2]
+
+    def eclass_md5(self, name):
+        """Return the md5 checksum of an eclass or None if it's missing."""
+        chksum = self._eclass_md5s.get(name, False)
+        if chksum is False:
+            data = self.read_file('eclass/%s.eclass' % (name,))
+            if data is not None:
+                chksum = hashlib.md5(data).hexdigest()
+            else:
+                chksum = None
+            self._eclass_md5s[name] = chksum
+        return chksum
+
+    def ebuild_mtime(self, path):
+        """Return the modification time of an ebuild.
+
+        That's the committer timestamp of the last commit up to the revision
+        changing the ebuild, the history is walked once for all ebuilds on
+        first use. Ebuilds not found in it (e.g. in shallow clones) fall back
+        to the timestamp of the revision.
+        """
+        if self._ebuild_mtimes is None:
+            self._ebuild_mtimes = self._get_ebuild_mtimes()
+        return self._ebuild_mtimes.get(path, self.commit_time)
+
+    def _get_ebuild_mtimes(self):
+        paths = set(x for x in _run_git(
+            self.location, 'ls-tree', '-r', '-z', '--name-only', self.commit)
+            if x.endswith('.ebuild'))
+        mtimes = {}
+        if not paths:
+            return mtimes
+        try:
+            proc = subprocess.Popen(
+                ('git', '-c', 'core.quotepath=off', 'log', '--format=%x00%ct',
+                 '--name-only', '--no-renames', self.commit, '--', '*.ebuild'),
+                cwd=self.location, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+        except EnvironmentError as e:
+            raise GitError('failed running git: %s' % (e,))
+        try:
+            commit_time = self.commit_time
+            for line in proc.stdout:
+                line = line.rstrip(b'\n')
+                if line.startswith(b'\0'):
+                    commit_time = int(line[1:])
+                    continue
+                if is_py3k:
+                    line = line.decode('utf-8')
+                # the log is newest first, later changes take precedence
+                if line in paths:
+                    paths.remove(line)
+                    mtimes[line] = commit_time
+                    if not paths:
+                        # no need to walk the rest of the history
+                        break
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.terminate()
+            proc.wait()
+        return mtimes
+
+    def listdir(self, path):
+        """Return the (name, is a directory) pairs of a repo directory."""
+        obj = self.git.read('%s:%s' % (self.commit, path))
+        if obj is None or obj[1] != 'tree':
+            return []
+        return _parse_tree(obj[2], len(obj[0]) // 2)
+
+    def _get_categories(self, *args):
+        if args:
+            return ()
+        dirs = [name for name, is_dir in self.listdir('') if is_dir]
+        categories = self.read_file('profiles/categories')
+        if categories is None:
+            return tuple(x for x in dirs if '-' in x or x == 'virtual')
+        categories = set(
+            x.strip() for x in categories.decode('utf8').splitlines())
+        return tuple(x for x in dirs if x in categories)
+
+    def _get_packages(self, category):
+        return tuple(name for name, is_dir in self.listdir(category) if is_dir)
+
+    def _get_versions(self, catpkg):
+        category, package = catpkg
+        prefix = package + '-'
+        versions = []
+        for name, is_dir in self.listdir('%s/%s' % catpkg):
+            if is_dir or not name.startswith(prefix) or \
+                    not name.endswith('.ebuild'):
+                continue
+            version = name[len(prefix):-len('.ebuild')]
+            try:
+                versioned_CPV('%s/%s-%s' % (category, package, version))
+            except InvalidCPV:
+                continue
+            versions.append(version)
+        return tuple(versions)
+
+    def _get_shared_pkg_data(self, category, package):
+        key = (category, package)
+        shared = self._shared_pkg_cache.get(key)
+        if shared is None:
+            pkgdir = '%s/%s' % key
+            mxml = self.read_file(pkgdir + '/metadata.xml')
+            if mxml is not None:
+                mxml = data_source.bytes_data_source(mxml)
+            manifest = self.read_file(pkgdir + '/Manifest') or b''
+            manifest = digest.Manifest(
+                data_source.text_data_source(manifest.decode('utf8')),
+                thin=True, allow_missing=True)
+            shared = self._shared_pkg_cache[key] = repo_objs.SharedPkgData(
+                _MetadataXml(mxml), manifest)
+        return shared
+
+    def path_restrict(self, path):
+        """Return a restriction matching the packages under a repo path."""
+        relpath = os.path.relpath(path, self.location)
+        parts = [x for x in relpath.split(os.sep) if x not in ('', '.')]
+        restrictions = []
+        if parts:
+            restrictions.append(restricts.CategoryDep(parts[0]))
+        if len(parts) > 1:
+            restrictions.append(restricts.PackageDep(parts[1]))
+        if len(parts) > 2 and parts[2].endswith('.ebuild'):
+            pkg = versioned_CPV('%s/%s' % (parts[0], parts[2][:-len('.ebuild')]))
+            restrictions.append(restricts.VersionMatch(
+                '=', pkg.version, rev=pkg.revision))
+        return packages.AndRestriction(*restrictions)
+
+    def close(self):
+        self.git.close()
+
+    def __str__(self):
+        return '%s@%s' % (self.repo_id, self.rev)
@@ -1,9 +1,7 @@
 # Copyright: 2006 Brian Harring <ferringb@gmail.com>
 # License: BSD/GPL2
 
-from pkgcore.restrictions import packages, values
-
-from pkgcheck.addons import ArchesAddon, StableCheckAddon
+from pkgcheck.addons import ArchesAddon, KeywordsAddon, StableCheckAddon
 from pkgcheck.base import versioned_feed, package_feed, Warning
 
 
@@ -30,7 +28,8 @@ class ImlateReport(StableCheckAddon):
     """Scan for ebuilds that are lagging in stabilization."""
 
     feed_type = package_feed
-    required_addons = (ArchesAddon,)
+    cacheable = True
+    required_addons = (ArchesAddon, KeywordsAddon)
     known_results = (LaggingStable,)
 
     @staticmethod
@@ -46,25 +45,24 @@ class ImlateReport(StableCheckAddon):
                 The default arches are %s.
             """ % (", ".join(ArchesAddon.default_arches)))
 
-    def __init__(self, options, arches):
+    def __init__(self, options, arches, keywords):
         super(ImlateReport, self).__init__(options)
-        arches = frozenset(arch.strip().lstrip("~") for arch in self.arches)
-        self.target_arches = frozenset(
-            "~%s" % arch.strip().lstrip("~") for arch in arches)
-        self.source_arches = frozenset(
-            arch.lstrip("~") for arch in options.reference_arches)
-        self.source_filter = packages.PackageRestriction(
-            "keywords", values.ContainmentMatch(*self.source_arches))
+        self.keywords = keywords
+        self.target_arches = keywords.mask(arch.strip() for arch in self.arches)
+        self.source_arches = keywords.mask(options.reference_arches)
 
     def feed(self, pkgset, reporter):
-        fmatch = self.source_filter.match
-        remaining = set(self.target_arches)
-        for pkg in reversed(pkgset):
-            if not fmatch(pkg):
+        matrix = self.keywords.matrix(pkgset)
+        source_arches = self.source_arches
+        remaining = self.target_arches
+        for i in reversed(xrange(len(pkgset))):
+            if not matrix.stable[i] & source_arches:
                 continue
-            unstable_keys = remaining.intersection(pkg.keywords)
+            unstable_keys = matrix.unstable[i] & remaining
             if unstable_keys:
-                reporter.add_report(LaggingStable(pkg, sorted(unstable_keys)))
-                remaining.difference_update(unstable_keys)
+                reporter.add_report(LaggingStable(
+                    pkgset[i],
+                    ["~%s" % arch for arch in self.keywords.names(unstable_keys)]))
+                remaining &= ~unstable_keys
                 if not remaining:
                     break
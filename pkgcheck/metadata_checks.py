@@ -11,7 +11,10 @@ from snakeoil.demandload import demandload
 
 from pkgcheck import base, addons
 
-demandload('logging')
+demandload(
+    'logging',
+    'pkgcore.ebuild.cpv:versioned_CPV',
+)
 
 
 class MetadataError(base.Error):
@@ -177,6 +180,43 @@ class MissingSlotDepReport(base.Template):
     def __init__(self, options, iuse_handler):
         base.Template.__init__(self, options)
         self.iuse_filter = iuse_handler.get_filter()
+        # repo -> package key -> {versioned cpv: slot}, filled on demand and
+        # kept for the whole run since deps on the same packages are common
+        self.slot_index = {}
+
+    def key_slots(self, repo, key):
+        """Return the {versioned cpv: slot} mapping of a package key.
+
+        Slots are read from the repo index (see :obj:`pkgcheck.repo_index`)
+        if there is one for the repo, without creating package objects.
+        Packages with missing or stale cache entries are matched in the repo
+        itself, which regenerates those.
+        """
+        index = self.slot_index.setdefault(repo, {})
+        slots = index.get(key)
+        if slots is None:
+            pkgs = None
+            repo_index = self.options.repo_index
+            if repo_index is not None and repo_index.covers(repo):
+                pkgs = repo_index.versions(key)
+                if not all(pkg.valid for pkg in pkgs):
+                    pkgs = None
+            if pkgs is None:
+                pkgs = repo.itermatch(atom(key))
+            slots = index[key] = dict(
+                (versioned_CPV(pkg.cpvstr), pkg.slot) for pkg in pkgs)
+        return slots
+
+    def dep_slots(self, repo, dep):
+        """Return the slots of the packages in repo matching an atom."""
+        if dep.use or dep.repo_id is not None:
+            # matching these requires the actual packages
+            return set(x.slot for x in repo.itermatch(dep))
+        slots = self.key_slots(repo, dep.key)
+        all_slots = set(slots.itervalues())
+        if len(all_slots) <= 1 or not dep.op:
+            return all_slots
+        return set(slot for cpv, slot in slots.iteritems() if dep.match(cpv))
 
     def feed(self, pkg, reporter):
         # only run the check for EAPI 5 and above
@@ -188,7 +228,7 @@ class MissingSlotDepReport(base.Template):
         # skip deps that are blockers or have explicit slots/slot operators
         for dep in (x for x in rdepends.intersection(depends) if not
                     (x.blocks or x.slot is not None or x.slot_operator is not None)):
-            dep_slots = set(x.slot for x in pkg.repo.itermatch(dep))
+            dep_slots = self.dep_slots(pkg.repo, dep)
             if len(dep_slots) > 1:
                 reporter.add_report(MissingSlotDep(pkg, str(dep), dep_slots))
 
@@ -250,11 +290,27 @@ class KeywordsReport(base.Template):
     """Check pkg keywords for sanity; empty keywords, and -* are flagged"""
 
     feed_type = base.versioned_feed
+    cacheable = True
     known_results = (StupidKeywords, MetadataError)
 
     def feed(self, pkg, reporter):
-        if "-*" in pkg.keywords and len(pkg.keywords) == 1:
-            reporter.add_report(StupidKeywords(pkg))
+        self.check(pkg, reporter.add_report)
+
+    def feed_batch(self, pkgs, reporter):
+        check, add_report = self.check, reporter.add_report
+        for pkg in pkgs:
+            try:
+                check(pkg, add_report)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception:
+                logging.exception('check %r raised', self)
+
+    @staticmethod
+    def check(pkg, add_report):
+        keywords = pkg.keywords
+        if len(keywords) == 1 and keywords[0] == "-*":
+            add_report(StupidKeywords(pkg))
 
 
 class MissingUri(base.Warning):
@@ -378,29 +434,45 @@ class DescriptionReport(base.Template):
     """
 
     feed_type = base.versioned_feed
+    cacheable = True
     known_results = (CrappyDescription,)
 
     def feed(self, pkg, reporter):
-        s = pkg.description.lower()
+        self.check(pkg, reporter.add_report)
+
+    def feed_batch(self, pkgs, reporter):
+        check, add_report = self.check, reporter.add_report
+        for pkg in pkgs:
+            try:
+                check(pkg, add_report)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception:
+                logging.exception('check %r raised', self)
+
+    @staticmethod
+    def check(pkg, add_report):
+        description = pkg.description
+        s = description.lower()
 
         if s.startswith("based on") and "eclass" in s:
-            reporter.add_report(CrappyDescription(
+            add_report(CrappyDescription(
                 pkg, "generic eclass defined description"))
 
         elif pkg.package == s or pkg.key == s:
-            reporter.add_report(CrappyDescription(
+            add_report(CrappyDescription(
                 pkg, "using the pkg name as the description isn't very helpful"))
 
         else:
-            l = len(pkg.description)
+            l = len(description)
             if not l:
-                reporter.add_report(CrappyDescription(
+                add_report(CrappyDescription(
                     pkg, "empty/unset"))
             elif l > 250:
-                reporter.add_report(CrappyDescription(
+                add_report(CrappyDescription(
                     pkg, "over 250 chars in length, bit long"))
             elif l < 5:
-                reporter.add_report(CrappyDescription(
+                add_report(CrappyDescription(
                     pkg, "under 10 chars in length- too short"))
 
 
@@ -26,11 +26,11 @@ demandload(
     'functools:partial',
     'lxml:etree',
     'tempfile:NamedTemporaryFile',
-    'pkgcore.ebuild.atom:atom',
     'pkgcore.log:logger',
     'pkgcore.spawn:spawn,find_binary',
     'snakeoil.osutils:pjoin',
     'snakeoil:fileutils',
+    'pkgcheck:atoms',
 )
 
 
@@ -85,13 +85,14 @@ class base_BadlyFormedXml(base.Warning):
 class base_InvalidXml(base.Error):
     """xml fails XML Schema validation"""
 
-    __slots__ = ("category", "package", "filename")
+    __slots__ = ("category", "package", "filename", "message")
     __attrs__ = __slots__
 
     # message first so partial() can be easily applied
     def __init__(self, message, filename, category, package=None):
         super(base_InvalidXml, self).__init__()
-        self.message = message
+        # render the lxml error log immediately, it's not picklable
+        self.message = tuple(self.format_lxml_errors(message))
         self.category = category
         self.package = package
         self.filename = filename
@@ -112,13 +113,13 @@ class base_InvalidXml(base.Error):
     def short_desc(self):
         return "%s %s violates metadata.xsd:\n%s" % (
             self._label, os.path.basename(self.filename),
-            '\n'.join(self.format_lxml_errors(self.message)))
+            '\n'.join(self.message))
 
 
 class base_MetadataXmlInvalidPkgRef(base.Error):
     """ metadata.xml <pkg/> references unavailable / invalid package """
 
-    __slots__ = ("category", "package", "filename")
+    __slots__ = ("category", "package", "filename", "pkgtext")
     __attrs__ = __slots__
 
     def __init__(self, pkgtext, filename, category, package=None):
@@ -143,11 +144,11 @@ class base_MetadataXmlInvalidPkgRef(base.Error):
 class base_MetadataXmlInvalidCatRef(base.Error):
     """ metadata.xml <cat/> references unavailable / invalid category """
 
-    __slots__ = ("category", "package", "filename")
+    __slots__ = ("category", "package", "filename", "cattext")
     __attrs__ = __slots__
 
     def __init__(self, cattext, filename, category, package=None):
-        super(base_MetadataXmlInvalidPkgRef, self).__init__()
+        super(base_MetadataXmlInvalidCatRef, self).__init__()
         self.category = category
         self.package = package
         self.filename = filename
@@ -301,7 +302,7 @@ class base_check(base.Template):
             p = el.text.strip()
             if p not in self.pkgref_cache:
                 try:
-                    a = atom(p)
+                    a = atoms.cache.atom(p)
                     found = self.options.search_repo.has_match(a)
                 except Exception:
                     # invalid atom
@@ -0,0 +1,373 @@
+# Copyright: 2016 Tim Harder <radhermit@gmail.com>
+# License: BSD/GPL2
+
+"""Run pipelines across multiple processes.
+
+Sources that can split themselves into independent shards (categories for a
+repo source) get the sinks that never need to see more than one shard at a
+time, or that can merge state gathered over separate shards (see
+:obj:`base.Template.mergeable`), farmed out to a pool of forked worker
+processes. Everything else (checks that need the entire repo) keeps running in
+the parent which still walks the full source so every sink sees its feed calls
+in the same order as a serial run would. Transforms that only feed shardable
+sinks don't run in the parent at all.
+
+Results from each worker are recorded per pipeline node and per feed call,
+then replayed by proxies sitting where the shardable sinks, or transforms
+only feeding those, used to be in the parent's pipeline. This keeps the order
+of results handed to the reporter identical to a serial run, including
+results from transforms flushing their data late.
+
+When profiling (see :obj:`pkgcheck.profiling`) the stats gathered in the
+workers are sent back along with their results and added up in the parent.
+"""
+
+from collections import deque
+
+from snakeoil.demandload import demandload
+
+from pkgcheck import base, feeds
+
+demandload(
+    'multiprocessing',
+    'traceback',
+    'snakeoil:pickling',
+)
+
+
+def shardable(sink):
+    """Determine if a sink can be run separately for each source shard.
+
+    Sinks with a scope larger than category need to see the entire source
+    unless they're able to merge their state.
+    """
+    return (sink.scope <= base.category_scope or
+            getattr(sink, 'mergeable', False))
+
+
+class _Collector(object):
+    """Reporter storing all results passed to it."""
+
+    def __init__(self):
+        self.results = []
+        self.add_report = self.results.append
+
+
+def _shardable_node(node):
+    """Determine if a pipeline node can be run entirely in the workers.
+
+    That's the case for shardable sinks and transforms only feeding those.
+    """
+    if isinstance(node, base.Transform):
+        return bool(node.child.checks) and all(
+            _shardable_node(x) for x in node.child.checks)
+    return shardable(node)
+
+
+def _leaf_sinks(node):
+    """Return the sinks at the end of a pipeline node, in feed order."""
+    if isinstance(node, base.Transform):
+        return [sink for child in node.child.checks
+                for sink in _leaf_sinks(child)]
+    return [node]
+
+
+class _SinkPassthrough(object):
+    """Stand-in for a sink in the worker copy of a pipeline node.
+
+    The wrapped sink is started once in the parent before the workers are
+    forked and finished in the parent once all shards are done, the per
+    shard start/finish calls only exist to reset and flush the transforms
+    feeding this. Mergeable sinks are the exception, these are restarted for
+    every shard so their partial state only covers that shard.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.mergeable = getattr(sink, 'mergeable', False)
+
+    def start(self):
+        if self.mergeable:
+            self.sink.start()
+
+    def feed(self, item, reporter):
+        self.sink.feed(item, reporter)
+
+    def feed_batch(self, items, reporter):
+        self.sink.feed_batch(items, reporter)
+
+    def finish(self, reporter):
+        pass
+
+    def __repr__(self):
+        return repr(self.sink)
+
+
+def _worker_copy(node):
+    """Copy a pipeline node, putting passthroughs in place of its sinks."""
+    if isinstance(node, base.Transform):
+        return node.__class__(
+            base.CheckRunner([_worker_copy(x) for x in node.child.checks]))
+    return _SinkPassthrough(node)
+
+
+class _ShardRecorder(object):
+    """Pipeline node wrapper used in workers, recording results for each
+    feed call.
+
+    Results the transforms of the node flush at the end of a shard are added
+    to the last feed call of that shard.
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self.sinks = _leaf_sinks(node)
+        self.pipe = base.CheckRunner([_worker_copy(node)])
+        self.batches = []
+
+    def start(self):
+        self.pipe.start()
+
+    def feed(self, item, reporter):
+        self._record(self.pipe.feed, item)
+
+    def feed_batch(self, items, reporter):
+        self._record(self.pipe.feed_batch, items)
+
+    def _record(self, func, arg):
+        collector = _Collector()
+        try:
+            func(arg, collector)
+        finally:
+            # record the call even if the node failed, otherwise the replay
+            # in the parent would get out of sync
+            self.batches.append(tuple(collector.results) or None)
+
+    def finish(self, reporter):
+        collector = _Collector()
+        self.pipe.finish(collector)
+        if collector.results and self.batches:
+            self.batches[-1] = (self.batches[-1] or ()) + tuple(
+                collector.results)
+
+    def pop_state(self):
+        """Return the results recorded and sink states for the current shard."""
+        batches = self.batches
+        self.batches = []
+        states = [
+            sink.partial_state() if getattr(sink, 'mergeable', False)
+            else None for sink in self.sinks]
+        return batches, states
+
+    def instrument(self, profiler):
+        """Account the time spent in the recorded node to a profiler."""
+        self.pipe = profiler.instrument(self.pipe)
+        return self
+
+    def __repr__(self):
+        return repr(self.node)
+
+
+class _ShardProxy(object):
+    """Pipeline node stand-in used in the parent, replaying results from
+    workers.
+
+    Transforms of the node never get fed in the parent, its sinks only get
+    started, get their states merged and get finished.
+    """
+
+    def __init__(self, node, index, replay):
+        self.node = node
+        self.index = index
+        self.replay = replay
+        self.sinks = _leaf_sinks(node)
+        self.pipe = base.CheckRunner([node])
+
+    def start(self):
+        self.pipe.start()
+
+    def feed(self, item, reporter):
+        batch = self.replay.next_batch(self.index)
+        if batch is not None:
+            for result in batch:
+                reporter.add_report(result)
+
+    feed_batch = feed
+
+    def finish(self, reporter):
+        shard_states = self.replay.states(self.index)
+        for i, sink in enumerate(self.sinks):
+            if getattr(sink, 'mergeable', False):
+                for states in shard_states:
+                    sink.merge_state(states[i])
+        self.pipe.finish(reporter)
+
+    def instrument(self, profiler):
+        """Account the time spent starting and finishing the node to a
+        profiler, replayed results are accounted in the workers."""
+        self.pipe = profiler.instrument(self.pipe)
+        return self
+
+    def __repr__(self):
+        return repr(self.node)
+
+
+class _Replay(object):
+    """Queue recorded results from workers in the order of their shards."""
+
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+        self.batches = []
+        self._states = []
+        self.shard_results = iter(())
+
+    def attach(self, sinks, shard_results):
+        self.batches = [deque() for _ in sinks]
+        self._states = [[] for _ in sinks]
+        self.shard_results = shard_results
+
+    def _load_shard(self):
+        """Pull in the data from the next shard.
+
+        :return: False if there are no shards left
+        """
+        try:
+            data = next(self.shard_results)
+        except StopIteration:
+            return False
+        error, data = pickling.loads(data)
+        if error:
+            raise Exception('pipeline worker failed:\n%s' % (data,))
+        data, stats = data
+        if self.profiler is not None:
+            self.profiler.merge(stats)
+        for queue, states, (shard_batches, state) in zip(
+                self.batches, self._states, data):
+            queue.extend(shard_batches)
+            states.append(state)
+        return True
+
+    def next_batch(self, index):
+        batches = self.batches[index]
+        while not batches:
+            if not self._load_shard():
+                raise AssertionError(
+                    'node %i fed more often than in the workers' % (index,))
+        return batches.popleft()
+
+    def states(self, index):
+        """Return the partial sink states of a node from all shards."""
+        while self._load_shard():
+            pass
+        return self._states[index]
+
+
+def _split_pipe(pipe, replay):
+    """Split a plugged pipeline into the parent and worker pipelines.
+
+    Transforms only feeding shardable sinks are left out of the parent
+    pipeline entirely, so the work they do (e.g. reading ebuilds) only
+    happens in the workers.
+
+    :return: (parent pipeline, worker pipeline or None, shard recorders)
+    """
+    recorders = []
+
+    def split(runner):
+        parent, worker = [], []
+        for child in runner.checks:
+            if _shardable_node(child):
+                parent.append(_ShardProxy(child, len(recorders), replay))
+                worker.append(_ShardRecorder(child))
+                recorders.append(worker[-1])
+            elif isinstance(child, base.Transform):
+                p, w = split(child.child)
+                parent.append(child.__class__(p))
+                if w is not None:
+                    worker.append(child.__class__(w))
+            else:
+                parent.append(child)
+        return base.CheckRunner(parent), (
+            base.CheckRunner(worker) if worker else None)
+
+    parent, worker = split(pipe)
+    return parent, worker, recorders
+
+
+# worker state, set in the parent before forking the workers off
+_worker_state = None
+
+
+def _run_shard(shard):
+    source, pipe, recorders, profiler = _worker_state
+    try:
+        if profiler is not None:
+            # drop anything inherited from the parent
+            profiler.reset()
+        pipe.start()
+        for batch in feeds.category_batches(source.shard_feed(shard)):
+            pipe.feed_batch(batch, None)
+        pipe.finish(None)
+        stats = profiler.pop_stats() if profiler is not None else None
+        data = (False, ([x.pop_state() for x in recorders], stats))
+        return pickling.dumps(data, -1)
+    except Exception:
+        return pickling.dumps((True, traceback.format_exc()), -1)
+
+
+def run(source, pipe, reporter, jobs, feed=None, profiler=None):
+    """Feed a pipeline from a source using multiple processes.
+
+    Falls back to running serially if the source doesn't support shards or
+    nothing in the pipeline can be sharded.
+
+    :param source: source instance, must provide shards() and shard_feed()
+        in order to be run in parallel.
+    :param pipe: pipeline as returned by :obj:`base.plug`.
+    :param reporter: reporter results get passed to.
+    :param jobs: maximum number of worker processes to use.
+    :param feed: iterable yielding the batches of items to feed in the main
+        process, defaults to the category batches of source.feed(). Has to
+        match the category batches of the source's shards if given.
+    :param profiler: :obj:`pkgcheck.profiling.Profiler` instance to account
+        the time spent in the pipeline to, or None.
+    """
+    global _worker_state
+
+    if feed is None:
+        feed = feeds.category_batches(source.feed())
+
+    shards = None
+    if jobs > 1 and hasattr(source, 'shards'):
+        shards = source.shards()
+
+    replay = _Replay(profiler)
+    parent, worker, recorders = _split_pipe(pipe, replay)
+    if profiler is not None:
+        pipe = profiler.instrument(pipe)
+        parent = profiler.instrument(parent)
+        if worker is not None:
+            worker = profiler.instrument(worker)
+    if not shards or worker is None:
+        pipe.start()
+        for batch in feed:
+            pipe.feed_batch(batch, reporter)
+        pipe.finish(reporter)
+        return
+
+    # start everything before forking so the workers inherit sinks that
+    # have already done their (potentially expensive) setup
+    parent.start()
+
+    _worker_state = (source, worker, recorders, profiler)
+    pool = multiprocessing.Pool(min(jobs, len(shards)))
+    try:
+        replay.attach(recorders, pool.imap(_run_shard, shards))
+        for batch in feed:
+            parent.feed_batch(batch, reporter)
+        parent.finish(reporter)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        _worker_state = None
@@ -6,10 +6,11 @@ from collections import deque
 import os
 import stat
 
-from pkgcore.ebuild.atom import MalformedAtom, atom
+from pkgcore.ebuild.atom import MalformedAtom
 from snakeoil.demandload import demandload
 from snakeoil.osutils import listdir, pjoin, sizeof_fmt
 
+from pkgcheck import atoms
 from pkgcheck.base import Error, Warning, Template, package_feed
 
 demandload('errno')
@@ -160,6 +161,7 @@ class PkgDirReport(Template):
     """Actual ebuild directory scans; file size, glep31 rule enforcement."""
 
     feed_type = package_feed
+    cacheable = True
 
     ignore_dirs = set(["cvs", ".svn", ".bzr"])
     known_results = (
@@ -194,7 +196,7 @@ class PkgDirReport(Template):
 
                 pkg_name = os.path.basename(filename[:-len(ebuild_ext)])
                 try:
-                    pkg_atom = atom('=%s/%s' % (category, pkg_name))
+                    pkg_atom = atoms.cache.atom('=%s/%s' % (category, pkg_name))
                     if pkg_atom.package != os.path.basename(base):
                         mismatched.append(pkg_name)
                 except MalformedAtom:
@@ -0,0 +1,112 @@
+# License: BSD/GPL2
+
+"""Persistent snapshot of the profile data set up by ProfileAddon.
+
+Creating all selected profiles and collapsing their masked and forced USE
+data per arch takes a long time on large repos, while the result only
+depends on the profiles trees and the arch and profile selection. The
+computed data is pickled to a file along with a fingerprint of those and
+reused by later runs with the same fingerprint.
+
+Only data pickle can restore is stored, e.g. visibility filters and keyword
+restrictions get recreated from it on load since pkgcore's restrictions are
+immutable and can't be unpickled in general.
+
+The fingerprint covers the paths, sizes and modification times of all files
+in the profiles directories of the target repo and its masters, so any edit
+to a profile invalidates the snapshot.
+"""
+
+import copy_reg
+import errno
+import os
+import pickle
+
+from pkgcore.ebuild import misc
+from pkgcore.restrictions import packages, restriction, values
+from snakeoil.demandload import demandload
+
+demandload(
+    'hashlib',
+    'snakeoil:pickling',
+    'snakeoil.osutils:pjoin',
+    'pkgcheck:__version__',
+)
+
+
+def _chunked_data(key, neg, pos):
+    return misc.chunked_data(key, neg, pos)
+
+
+def _restrict_payload(restrict, data):
+    return misc.restrict_payload(restrict, data)
+
+
+def _always_bool(module, name):
+    return getattr({'packages': packages, 'values': values}[module], name)
+
+
+def _reduce_always_bool(restrict):
+    for module in (packages, values):
+        for name in ('AlwaysTrue', 'AlwaysFalse'):
+            if getattr(module, name) is restrict:
+                return _always_bool, (module.__name__.rsplit('.', 1)[1], name)
+    raise pickle.PicklingError('unknown restriction: %r' % (restrict,))
+
+
+# The namedtuples used by ChunkedDataDict claim to live in a different module
+# than they do, so pickle can't find them on its own.
+copy_reg.pickle(misc.chunked_data, lambda x: (_chunked_data, tuple(x)))
+copy_reg.pickle(misc.restrict_payload, lambda x: (_restrict_payload, tuple(x)))
+# Restrictions are immutable and can't be restored by pickle, these ones are
+# used as keys for global use data.
+copy_reg.pickle(restriction.AlwaysBool, _reduce_always_bool)
+
+
+def fingerprint(profiles_dirs, selection):
+    """Return a string identifying the state of profiles trees and a selection.
+
+    :param profiles_dirs: paths of the profiles directories in use
+    :param selection: repr()-able object describing the selected arches and
+        profiles
+    """
+    chf = hashlib.sha1()
+    chf.update(repr(__version__).encode())
+    chf.update(repr(selection).encode())
+    for profiles_dir in profiles_dirs:
+        chf.update(repr(profiles_dir).encode())
+        for root, dirs, files in os.walk(profiles_dir):
+            dirs.sort()
+            for name in sorted(files):
+                path = pjoin(root, name)
+                try:
+                    st = os.stat(path)
+                except EnvironmentError:
+                    continue
+                chf.update(repr((
+                    path[len(profiles_dir):], st.st_mtime, st.st_size)).encode())
+    return chf.hexdigest()
+
+
+def load(path, key):
+    """Return the snapshot stored at path or None if missing or outdated."""
+    try:
+        with open(path, 'rb') as f:
+            stored_key, snapshot = pickling.load(f)
+    except EnvironmentError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    except Exception:
+        # corrupted or written by an incompatible version
+        return None
+    if stored_key != key:
+        return None
+    return snapshot
+
+
+def save(path, key, snapshot):
+    tmp = '%s.%i' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        pickling.dump((key, snapshot), f, -1)
+    os.rename(tmp, path)
@@ -0,0 +1,216 @@
+# License: BSD/GPL2
+
+"""Time accounting for checks and transforms.
+
+Profiling works by wrapping every node of a plugged pipeline (see
+:obj:`Profiler.instrument`), nothing is added to the pipeline classes
+themselves so runs without profiling don't pay for it.
+
+Times are exclusive: the time a transform spends feeding its children is
+accounted to the children, not the transform. CPU times are those of the
+whole process while the node was running, so work done by other threads
+(e.g. prefetching or an asynchronous reporter) gets attributed to whatever
+node happened to be running. Times gathered in worker processes are added
+up, so totals may exceed the elapsed time of a parallel run.
+"""
+
+import time
+
+from pkgcheck import base
+
+_cpu_time = getattr(time, 'process_time', None) or time.clock
+
+
+class Stats(object):
+    """Counters gathered for a single check or transform.
+
+    :ivar calls: number of feed calls, batches counting once
+    :ivar items: number of items fed
+    :ivar results: number of results emitted
+    :ivar wall: exclusive wall clock time in seconds
+    :ivar cpu: exclusive process CPU time in seconds
+    """
+
+    __slots__ = ('calls', 'items', 'results', 'wall', 'cpu')
+
+    def __init__(self, calls=0, items=0, results=0, wall=0.0, cpu=0.0):
+        self.calls = calls
+        self.items = items
+        self.results = results
+        self.wall = wall
+        self.cpu = cpu
+
+    def merge(self, other):
+        for attr in self.__slots__:
+            setattr(self, attr, getattr(self, attr) + getattr(other, attr))
+
+    def __getstate__(self):
+        return tuple(getattr(self, attr) for attr in self.__slots__)
+
+    def __setstate__(self, state):
+        for attr, value in zip(self.__slots__, state):
+            setattr(self, attr, value)
+
+    def as_dict(self):
+        return dict((attr, getattr(self, attr)) for attr in self.__slots__)
+
+
+def node_name(node):
+    """Return the name stats of a pipeline node are accounted under.
+
+    Stand-ins for sinks (like the ones used for parallel runs) expose the
+    wrapped sink as their sink attribute.
+    """
+    while hasattr(node, 'sink'):
+        node = node.sink
+    return node.__class__.__name__
+
+
+class _CountingReporter(object):
+
+    __slots__ = ('reporter', 'stats')
+
+    def __init__(self, reporter, stats):
+        self.reporter = reporter
+        self.stats = stats
+
+    def add_report(self, result):
+        self.stats.results += 1
+        self.reporter.add_report(result)
+
+
+class _Timed(object):
+    """Pipeline node wrapper accounting its calls to a :obj:`Profiler`."""
+
+    def __init__(self, node, profiler):
+        self.node = node
+        self.profiler = profiler
+        self.stats = profiler.get_stats(node_name(node))
+        # results passed on by transforms belong to their children
+        self.counting = not isinstance(node, base.Transform)
+        self._reporter = None
+        self._counting_reporter = None
+
+    def _wrap_reporter(self, reporter):
+        if not self.counting or reporter is None:
+            return reporter
+        if reporter is not self._reporter:
+            self._reporter = reporter
+            self._counting_reporter = _CountingReporter(reporter, self.stats)
+        return self._counting_reporter
+
+    def start(self):
+        self.profiler.call(self.stats, self.node.start, ())
+
+    def feed(self, item, reporter):
+        self.profiler.call(
+            self.stats, self.node.feed, (item, self._wrap_reporter(reporter)),
+            count=1)
+
+    def feed_batch(self, items, reporter):
+        self.profiler.call(
+            self.stats, self.node.feed_batch,
+            (items, self._wrap_reporter(reporter)), count=len(items))
+
+    def finish(self, reporter):
+        self.profiler.call(
+            self.stats, self.node.finish, (self._wrap_reporter(reporter),))
+
+    def __repr__(self):
+        return repr(self.node)
+
+
+class Profiler(object):
+    """Gather :obj:`Stats` for the nodes of instrumented pipelines."""
+
+    def __init__(self):
+        self.stats = {}
+        # [wall, cpu] time spent in nested calls, for each active call
+        self._nested = []
+
+    def get_stats(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = Stats()
+        return stats
+
+    def instrument(self, runner):
+        """Return a copy of a pipeline with every node wrapped.
+
+        Stand-ins for parts of a pipeline (like the ones used for parallel
+        runs) providing an instrument method instrument what they wrap
+        themselves.
+        """
+        nodes = []
+        for node in runner.checks:
+            if isinstance(node, base.Transform):
+                node = _Timed(
+                    node.__class__(self.instrument(node.child)), self)
+            elif hasattr(node, 'instrument'):
+                node = node.instrument(self)
+            else:
+                node = _Timed(node, self)
+            nodes.append(node)
+        return base.CheckRunner(nodes)
+
+    def call(self, stats, func, args, count=None):
+        """Run func with args, accounting its time to stats.
+
+        :param count: number of items fed by the call, None for calls that
+            aren't feed calls (start and finish).
+        """
+        self._nested.append([0.0, 0.0])
+        wall = time.time()
+        cpu = _cpu_time()
+        try:
+            return func(*args)
+        finally:
+            wall = time.time() - wall
+            cpu = _cpu_time() - cpu
+            nested_wall, nested_cpu = self._nested.pop()
+            if self._nested:
+                self._nested[-1][0] += wall
+                self._nested[-1][1] += cpu
+            stats.wall += wall - nested_wall
+            stats.cpu += cpu - nested_cpu
+            if count is not None:
+                stats.calls += 1
+                stats.items += count
+
+    def reset(self):
+        """Forget the stats gathered so far."""
+        # instrumented pipelines hold on to the existing instances
+        for stats in self.stats.itervalues():
+            stats.__init__()
+
+    def pop_stats(self):
+        """Return a copy of the stats gathered so far and reset them."""
+        stats = dict((name, Stats(*x.__getstate__()))
+                     for name, x in self.stats.iteritems())
+        self.reset()
+        return stats
+
+    def merge(self, stats):
+        """Add up stats returned by :obj:`pop_stats` of another profiler."""
+        for name, other in stats.iteritems():
+            self.get_stats(name).merge(other)
+
+    def sorted_stats(self):
+        """Return (name, stats) pairs, most expensive first."""
+        return sorted(self.stats.iteritems(),
+                      key=lambda x: (-x[1].wall, x[0]))
+
+    def format(self):
+        """Yield the lines of a table of the gathered stats."""
+        total = sum(x.wall for x in self.stats.itervalues()) or 1.0
+        row = '%-32s %9s %9s %9s %10s %10s %6s'
+        yield row % ('name', 'calls', 'items', 'results', 'wall', 'cpu', '%')
+        for name, stats in self.sorted_stats():
+            yield row % (
+                name, stats.calls, stats.items, stats.results,
+                '%.3fs' % stats.wall, '%.3fs' % stats.cpu,
+                '%.1f' % (100 * stats.wall / total))
+
+    def as_dict(self):
+        return dict(
+            (name, stats.as_dict()) for name, stats in self.stats.iteritems())
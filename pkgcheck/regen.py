@@ -0,0 +1,114 @@
+# License: BSD/GPL2
+
+"""Regenerate stale metadata cache entries before running checks.
+
+pkgcore sources ebuilds lacking a valid metadata cache entry on first
+access, which would otherwise happen one package at a time in the middle of
+the check pipeline. The pre-pass finds the targeted packages with stale
+entries up front and regenerates them concurrently. Ebuilds get sourced by
+pkgcore's ebuild processors, which are separate processes, so a pool of
+threads each driving one of them is enough to make use of multiple cores.
+"""
+
+from itertools import chain
+import time
+
+from pkgcore.package.errors import MetadataException
+from snakeoil.demandload import demandload
+
+demandload(
+    'multiprocessing.pool:ThreadPool',
+    'pkgcore.cache:errors@cache_errors',
+    'snakeoil.chksum:LazilyHashedPath',
+)
+
+
+class Regen(object):
+    """Regenerate the stale cache entries of packages.
+
+    :ivar total: number of packages looked at
+    :ivar regenerated: number of cache entries regenerated
+    :ivar failed: number of packages failing to regenerate, their metadata
+        errors are left to get reported by the checks
+    :ivar elapsed: wall clock time spent
+    """
+
+    def __init__(self, jobs=1):
+        self.jobs = jobs
+        self.total = self.regenerated = self.failed = 0
+        self.elapsed = 0.0
+
+    @staticmethod
+    def stale(pkg):
+        """Determine if a package lacks a valid cache entry."""
+        factory = pkg._parent
+        caches = [x for x in getattr(factory, '_cache', None) or () if x is not None]
+        if not any(not x.readonly for x in caches):
+            # nowhere to store regenerated metadata
+            return False
+        ebuild_hash = LazilyHashedPath(pkg.path)
+        for cache in caches:
+            try:
+                data = cache[pkg.cpvstr]
+            except (KeyError, cache_errors.CacheError):
+                continue
+            if cache.validate_entry(data, ebuild_hash, factory._ecache):
+                return False
+        return True
+
+    @staticmethod
+    def update(pkg):
+        """Regenerate the metadata of a package, storing it in the cache."""
+        pkg._fetch_metadata()
+
+    def _regen(self, pkg):
+        if not self.stale(pkg):
+            return None
+        try:
+            self.update(pkg)
+        except MetadataException:
+            return False
+        return True
+
+    def run(self, repo, limiters):
+        """Regenerate the stale entries of the packages matching limiters."""
+        start = time.time()
+        seen = set()
+        pkgs = []
+        for pkg in chain.from_iterable(repo.itermatch(x) for x in limiters):
+            if pkg.cpvstr not in seen:
+                seen.add(pkg.cpvstr)
+                pkgs.append(pkg)
+        self.total += len(pkgs)
+
+        if self.jobs > 1 and len(pkgs) > 1:
+            pool = ThreadPool(min(self.jobs, len(pkgs)))
+            try:
+                results = pool.imap_unordered(self._regen, pkgs)
+                self._count(results)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            self._count(self._regen(pkg) for pkg in pkgs)
+
+        operations = getattr(repo, 'operations', None)
+        if self.regenerated and operations is not None:
+            operations.run_if_supported('flush_cache')
+        self.elapsed += time.time() - start
+
+    def _count(self, results):
+        for result in results:
+            if result:
+                self.regenerated += 1
+            elif result is not None:
+                self.failed += 1
+
+    def __str__(self):
+        rate = self.regenerated / self.elapsed if self.elapsed else 0.0
+        s = 'metadata regen: %i of %i cache entries regenerated in %.2fs (%.1f/s)' % (
+            self.regenerated, self.total, self.elapsed, rate)
+        if self.failed:
+            s += ', %i failed' % (self.failed,)
+        return s
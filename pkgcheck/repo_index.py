@@ -0,0 +1,437 @@
+# License: BSD/GPL2
+
+"""Memory-mapped columnar index of the metadata cache of a repo.
+
+Package objects load their metadata cache entry on first attribute access
+and allocate objects for every attribute used, which adds up when all that's
+needed are a couple of raw metadata strings for each version of a repo. The
+index stores the commonly used metadata of every version with a cache entry
+in a single binary file that gets memory-mapped:
+
+- a table of all distinct strings, so each one is stored (and, once loaded,
+  kept in memory) only once
+- a fixed size row per ebuild of string ids for category, package, version,
+  EAPI, SLOT, KEYWORDS, IUSE, inherited eclasses, LICENSE, the raw DEPEND,
+  RDEPEND and PDEPEND strings and the eclass checksums of its cache entry,
+  along with the state of the cache entry and the modification times and
+  sizes of the ebuild and cache entry
+
+Rows are sorted in the order repos feed packages in. Updating the index only
+parses cache entries that changed since it was last written, the rows of all
+other versions are copied over as is. Nothing gets written if no entries
+changed.
+
+Every ebuild gets a row, even without a cache entry. Like pkgcore's
+md5-cache, entries only count as valid if their ebuild checksum matches and
+the eclasses they were generated with are unchanged (see
+:obj:`IndexEntry.valid`), users have to fall back to package objects for
+everything else.
+"""
+
+import errno
+import mmap
+import os
+import struct
+
+from snakeoil.compatibility import is_py3k
+from snakeoil.demandload import demandload
+
+demandload(
+    'hashlib',
+    'pkgcore.ebuild.cpv:versioned_CPV',
+    'pkgcheck:atoms',
+    'snakeoil.osutils:listdir_dirs,listdir_files,pjoin',
+)
+
+# indexed metadata cache keys, in row order after category, package and
+# version
+_METADATA_KEYS = (
+    'EAPI', 'SLOT', 'KEYWORDS', 'IUSE', '_eclasses_', 'LICENSE',
+    'DEPEND', 'RDEPEND', 'PDEPEND',
+)
+_COLUMNS = ('category', 'package', 'fullver') + _METADATA_KEYS + (
+    'eclass_sums',)
+(_CATEGORY, _PACKAGE, _FULLVER, _EAPI, _SLOT, _KEYWORDS, _IUSE, _INHERITED,
+ _LICENSE, _DEPEND, _RDEPEND, _PDEPEND, _ECLASS_SUMS, _STATE, _EBUILD_MTIME,
+ _EBUILD_SIZE, _CACHE_MTIME, _CACHE_SIZE) = range(len(_COLUMNS) + 5)
+
+# cache entry states
+_CACHED, _STALE, _UNCACHED = range(3)
+# stats of missing cache entries
+_NO_STAT = (-1.0, 0)
+
+_header = struct.Struct('<8sIII')
+_row = struct.Struct('<%iIBdQdQ' % (len(_COLUMNS),))
+_offset = struct.Struct('<I')
+_MAGIC = b'PKGCKIDX'
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except EnvironmentError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def _md5(path):
+    chf = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            chf.update(chunk)
+    return chf.hexdigest()
+
+
+def _parse_entry(path):
+    """Return the indexed values and ebuild checksum of a cache entry."""
+    data = {}
+    with open(path, 'rb') as f:
+        for line in f:
+            key, sep, value = line.rstrip(b'\n').partition(b'=')
+            if sep:
+                if is_py3k:
+                    key = key.decode()
+                    value = value.decode('utf8')
+                data[key] = value
+    eclass_sums = data.get('_eclasses_', '')
+    data['_eclasses_'] = ' '.join(eclass_sums.split('\t')[::2])
+    data.setdefault('EAPI', '0')
+    return (tuple(data.get(key, '') for key in _METADATA_KEYS) +
+            (eclass_sums,), data.get('_md5_'))
+
+
+class IndexEntry(object):
+    """Metadata of a single version stored in a :obj:`RepoIndex`.
+
+    Provides the attributes package restrictions (e.g. atoms) match against,
+    so they can be used to select entries without creating package objects.
+    """
+
+    __slots__ = ('_index', '_row')
+
+    def __init__(self, index, row):
+        self._index = index
+        self._row = row
+
+    def _string(self, column):
+        return self._index._string(self._row[column])
+
+    category = property(lambda self: self._string(_CATEGORY))
+    package = property(lambda self: self._string(_PACKAGE))
+    fullver = property(lambda self: self._string(_FULLVER))
+    eapi = property(lambda self: self._string(_EAPI))
+    license = property(lambda self: self._string(_LICENSE))
+    depend = property(lambda self: self._string(_DEPEND))
+    rdepend = property(lambda self: self._string(_RDEPEND))
+    pdepend = property(lambda self: self._string(_PDEPEND))
+
+    @property
+    def key(self):
+        return '%s/%s' % (self.category, self.package)
+
+    @property
+    def repo(self):
+        """Repo the index was last updated from, for repo deps to match."""
+        return self._index.repo
+
+    @property
+    def cpvstr(self):
+        return '%s/%s-%s' % (self.category, self.package, self.fullver)
+
+    @property
+    def version(self):
+        version, sep, rev = self.fullver.rpartition('-r')
+        return version if sep and rev.isdigit() else self.fullver
+
+    @property
+    def revision(self):
+        version, sep, rev = self.fullver.rpartition('-r')
+        if sep and rev.isdigit():
+            return int(rev) or None
+        return None
+
+    @property
+    def slot(self):
+        return self._string(_SLOT).partition('/')[0]
+
+    @property
+    def subslot(self):
+        slot, sep, subslot = self._string(_SLOT).partition('/')
+        return subslot if sep else slot
+
+    @property
+    def keywords(self):
+        return tuple(self._string(_KEYWORDS).split())
+
+    @property
+    def iuse(self):
+        return tuple(self._string(_IUSE).split())
+
+    @property
+    def inherited(self):
+        return tuple(self._string(_INHERITED).split())
+
+    @property
+    def valid(self):
+        """Whether the metadata comes from an up to date cache entry.
+
+        That's the case if there's a cache entry for the ebuild, generated
+        from the current ebuild and eclasses of the repo the index was last
+        updated from. Metadata of invalid entries is empty or stale.
+        """
+        if self._row[_STATE] != _CACHED:
+            return False
+        sums = self._string(_ECLASS_SUMS).split('\t')
+        md5s = self._index._eclass_md5s
+        return all(md5s.get(name) == chksum
+                   for name, chksum in zip(sums[::2], sums[1::2]))
+
+    @property
+    def mtime(self):
+        """Modification time of the ebuild."""
+        return self._row[_EBUILD_MTIME]
+
+    @property
+    def cache_mtime(self):
+        """Modification time of the metadata cache entry, -1 if missing."""
+        return self._row[_CACHE_MTIME]
+
+    def __repr__(self):
+        return '<%s cpvstr=%s @%#8x>' % (
+            self.__class__.__name__, self.cpvstr, id(self))
+
+
+class RepoIndex(object):
+    """Memory-mapped index of the metadata cache of a repo.
+
+    :ivar reindexed: number of cache entries parsed by the last update
+    """
+
+    format_version = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.repo = None
+        self.reindexed = 0
+        # eclass name -> md5 checksum, for the repo last updated from
+        self._eclass_md5s = {}
+        self._map = None
+        self._rows = 0
+        self._strings = []
+        # package key -> (first row, last row + 1), built on demand
+        self._keys = None
+        self.load()
+
+    def load(self):
+        self.close()
+        try:
+            with open(self.path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        except ValueError:
+            # empty file
+            return
+        try:
+            magic, version, strings, rows = _header.unpack_from(mapped)
+            size = (_header.size + (strings + 1) * _offset.size +
+                    rows * _row.size)
+            if magic != _MAGIC or version != self.format_version or \
+                    size > len(mapped):
+                raise ValueError
+        except (struct.error, ValueError):
+            # corrupted or written by an incompatible version, start over
+            mapped.close()
+            return
+        self._map = mapped
+        self._rows = rows
+        self._strings = [None] * strings
+        self._offsets_pos = _header.size
+        self._rows_pos = self._offsets_pos + (strings + 1) * _offset.size
+        self._data_pos = self._rows_pos + rows * _row.size
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._rows = 0
+        self._strings = []
+        self._keys = None
+
+    def _string(self, i):
+        s = self._strings[i]
+        if s is None:
+            pos = self._offsets_pos + i * _offset.size
+            start, end = struct.unpack_from('<II', self._map, pos)
+            s = self._map[self._data_pos + start:self._data_pos + end]
+            if is_py3k:
+                s = s.decode('utf8')
+            self._strings[i] = s
+        return s
+
+    def _get_row(self, i):
+        return _row.unpack_from(self._map, self._rows_pos + i * _row.size)
+
+    def __len__(self):
+        return self._rows
+
+    def __iter__(self):
+        for i in range(self._rows):
+            yield IndexEntry(self, self._get_row(i))
+
+    def _key_ranges(self):
+        if self._keys is None:
+            self._keys = {}
+            for i, entry in enumerate(self):
+                key = entry.key
+                start = self._keys.get(key, (i,))[0]
+                self._keys[key] = (start, i + 1)
+        return self._keys
+
+    def versions(self, key):
+        """Return the entries of all versions of a package key."""
+        start, end = self._key_ranges().get(key, (0, 0))
+        return [IndexEntry(self, self._get_row(i)) for i in range(start, end)]
+
+    def covers(self, repo):
+        """Determine if the index was updated from a repo."""
+        location = getattr(repo, 'location', None)
+        return location is not None and \
+            location == getattr(self.repo, 'location', None)
+
+    def itermatch(self, restrict):
+        """Iterate over the entries matching a package restriction.
+
+        USE deps of atoms are ignored, entries don't have any USE flags
+        enabled (same as the packages of an unconfigured repo). Invalid
+        entries are matched using their empty or stale metadata.
+        """
+        if getattr(restrict, 'use', None):
+            restrict = atoms.cache.strip_use(restrict)
+        key = getattr(restrict, 'key', None)
+        entries = self if key is None else self.versions(key)
+        match = restrict.match
+        for entry in entries:
+            if match(entry):
+                yield entry
+
+    def update(self, repo):
+        """Bring the index up to date with the metadata cache of a repo.
+
+        The updated index is written out and mapped in place of the old one
+        if any entries changed.
+        """
+        self.repo = repo
+        old = {}
+        for entry in self:
+            old[entry.cpvstr] = entry._row
+
+        # eclasses of repos later in the list override earlier ones
+        self._eclass_md5s = {}
+        for tree in getattr(repo, 'trees', (repo,)):
+            eclass_dir = pjoin(tree.location, 'eclass')
+            try:
+                names = listdir_files(eclass_dir)
+            except EnvironmentError:
+                continue
+            for name in names:
+                if name.endswith('.eclass'):
+                    try:
+                        self._eclass_md5s[name[:-len('.eclass')]] = _md5(
+                            pjoin(eclass_dir, name))
+                    except EnvironmentError:
+                        pass
+
+        cache_dir = pjoin(repo.location, 'metadata', 'md5-cache')
+        self.reindexed = 0
+        versions = []
+        for category in repo.categories:
+            try:
+                pkgdirs = listdir_dirs(pjoin(repo.location, category))
+            except EnvironmentError:
+                continue
+            for package in pkgdirs:
+                pkgdir = pjoin(repo.location, category, package)
+                try:
+                    files = listdir_files(pkgdir)
+                except EnvironmentError:
+                    continue
+                for name in files:
+                    if not name.endswith('.ebuild'):
+                        continue
+                    pf = name[:-len('.ebuild')]
+                    try:
+                        pkg = versioned_CPV('%s/%s' % (category, pf))
+                    except Exception:
+                        # invalid ebuild names get reported by the scan
+                        continue
+                    if pkg.package != package:
+                        continue
+                    ebuild_path = pjoin(pkgdir, name)
+                    ebuild_stat = _stat(ebuild_path)
+                    if ebuild_stat is None:
+                        continue
+                    cache_path = pjoin(cache_dir, category, pf)
+                    stats = ebuild_stat + (_stat(cache_path) or _NO_STAT)
+                    row = old.get(pkg.cpvstr)
+                    if row is not None and row[_EBUILD_MTIME:] == stats:
+                        values = tuple(
+                            self._string(x) for x in row[:_STATE])
+                        state = row[_STATE]
+                    else:
+                        values, state = self._index_entry(
+                            pkg, ebuild_path, cache_path)
+                        self.reindexed += 1
+                    versions.append((pkg, values, state, stats))
+        if not self.reindexed and len(versions) == self._rows:
+            # every row was copied over as is
+            return
+        versions.sort(key=lambda x: x[0])
+        self._write(versions)
+        self.load()
+
+    def _index_entry(self, pkg, ebuild_path, cache_path):
+        """Return the indexed values and cache entry state of an ebuild."""
+        values = (pkg.category, pkg.package, pkg.fullver)
+        try:
+            metadata, md5 = _parse_entry(cache_path)
+        except EnvironmentError:
+            return values + ('',) * (len(_COLUMNS) - 3), _UNCACHED
+        try:
+            state = _CACHED if md5 == _md5(ebuild_path) else _STALE
+        except EnvironmentError:
+            state = _STALE
+        return values + metadata, state
+
+    def _write(self, versions):
+        strings = {}
+        data = []
+        offsets = [0]
+        rows = []
+        for pkg, values, state, stats in versions:
+            ids = []
+            for value in values:
+                i = strings.get(value)
+                if i is None:
+                    i = strings[value] = len(data)
+                    if is_py3k:
+                        value = value.encode('utf8')
+                    data.append(value)
+                    offsets.append(offsets[-1] + len(value))
+                ids.append(i)
+            rows.append(_row.pack(*(ids + [state] + list(stats))))
+
+        tmp = '%s.%i' % (self.path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(_header.pack(
+                _MAGIC, self.format_version, len(data), len(rows)))
+            f.write(struct.pack('<%iI' % (len(offsets),), *offsets))
+            f.write(b''.join(rows))
+            f.write(b''.join(data))
+        os.rename(tmp, self.path)
+
+    def __str__(self):
+        return 'repo index: %i versions, %i reindexed' % (
+            self._rows, self.reindexed)
@@ -41,6 +41,7 @@ class UnusedGlobalFlagsCheck(base.Template):
 
     feed_type = base.versioned_feed
     scope = base.repository_scope
+    mergeable = True
     required_addons = (addons.UseAddon,)
     known_results = (UnusedGlobalFlags,) + addons.UseAddon.known_results
 
@@ -57,6 +58,15 @@ class UnusedGlobalFlagsCheck(base.Template):
         if self.flags:
             self.flags.difference_update(pkg.iuse_stripped)
 
+    def partial_state(self):
+        return self.flags
+
+    def merge_state(self, flags):
+        # flags are only dropped once used, so anything used in any of the
+        # shards is gone after intersecting
+        if self.flags:
+            self.flags.intersection_update(flags)
+
     def finish(self, reporter):
         if self.flags:
             reporter.add_report(UnusedGlobalFlags(self.flags))
@@ -85,6 +95,7 @@ class UnusedLicensesCheck(base.Template):
 
     feed_type = base.versioned_feed
     scope = base.repository_scope
+    mergeable = True
     known_results = (UnusedLicenses,)
 
     def __init__(self, options):
@@ -100,6 +111,12 @@ class UnusedLicensesCheck(base.Template):
     def feed(self, pkg, reporter):
         self.licenses.difference_update(iflatten_instance(pkg.license))
 
+    def partial_state(self):
+        return self.licenses
+
+    def merge_state(self, licenses):
+        self.licenses.intersection_update(licenses)
+
     def finish(self, reporter):
         if self.licenses:
             reporter.add_report(UnusedLicenses(self.licenses))
@@ -128,6 +145,7 @@ class UnusedMirrorsCheck(base.Template):
     required_addons = (addons.UseAddon,)
     feed_type = base.versioned_feed
     scope = base.repository_scope
+    mergeable = True
     known_results = (UnusedMirrors,) + addons.UseAddon.known_results
 
     def __init__(self, options, iuse_handler):
@@ -149,6 +167,13 @@ class UnusedMirrorsCheck(base.Template):
                     mirrors.append(m[0].mirror_name)
             self.mirrors.difference_update(mirrors)
 
+    def partial_state(self):
+        return self.mirrors
+
+    def merge_state(self, mirrors):
+        if self.mirrors:
+            self.mirrors.intersection_update(mirrors)
+
     def finish(self, reporter):
         if self.mirrors:
             reporter.add_report(UnusedMirrors(self.mirrors))
@@ -6,12 +6,18 @@
 """Basic reporters and reporter factories."""
 
 from pkgcore.config import configurable
-from snakeoil import formatters
+from snakeoil import compatibility, formatters
 from snakeoil.demandload import demandload
 
 from pkgcheck import base
 
+if compatibility.is_py3k:
+    demandload('queue@Queue')
+else:
+    demandload('Queue')
+
 demandload(
+    'threading',
     'xml.sax.saxutils:escape@xml_escape',
     'snakeoil:currying,pickling',
     'pkgcheck:errors',
@@ -185,11 +191,81 @@ class MultiplexReporter(base.Reporter):
         for x in self.reporters:
             x.add_report(result)
 
+    def start_check(self, source, target):
+        for x in self.reporters:
+            x.start_check(source, target)
+
+    def end_check(self):
+        for x in self.reporters:
+            x.end_check()
+
     def finish(self):
         for x in self.reporters:
             x.finish()
 
 
+class AsyncReporter(base.Reporter):
+    """Run another reporter in a separate thread.
+
+    Everything passed to this is queued up for the wrapped reporter in
+    order, the queue being bounded so a slow reporter throttles the scan
+    instead of growing the queue without limit. Exceptions raised by the
+    wrapped reporter are raised again in the calling thread on the next
+    call (at the latest by finish()).
+    """
+
+    def __init__(self, reporter, maxsize=1000):
+        base.Reporter.__init__(self)
+        self.reporter = reporter
+        self._queue = Queue.Queue(maxsize)
+        self._thread = None
+        self._exception = None
+
+    def _run(self):
+        get = self._queue.get
+        while True:
+            method, args = get()
+            if method is None:
+                break
+            # keep draining the queue after failures so callers don't block
+            if self._exception is None:
+                try:
+                    getattr(self.reporter, method)(*args)
+                except Exception as e:
+                    self._exception = e
+
+    def _put(self, method, *args):
+        if self._exception is not None:
+            raise self._exception
+        self._queue.put((method, args))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='reporter')
+        self._thread.daemon = True
+        self._thread.start()
+        self._put('start')
+
+    def add_report(self, result):
+        self._put('add_report', result)
+
+    def start_check(self, source, target):
+        self._put('start_check', source, target)
+
+    def end_check(self):
+        self._put('end_check')
+
+    def finish(self):
+        try:
+            self._put('finish')
+        finally:
+            # stop the thread even if the reporter already failed
+            self._queue.put((None, ()))
+            self._thread.join()
+            self._thread = None
+        if self._exception is not None:
+            raise self._exception
+
+
 def make_configurable_reporter_factory(klass):
     @configurable({'dest': 'str'}, typename='pkgcheck_reporter_factory')
     def configurable_reporter_factory(dest=None):
@@ -0,0 +1,330 @@
+# License: BSD/GPL2
+
+"""Persistent cache of check results for unchanged packages.
+
+Results of cacheable checks (see :obj:`pkgcheck.base.Template.cacheable`)
+are stored per package along with a fingerprint of everything they depend
+on: the files in the package's directory (ebuilds, Manifest, metadata.xml and
+anything under files/), the eclasses inherited by the versions fed, the repo
+config (e.g. layout.conf) and the arch/profile selection of the run. When a package is fed again with the same
+fingerprint its results get replayed instead of running the checks on it.
+
+File contents are only rehashed when their size or modification time
+changed, similar to how git's index avoids rereading unchanged files.
+"""
+
+import errno
+from itertools import groupby
+import os
+
+from snakeoil.demandload import demandload
+
+from pkgcheck import base
+
+demandload(
+    'hashlib',
+    'logging',
+    'snakeoil:pickling',
+    'snakeoil.osutils:pjoin',
+    'pkgcheck:__version__',
+)
+
+# options influencing the results of cacheable checks
+_selection_options = (
+    'arches', 'selected_arches', 'reference_arches', 'profiles',
+    'profiles_dir', 'profiles_ignore_deprecated',
+)
+
+# repo config files influencing the results of cacheable checks, e.g.
+# eapis-deprecated in layout.conf
+_config_files = (
+    'metadata/layout.conf', 'profiles/arch.list', 'profiles/arches.desc',
+)
+
+
+def _normalize(value):
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(x) for x in value)
+    return value
+
+
+def selection_fingerprint(options):
+    """Return a string identifying the settings cached results depend on."""
+    chf = hashlib.sha1()
+    chf.update(repr(__version__).encode())
+    repo = options.target_repo
+    chf.update(repr(getattr(repo, 'location', None)).encode())
+    for tree in getattr(repo, 'trees', (repo,)):
+        config = getattr(tree, 'config', None)
+        stable_arches = getattr(config, 'stable_arches', ())
+        chf.update(repr(tuple(sorted(stable_arches))).encode())
+        location = getattr(tree, 'location', None)
+        for path in _config_files:
+            data = None
+            if location is not None:
+                try:
+                    with open(pjoin(location, path), 'rb') as f:
+                        data = f.read()
+                except EnvironmentError:
+                    pass
+            chf.update(repr((path, data)).encode())
+    for attr in _selection_options:
+        chf.update(
+            repr((attr, _normalize(getattr(options, attr, None)))).encode())
+    return chf.hexdigest()
+
+
+def _item_pkgs(feed_type, item):
+    """Return the package versions making up a fed item."""
+    if feed_type == base.versioned_feed:
+        return (item,)
+    elif feed_type == base.ebuild_feed:
+        return (item[0],)
+    return item
+
+
+class ResultCache(object):
+    """Results of cacheable checks stored per package.
+
+    :ivar hits: number of cached check results replayed for a package
+    :ivar misses: number of times checks had to be run on a package
+    """
+
+    format_version = 1
+
+    def __init__(self, path, selection):
+        self.path = path
+        self.selection = selection
+        self.hits = self.misses = 0
+        # package key -> (fingerprint, {check name: results})
+        self._entries = {}
+        # path -> (mtime, size, content hash)
+        self._file_hashes = {}
+        # (package key, versions) -> fingerprint, valid for the current run
+        self._fingerprints = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickling.load(f)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        except Exception:
+            # corrupted or written by an incompatible version, start over
+            return
+        version, selection, entries, file_hashes = data
+        if version != self.format_version:
+            return
+        # file hashes don't depend on the selection, entries do
+        self._file_hashes = file_hashes
+        if selection == self.selection:
+            self._entries = entries
+
+    def save(self):
+        # drop hashes of removed files so they don't pile up
+        self._file_hashes = dict(
+            (path, value) for path, value in self._file_hashes.iteritems()
+            if os.path.lexists(path))
+        data = (self.format_version, self.selection, self._entries,
+                self._file_hashes)
+        tmp = '%s.%i' % (self.path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickling.dump(data, f, -1)
+        os.rename(tmp, self.path)
+
+    def _file_hash(self, path, st):
+        cached = self._file_hashes.get(path)
+        if cached is not None and cached[:2] == (st.st_mtime, st.st_size):
+            return cached[2]
+        chf = hashlib.sha1()
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    chf.update(chunk)
+        except EnvironmentError:
+            # dangling symlinks and the like, the mode still gets hashed
+            return None
+        digest = chf.hexdigest()
+        self._file_hashes[path] = (st.st_mtime, st.st_size, digest)
+        return digest
+
+    def fingerprint(self, pkgs):
+        """Return the fingerprint of the given versions of a package."""
+        key = (pkgs[0].key, tuple(pkg.cpvstr for pkg in pkgs))
+        fingerprint = self._fingerprints.get(key)
+        if fingerprint is not None:
+            return fingerprint
+
+        chf = hashlib.sha1()
+        chf.update(repr(key).encode())
+        pkgdir = os.path.dirname(pkgs[0].path)
+        for root, dirs, files in os.walk(pkgdir):
+            dirs.sort()
+            for name in sorted(files):
+                path = pjoin(root, name)
+                try:
+                    st = os.lstat(path)
+                except EnvironmentError:
+                    continue
+                chf.update(repr((path[len(pkgdir):], st.st_mode,
+                                 self._file_hash(path, st))).encode())
+        eclasses = {}
+        for pkg in pkgs:
+            eclasses.update(pkg.data.get('_eclasses_', {}))
+        for name in sorted(eclasses):
+            path = getattr(eclasses[name], 'path', None)
+            digest = None
+            if path is not None:
+                try:
+                    digest = self._file_hash(path, os.stat(path))
+                except EnvironmentError:
+                    pass
+            chf.update(repr((name, digest)).encode())
+
+        fingerprint = self._fingerprints[key] = chf.hexdigest()
+        return fingerprint
+
+    def lookup(self, key, fingerprint, name):
+        """Return the cached results of a check or None if there are none."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != fingerprint:
+            return None
+        return entry[1].get(name)
+
+    def store(self, key, fingerprint, name, results):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != fingerprint:
+            entry = self._entries[key] = (fingerprint, {})
+        entry[1][name] = results
+
+    def wrap(self, runner):
+        """Return a copy of a pipeline with cacheable checks using the cache."""
+        nodes = []
+        for node in runner.checks:
+            if isinstance(node, base.Transform):
+                node = node.__class__(self.wrap(node.child))
+            elif (getattr(node, 'cacheable', False) and
+                    node.scope <= base.package_scope):
+                node = CachedCheck(node, self)
+            nodes.append(node)
+        return base.CheckRunner(nodes)
+
+    def __str__(self):
+        return 'result cache: %i hits, %i misses' % (self.hits, self.misses)
+
+
+class _Recorder(object):
+    """Reporter passing results on while sorting them by package."""
+
+    def __init__(self, reporter, keys):
+        self.reporter = reporter
+        self.results = dict((key, []) for key in keys)
+        self.valid = True
+
+    def add_report(self, result):
+        results = self.results.get('%s/%s' % (
+            getattr(result, 'category', None),
+            getattr(result, 'package', None)))
+        if results is None:
+            # can't tell which package this belongs to, don't cache anything
+            self.valid = False
+        else:
+            results.append(result)
+        self.reporter.add_report(result)
+
+
+class CachedCheck(object):
+    """Stand-in for a check, replaying cached results for unchanged packages.
+
+    Only batches get cached, single items are passed straight on since they
+    don't necessarily cover all versions of a package. Results of packages
+    the check raised on aren't cached.
+
+    New cache entries and hit counts are collected and only applied to the
+    cache when finishing. These get handed over using the mergeable sink API
+    so they make it back from the worker processes of parallel runs.
+    """
+
+    mergeable = True
+
+    def __init__(self, sink, cache):
+        self.sink = sink
+        self.cache = cache
+        self.name = sink.__class__.__name__
+        self.feed_type = sink.feed_type
+        self.scope = sink.scope
+        self.priority = sink.priority
+        self._started = False
+        self._updates = []
+        self._hits = self._misses = 0
+
+    def start(self):
+        # parallel runs restart mergeable sinks for every shard, the check
+        # itself only needs to be started once
+        if not self._started:
+            self.sink.start()
+            self._started = True
+        self._updates = []
+        self._hits = self._misses = 0
+
+    def feed(self, item, reporter):
+        self.sink.feed(item, reporter)
+
+    def feed_batch(self, items, reporter):
+        for key, group in groupby(
+                items, lambda x: _item_pkgs(self.feed_type, x)[0].key):
+            group = list(group)
+            pkgs = [pkg for item in group
+                    for pkg in _item_pkgs(self.feed_type, item)]
+            fingerprint = self.cache.fingerprint(pkgs)
+            results = self.cache.lookup(key, fingerprint, self.name)
+            if results is None:
+                self._misses += 1
+                self._run(key, fingerprint, group, reporter)
+                continue
+            self._hits += 1
+            for result in results:
+                reporter.add_report(result)
+
+    def _run(self, key, fingerprint, items, reporter):
+        # Items are fed one at a time since feed_batch() logs and skips the
+        # ones raising, a package the check failed on must not be cached as
+        # having no results.
+        recorder = _Recorder(reporter, [key])
+        for item in items:
+            try:
+                self.sink.feed(item, recorder)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception:
+                logging.exception('check %r raised', self.sink)
+                recorder.valid = False
+        if recorder.valid:
+            self._updates.append(
+                (key, fingerprint, tuple(recorder.results[key])))
+
+    def partial_state(self):
+        return self._updates, self._hits, self._misses
+
+    def merge_state(self, state):
+        updates, hits, misses = state
+        self._updates.extend(updates)
+        self._hits += hits
+        self._misses += misses
+
+    def finish(self, reporter):
+        for key, fingerprint, results in self._updates:
+            self.cache.store(key, fingerprint, self.name, results)
+        self.cache.hits += self._hits
+        self.cache.misses += self._misses
+        self._updates = []
+        self._hits = self._misses = 0
+        self.sink.finish(reporter)
+
+    def __repr__(self):
+        return repr(self.sink)
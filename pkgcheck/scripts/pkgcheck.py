@@ -14,20 +14,22 @@ from snakeoil.demandload import demandload
 from snakeoil.formatters import decorate_forced_wrapping
 from snakeoil.sequences import unstable_unique
 
-from pkgcheck import plugins, base, feeds
+from pkgcheck import plugins, base, feeds, parallel
 
 demandload(
+    'json',
     'logging',
     'os',
     'sys',
     'textwrap',
     'pkgcore.ebuild:repository',
-    'pkgcore.restrictions:packages',
+    'pkgcore.restrictions:packages,values',
     'pkgcore.restrictions.values:StrExactMatch',
     'pkgcore.repository:multiplex',
     'snakeoil.osutils:abspath',
     'snakeoil.sequences:iflatten_instance',
-    'pkgcheck:errors',
+    'pkgcheck:addons,atoms,eclass_index,errors,git,profiling,regen,repo_index,'
+    'reporters,result_cache',
 )
 
 argparser = commandline.ArgumentParser(
@@ -52,6 +54,140 @@ main_options.add_argument(
 main_options.add_argument(
     '--reporter', action='store', default=None,
     help="use a non-default reporter (defined in pkgcore's config)")
+main_options.add_argument(
+    '--commits', metavar='REF',
+    help='scan the packages changed relative to a git ref',
+    docs="""
+        Scan the packages changed in the target repo's git checkout relative
+        to REF (e.g. origin/master or HEAD), in place of explicit targets.
+
+        Committed, staged and unstaged changes are included, as are files
+        unknown to git. Packages inheriting a changed eclass get scanned too.
+        If --git-rev is given, the changes between REF and that revision
+        are used instead.
+    """)
+main_options.add_argument(
+    '--git-rev', metavar='REV',
+    help='scan the packages of the target repo at a git revision',
+    docs="""
+        Read the packages to scan straight from the target repo's git objects
+        at REV (e.g. a commit id or branch name) instead of from its
+        working tree, so any revision can be scanned without checking it out.
+
+        Package metadata is only taken from the md5-cache entries committed
+        at REV, packages lacking an up to date entry get reported as having
+        invalid metadata. Repo-wide data such as profiles, licenses and the
+        repos used for dependency lookups, as well as checks inspecting
+        package directories directly, still use the working tree.
+    """)
+main_options.add_argument(
+    '--eclass-index', metavar='FILE',
+    help='keep an index of the eclasses inherited by each package in FILE',
+    docs="""
+        Keep an index of the eclasses inherited by each package of the target
+        repo in FILE, updating it at the start of every run. Only packages
+        whose ebuild or metadata cache entry changed since the last run get
+        their metadata reloaded. The file is created if it doesn't exist yet.
+
+        The index is used to find the packages inheriting changed eclasses
+        for --commits and --changed-eclasses.
+    """)
+main_options.add_argument(
+    '--changed-eclasses', action='store_true', default=False,
+    help='scan the packages inheriting eclasses changed since the last run',
+    docs="""
+        Scan the packages inheriting eclasses that were added, removed or
+        edited since the last run using this option that finished, in place
+        of explicit targets. Requires --eclass-index.
+    """)
+main_options.add_argument(
+    '--repo-index', metavar='FILE', dest='repo_index_path',
+    help='keep a memory-mapped index of the metadata cache in FILE',
+    docs="""
+        Keep a compact binary index of the metadata cache of the target repo
+        in FILE, updating it at the start of every run. Only cache entries
+        that changed since the last run get parsed again and the file is
+        only rewritten if any did. The file is created if it doesn't exist
+        yet.
+
+        Checks supporting it (currently MissingSlotDepReport) query package
+        metadata from the index instead of loading it through package
+        objects, except for ebuilds with missing or stale cache entries.
+    """)
+main_options.add_argument(
+    '-j', '--jobs', type=int, default=1, metavar='JOBS',
+    help='number of processes to run checks in (default: 1)',
+    docs="""
+        Number of processes to split the scan across.
+
+        Checks that never need to see more than a single category at a time
+        are run for each category in separate processes, all other checks
+        are run in the main process. Results are reported in the same order
+        as in a serial run. The selected profiles get set up in parallel as
+        well.
+    """)
+main_options.add_argument(
+    '--regen', action='store_true', default=False,
+    help='regenerate stale metadata cache entries of the targets up front',
+    docs="""
+        Regenerate the stale metadata cache entries of the targeted packages
+        before running any checks, using as many ebuild processors in
+        parallel as --jobs allows.
+
+        Otherwise stale entries get regenerated one at a time as checks
+        access package metadata. Regeneration throughput is shown once done.
+    """)
+main_options.add_argument(
+    '--prefetch', type=int, default=0, metavar='PACKAGES',
+    help='number of packages to read ahead in the background (default: 0)',
+    docs="""
+        Number of packages to read ahead of the one currently being checked.
+
+        Background threads pull the ebuilds and metadata cache entries of
+        upcoming packages from disk while checks run so I/O isn't waiting on
+        CPU work and vice versa. Statistics on how often the prefetching
+        kept up are shown at the end of the run. Disabled by default.
+    """)
+main_options.add_argument(
+    '--reporter-queue', type=int, default=0, metavar='SIZE',
+    help='run the reporter in a separate thread with a queue of the '
+         'given size (default: 0, disabled)',
+    docs="""
+        Run the reporter in a separate thread, passing results to it through
+        a queue holding at most SIZE entries.
+
+        This keeps a slow output target (e.g. a pipe to a slow consumer or a
+        file on a network filesystem) from stalling checks until the queue
+        fills up. Results are still reported in the same order.
+    """)
+main_options.add_argument(
+    '--profile-checks', action='store_true', default=False,
+    help='show the time spent in each check and transform')
+main_options.add_argument(
+    '--profile-checks-json', metavar='FILE',
+    help='write the time spent in each check and transform to FILE as JSON',
+    docs="""
+        Write per check and transform statistics to FILE as a JSON object
+        mapping their names to the number of feed calls, items fed, results
+        emitted and the wall clock and CPU time spent. Implies
+        --profile-checks.
+
+        Times are exclusive of the time spent in checks fed by a transform.
+        When running with multiple jobs the times spent in all processes
+        are added up.
+    """)
+main_options.add_argument(
+    '--result-cache', metavar='FILE',
+    help='reuse results of checks for unchanged packages stored in FILE',
+    docs="""
+        Store the results of checks that only depend on a package's own
+        files in FILE and reuse them for packages that didn't change since.
+
+        Packages are considered unchanged if the files in their directory,
+        the eclasses inherited by the scanned versions and the selected
+        arches and profiles are the same as when the stored results were
+        gathered. The file is created if it doesn't exist yet.
+    """)
 list_options = main_options.add_mutually_exclusive_group()
 list_options.add_argument(
     '--list-checks', action='store_true', default=False,
@@ -98,6 +234,13 @@ def check_args(parser, namespace):
         # no need to check any other args
         return
 
+    if namespace.jobs < 1:
+        parser.error('--jobs must be a positive integer')
+    if namespace.prefetch < 0:
+        parser.error('--prefetch must not be negative')
+    if namespace.reporter_queue < 0:
+        parser.error('--reporter-queue must not be negative')
+
     cwd = abspath(os.getcwd())
     if namespace.suite is None:
         # No suite explicitly specified. Use the repo to guess the suite.
@@ -206,7 +349,59 @@ def check_args(parser, namespace):
 
     namespace.repo_bases = [abspath(repo.location) for repo in reversed(namespace.target_repo.trees)]
 
-    if namespace.targets:
+    # repo the scanned packages are read from
+    namespace.source_repo = namespace.target_repo
+    if namespace.git_rev:
+        if not getattr(namespace.target_repo, 'location', None):
+            parser.error('--git-rev requires a target repo that is not multi-tree')
+        if namespace.result_cache:
+            parser.error('--git-rev and --result-cache are mutually exclusive')
+        if namespace.regen:
+            parser.error('--git-rev and --regen are mutually exclusive')
+        try:
+            namespace.source_repo = git.GitTree(
+                namespace.target_repo.location, namespace.git_rev,
+                repo_id=namespace.target_repo.repo_id,
+                base_repo=namespace.target_repo)
+        except errors.GitError as e:
+            parser.error(e)
+
+    namespace.inheritance_index = None
+    if namespace.eclass_index:
+        if not getattr(namespace.target_repo, 'location', None):
+            parser.error('--eclass-index requires a target repo that is not multi-tree')
+        if namespace.git_rev:
+            parser.error('--eclass-index and --git-rev are mutually exclusive')
+        # updated by main() right before the scan
+        namespace.inheritance_index = eclass_index.EclassIndex(
+            namespace.eclass_index)
+    elif namespace.changed_eclasses:
+        parser.error('--changed-eclasses requires --eclass-index')
+
+    namespace.repo_index = None
+    if namespace.repo_index_path:
+        if not getattr(namespace.target_repo, 'location', None):
+            parser.error('--repo-index requires a target repo that is not multi-tree')
+        if namespace.git_rev:
+            parser.error('--repo-index and --git-rev are mutually exclusive')
+        index = repo_index.RepoIndex(namespace.repo_index_path)
+        index.update(namespace.target_repo)
+        namespace.repo_index = index
+
+    if namespace.changed_eclasses:
+        if namespace.targets or namespace.commits:
+            parser.error(
+                '--changed-eclasses, --commits and targets are mutually exclusive')
+        # resolved by main() once the eclass index is up to date
+        namespace.limiters = None
+    elif namespace.commits:
+        if namespace.targets:
+            parser.error('--commits and targets are mutually exclusive')
+        if not getattr(namespace.target_repo, 'location', None):
+            parser.error('--commits requires a target repo that is not multi-tree')
+        # resolved by main() once the eclass index is up to date
+        namespace.limiters = None
+    elif namespace.targets:
         limiters = []
         repo = namespace.target_repo
 
@@ -256,6 +451,28 @@ def check_args(parser, namespace):
     if not namespace.checks:
         parser.error('no active checks')
 
+    # Drop checks that can't run for any of the targets before setting up
+    # addons so their (possibly expensive) setup gets skipped.
+    transforms = list(get_plugins('transform', plugins))
+    limiters = namespace.limiters
+    if limiters is None:
+        # changed packages are matched by their key once they're known
+        limiters = [packages.PackageRestriction('package', values.AlwaysTrue)]
+    elif not limiters:
+        # nothing gets scanned, plan for the widest scope
+        limiters = [packages.AlwaysTrue]
+    scoped_limiters = {}
+    for limiter in limiters:
+        scoped_limiters.setdefault(feeds.restriction_scope(limiter), limiter)
+    reachable = set()
+    for limiter in scoped_limiters.itervalues():
+        source = feeds.RestrictedRepoSource(namespace.source_repo, limiter)
+        bad_checks, pipes = base.plug(namespace.checks, transforms, [source])
+        reachable.update(set(namespace.checks).difference(bad_checks))
+    namespace.unreachable_checks = [
+        x for x in namespace.checks if x not in reachable]
+    namespace.checks = [x for x in namespace.checks if x in reachable]
+
     namespace.addons = set()
 
     def add_addon(addon):
@@ -372,6 +589,25 @@ def display_reporters(out, config, config_reporters, plugin_reporters):
         out.write()
 
 
+def report_unreachable(err, bad_sinks, transforms, repo):
+    """Complain about sinks that can't be connected to the source.
+
+    We want to report the ones that would work if this was a full repo scan
+    separately from the ones that are actually missing transforms.
+    """
+    full_scope = feeds.RestrictedRepoSource(repo, packages.AlwaysTrue)
+    really_bad, ignored = base.plug(bad_sinks, transforms, [full_scope])
+    really_bad = set(really_bad)
+    for sink in bad_sinks:
+        if sink in really_bad:
+            err.error(
+                'sink %s could not be connected (missing transforms?)' % (
+                    sink,))
+        else:
+            name = getattr(sink, '__name__', sink.__class__.__name__)
+            err.warn('not running %s (not a full repo scan)' % (name,))
+
+
 @argparser.bind_main_func
 def main(options, out, err):
     """Do stuff."""
@@ -402,6 +638,35 @@ def main(options, out, err):
     if options.guessed_target_repo:
         err.write('using repository guessed from working directory')
 
+    if options.inheritance_index is not None:
+        index = options.inheritance_index
+        index.update(options.target_repo)
+        # the baseline only moves forward once the changes got scanned
+        index.save(advance=False)
+        err.write(str(index))
+    if options.limiters is None:
+        try:
+            if options.changed_eclasses:
+                restrict = options.inheritance_index.restrict(
+                    options.target_repo,
+                    options.inheritance_index.changed_eclasses())
+            else:
+                restrict = git.changed_restrict(
+                    options.source_repo, options.commits, options.git_rev,
+                    options.inheritance_index)
+        except errors.GitError as e:
+            err.write(
+                err.fg('red'), err.bold, '!!! ', err.reset,
+                'Error finding changed packages: ', e)
+            return 1
+        options.limiters = [restrict] if restrict is not None else []
+    if options.repo_index is not None:
+        err.write(str(options.repo_index))
+    if options.changed_eclasses and not options.limiters:
+        err.write('no packages affected by eclass changes')
+    elif options.commits and not options.limiters:
+        err.write('no packages changed relative to %s' % (options.commits,))
+
     try:
         reporter = options.reporter(out)
     except errors.ReporterInitError as e:
@@ -409,6 +674,8 @@ def main(options, out, err):
             err.fg('red'), err.bold, '!!! ', err.reset,
             'Error initializing reporter: ', e)
         return 1
+    if options.reporter_queue:
+        reporter = reporters.AsyncReporter(reporter, options.reporter_queue)
 
     addons_map = {}
 
@@ -444,46 +711,90 @@ def main(options, out, err):
     sinks = list(addon for addon in addons_map.itervalues()
                  if getattr(addon, 'feed_type', False))
 
+    if options.unreachable_checks:
+        report_unreachable(
+            err, options.unreachable_checks, transforms, options.target_repo)
+
+    prefetch = feeds.Prefetcher(options.prefetch)
+    profiler = None
+    if options.profile_checks or options.profile_checks_json:
+        profiler = profiling.Profiler()
+    cache = None
+    if options.result_cache:
+        cache = result_cache.ResultCache(
+            options.result_cache, result_cache.selection_fingerprint(options))
+    if options.regen and options.limiters:
+        regen_pass = regen.Regen(options.jobs)
+        regen_pass.run(options.source_repo, options.limiters)
+        err.write(str(regen_pass))
+
     reporter.start()
 
+    # Targets sharing the same scope get the same set of checks run on them,
+    # so they're scanned together in a single pass.
+    scopes = []
+    scoped_limiters = {}
     for filterer in options.limiters:
-        sources = [feeds.RestrictedRepoSource(options.target_repo, filterer)]
-        bad_sinks, pipes = base.plug(sinks, transforms, sources, debug)
+        scope = feeds.restriction_scope(filterer)
+        if scope not in scoped_limiters:
+            scopes.append(scope)
+        scoped_limiters.setdefault(scope, []).append(filterer)
+
+    for filterers in (scoped_limiters[scope] for scope in scopes):
+        if len(filterers) == 1:
+            source = feeds.RestrictedRepoSource(
+                options.source_repo, filterers[0])
+        else:
+            source = feeds.CombinedRepoSource(options.source_repo, filterers)
+        if sinks:
+            bad_sinks, pipes = base.plug(sinks, transforms, [source], debug)
+        else:
+            bad_sinks, pipes = [], ()
         if bad_sinks:
-            # We want to report the ones that would work if this was a
-            # full repo scan separately from the ones that are
-            # actually missing transforms.
-            bad_sinks = set(bad_sinks)
-            full_scope = feeds.RestrictedRepoSource(
-                options.target_repo, packages.AlwaysTrue)
-            really_bad, ignored = base.plug(sinks, transforms, [full_scope])
-            really_bad = set(really_bad)
-            assert bad_sinks >= really_bad, \
-                '%r unreachable with no limiters but reachable with?' % (
-                    really_bad - bad_sinks,)
-            out_of_scope = bad_sinks - really_bad
-            for sink in really_bad:
-                err.error(
-                    'sink %s could not be connected (missing transforms?)' % (
-                        sink,))
-            for sink in bad_sinks - really_bad:
-                err.warn('not running %s (not a full repo scan)' % (
-                    sink.__class__.__name__,))
+            report_unreachable(err, bad_sinks, transforms, options.target_repo)
         if not pipes:
             out.write(out.fg('red'), ' * ', out.reset, 'No checks!')
         else:
             if options.debug:
                 err.write('Running %i tests' % (len(sinks) - len(bad_sinks),))
             for source, pipe in pipes:
-                pipe.start()
-                reporter.start_check(
-                    list(base.collect_checks_classes(pipe)), filterer)
-                for thing in source.feed():
-                    pipe.feed(thing, reporter)
-                pipe.finish(reporter)
+                checks = list(base.collect_checks_classes(pipe))
+                if cache is not None:
+                    pipe = cache.wrap(pipe)
+
+                def feed():
+                    # emit the headers for each target as we reach it
+                    for i, (target, items) in enumerate(source.itertargets()):
+                        if i:
+                            reporter.end_check()
+                        reporter.start_check(checks, target)
+                        for batch in feeds.category_batches(prefetch(items)):
+                            yield batch
+
+                parallel.run(
+                    source, pipe, reporter, options.jobs, feed(), profiler)
                 reporter.end_check()
 
     reporter.finish()
+    prefetch.close()
+    if options.prefetch:
+        err.write(str(prefetch))
+    if cache is not None:
+        cache.save()
+        err.write(str(cache))
+    if options.changed_eclasses:
+        options.inheritance_index.save()
+    if profiler is not None:
+        for line in profiler.format():
+            err.write(line)
+        query_cache = addons_map.get(addons.QueryCacheAddon)
+        if query_cache is not None:
+            # only covers the main process when running with multiple jobs
+            err.write(str(query_cache.query_cache))
+        err.write(str(atoms.cache))
+        if options.profile_checks_json:
+            with open(options.profile_checks_json, 'w') as f:
+                json.dump(profiler.as_dict(), f, indent=2, sort_keys=True)
 
     # flush stdout first; if they're directing it all to a file, this makes
     # results not get the final message shoved in midway
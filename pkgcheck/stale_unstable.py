@@ -3,7 +3,7 @@
 
 import time
 
-from pkgcheck.addons import ArchesAddon, StableCheckAddon
+from pkgcheck.addons import ArchesAddon, KeywordsAddon, StableCheckAddon
 from pkgcheck.base import versioned_feed, Warning
 
 day = 24*3600
@@ -32,14 +32,15 @@ class StaleUnstableReport(StableCheckAddon):
     """Ebuilds that have sat unstable for over a month."""
 
     feed_type = versioned_feed
-    required_addons = (ArchesAddon,)
+    required_addons = (ArchesAddon, KeywordsAddon)
     known_results = (StaleUnstable,)
 
-    def __init__(self, options, arches, staleness=long(day*30)):
+    def __init__(self, options, arches, keywords, staleness=long(day*30)):
         super(StaleUnstableReport, self).__init__(options)
         self.staleness = staleness
         self.start_time = None
-        self.arches = frozenset("~%s" % x.lstrip("~") for x in self.arches)
+        self.keywords = keywords
+        self.arches = keywords.mask(self.arches)
 
     def start(self):
         self.start_time = time.time()
@@ -48,8 +49,8 @@ class StaleUnstableReport(StableCheckAddon):
         unchanged_time = self.start_time - pkg._mtime_
         if unchanged_time < self.staleness:
             return
-        unstable = [arch for arch in pkg.keywords if arch in self.arches]
-        if not unstable:
-            return
-        reporter.add_report(
-            StaleUnstable(pkg, unstable, int(unchanged_time/day)))
+        unstable = self.keywords.encode(pkg.keywords)[1] & self.arches
+        if unstable:
+            reporter.add_report(StaleUnstable(
+                pkg, ["~%s" % arch for arch in self.keywords.names(unstable)],
+                int(unchanged_time/day)))
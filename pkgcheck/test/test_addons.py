@@ -8,6 +8,7 @@ import shutil
 import sys
 
 from pkgcore.ebuild import repo_objs
+from pkgcore.ebuild.atom import atom
 from pkgcore.restrictions import packages
 from pkgcore.test import TestCase
 from pkgcore.util import commandline
@@ -74,30 +75,84 @@ class TestArchesAddon(base_test):
 class TestQueryCacheAddon(base_test):
 
     addon_kls = addons.QueryCacheAddon
-    default_feed = base.package_feed
+    default_feed = None
 
     def test_opts(self):
         for val, ret in (('version', base.versioned_feed),
                          ('package', base.package_feed),
-                         ('category', base.repository_feed)):
+                         ('category', base.category_feed)):
             self.process_check(
                 ['--reset-caching-per', val],
                 query_caching_freq=ret, silence=True)
+        self.process_check(
+            ['--query-cache-size', '10'], query_cache_size=10, silence=True)
 
     def test_default(self):
         self.process_check(
-            [], silence=True, query_caching_freq=self.default_feed)
+            [], silence=True, query_caching_freq=self.default_feed,
+            query_cache_size=100000)
 
     def test_feed(self):
         options = self.process_check([], silence=True)
         check = self.addon_kls(options)
         check.start()
-        self.assertEqual(check.feed_type, self.default_feed)
+        self.assertEqual(check.feed_type, None)
+        check.query_cache["boobies"] = "hooray for"
+        self.assertEqual(check.query_cache["boobies"], "hooray for")
+
+        options = self.process_check(
+            ['--reset-caching-per', 'package'], silence=True)
+        check = self.addon_kls(options)
+        check.start()
+        self.assertEqual(check.feed_type, base.package_feed)
         check.query_cache["boobies"] = "hooray for"
         check.feed(None, None)
         self.assertFalse(check.query_cache)
 
 
+class TestQueryCache(TestCase):
+
+    def test_lru(self):
+        cache = addons.QueryCache(5)
+        cache['a'] = (1, 2)
+        cache['b'] = ()
+        cache['c'] = (1,)
+        self.assertEqual(cache.weight, 4)
+        # mark 'a' as recently used
+        self.assertEqual(cache['a'], (1, 2))
+        cache['d'] = (1, 2)
+        self.assertEqual(sorted(cache._entries), ['a', 'c', 'd'])
+        self.assertEqual(cache.weight, 5)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertRaises(KeyError, cache.__getitem__, 'b')
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        # replacing entries updates the weight
+        cache['c'] = (1, 2, 3)
+        self.assertEqual(sorted(cache._entries), ['c', 'd'])
+        self.assertEqual(cache.weight, 5)
+
+        # oversized entries stay until the next insertion
+        cache['e'] = tuple(range(10))
+        self.assertEqual(list(cache._entries), ['e'])
+        cache['f'] = ()
+        self.assertEqual(list(cache._entries), ['f'])
+        self.assertEqual(cache.evictions, 5)
+
+        cache.clear()
+        self.assertEqual((len(cache), cache.weight), (0, 0))
+        self.assertEqual(
+            str(cache), 'query cache: 1 hits, 2 misses, 5 evictions')
+
+    def test_unbounded(self):
+        cache = addons.QueryCache()
+        for i in range(100):
+            cache[i] = tuple(range(i))
+        self.assertEqual(len(cache), 100)
+        self.assertEqual(cache.evictions, 0)
+
+
 class Test_profile_data(TestCase):
 
     def assertResults(self, profile, known_flags, required_immutable,
@@ -198,7 +253,7 @@ class profile_mixin(mixins.TempDirMixin, base_test):
             repo = QuietRepoConfig(self.dir)
         else:
             repo = QuietRepoConfig(profiles_base, profiles_base='.')
-        namespace.target_repo = Options(config=repo)
+        namespace.target_repo = Options(config=repo, trees=())
         namespace.search_repo = Options()
         options = base_test.process_check(self, namespace=namespace, *args, **kwds)
         return options
@@ -282,6 +337,106 @@ class TestProfileAddon(profile_mixin):
         check = self.addon_kls(options)
         self.assertProfiles(check, 'x86', 'default-linux')
 
+    def test_profile_cache(self):
+        self.mk_profiles({
+            'default-linux': ['x86'],
+            'default-linux/x86': ["x86"],
+            'default-linux/ppc': ['ppc']},
+            base='foo')
+        with open(pjoin(self.dir, 'foo', 'default-linux', 'use.mask'), 'w') as f:
+            f.write("lib\n")
+        with open(pjoin(self.dir, 'foo', 'default-linux', 'x86',
+                        'package.provided'), 'w') as f:
+            f.write("dev-util/provided-1\n")
+        cache = pjoin(self.dir, 'profiles.cache')
+
+        def run_check():
+            options = self.process_check(
+                pjoin(self.dir, 'foo'), ['--profile-cache', cache])
+            return options.profile_snapshot is not None, self.addon_kls(options)
+
+        cached, check = run_check()
+        self.assertFalse(cached)
+        self.assertTrue(os.path.exists(cache))
+        cached, cached_check = run_check()
+        self.assertTrue(cached)
+
+        for key in ('x86', '~x86', 'ppc', '~ppc'):
+            self.assertEqual(
+                [[x.name for x in group] for group in check.profile_evaluate_dict[key]],
+                [[x.name for x in group] for group in cached_check.profile_evaluate_dict[key]])
+        self.assertEqual(list(check.keywords_filter), list(cached_check.keywords_filter))
+        pkg = FakePkg("dev-util/foo-1", data={'KEYWORDS': 'x86'})
+        self.assertEqual(
+            sorted(x.name for y in cached_check.identify_profiles(pkg) for x in y),
+            ['default-linux', 'default-linux/x86'])
+        profiles = dict((x.name, x) for x in cached_check.profile_filters['x86'])
+        self.assertTrue(
+            profiles['default-linux/x86'].provides_has_match(atom("dev-util/provided")))
+        self.assertFalse(
+            profiles['default-linux'].provides_has_match(atom("dev-util/provided")))
+        self.assertEqual(
+            sorted(profiles['default-linux'].masked_use.pull_data(pkg)),
+            ['lib', 'ppc'])
+
+        # changing the profiles or the selection invalidates the cache
+        with open(pjoin(self.dir, 'foo', 'default-linux', 'use.force'), 'w') as f:
+            f.write("foo\n")
+        self.assertFalse(run_check()[0])
+        self.assertTrue(run_check()[0])
+        options = self.process_check(
+            pjoin(self.dir, 'foo'), ['--profile-cache', cache,
+                                     '--profiles', 'default-linux'])
+        self.assertEqual(options.profile_snapshot, None)
+
+    def test_parallel(self):
+        self.mk_profiles({
+            'default-linux': ['x86'],
+            'default-linux/x86': ["x86"],
+            'default-linux/ppc': ['ppc', False, True]},
+            base='foo')
+        with open(pjoin(self.dir, 'foo', 'default-linux', 'use.mask'), 'w') as f:
+            f.write("lib\n")
+        with open(pjoin(self.dir, 'foo', 'default-linux', 'x86',
+                        'package.provided'), 'w') as f:
+            f.write("dev-util/provided-1\n")
+
+        def run_check(jobs, *args):
+            options = self.process_check(
+                pjoin(self.dir, 'foo'), list(args), preset_values={'jobs': jobs})
+            return options, self.addon_kls(options)
+
+        pkg = FakePkg("dev-util/foo-1", data={'KEYWORDS': 'x86'})
+        serial = run_check(1)[1]
+        options, check = run_check(2)
+        self.assertEqual(
+            sorted((arch, path, p.deprecated is not None)
+                   for arch, l in options.arch_profiles.iteritems() for path, p in l),
+            [('ppc', 'default-linux/ppc', True),
+             ('x86', 'default-linux', False), ('x86', 'default-linux/x86', False)])
+        # created in the workers instead of falling back to the parent
+        self.assertTrue(all(
+            isinstance(p, addons._LoadedProfile)
+            for l in options.arch_profiles.itervalues() for path, p in l))
+        for key in ('x86', '~x86', 'ppc', '~ppc'):
+            self.assertEqual(
+                [[x.name for x in group] for group in serial.profile_evaluate_dict[key]],
+                [[x.name for x in group] for group in check.profile_evaluate_dict[key]])
+        profiles = dict((x.name, x) for x in check.profile_filters['x86'])
+        self.assertTrue(
+            profiles['default-linux/x86'].provides_has_match(atom("dev-util/provided")))
+        self.assertEqual(
+            sorted(profiles['default-linux'].masked_use.pull_data(pkg)),
+            ['lib', 'ppc'])
+        self.assertEqual(
+            sorted(x.name for y in check.identify_profiles(pkg) for x in y),
+            ['default-linux', 'default-linux/x86'])
+
+        options = run_check(2, '--profiles-disable-deprecated')[0]
+        self.assertEqual(sorted(options.arch_profiles), ['x86'])
+        self.assertRaises(
+            SystemExit, run_check, 2, '--profiles', 'default-linux,nonexistent')
+
     def test_identify_profiles(self):
         self.mk_profiles({
             'default-linux': ['x86'],
@@ -353,6 +508,44 @@ class TestProfileAddon(profile_mixin):
         self.assertEqual(len(check.profile_evaluate_dict['x86']), 1)
 
 
+    def test_visibility_classes(self):
+        self.mk_profiles({
+            'default-linux': ['x86'],
+            'default-linux/x86': ["x86"],
+            'default-linux/amd64': ["x86"]},
+            base='foo')
+        options = self.process_check(pjoin(self.dir, 'foo'), [])
+        check = self.addon_kls(options)
+        # identical masks share a single visibility evaluation
+        for key in ('x86', '~x86'):
+            self.assertEqual(len(check.visibility_classes[key]), 1)
+
+        # use a fresh path, sidestepping ProfileNode instance caching
+        path = pjoin(self.dir, 'bar')
+        shutil.copytree(pjoin(self.dir, 'foo'), path, symlinks=True)
+        with open(pjoin(path, 'default-linux', 'x86', 'package.mask'), 'w') as f:
+            f.write("dev-util/masked\n")
+        options = self.process_check(path, [])
+        check = self.addon_kls(options)
+        self.assertEqual(
+            sorted(sorted(x.name for x in profiles)
+                   for match, profiles in check.visibility_classes['x86']),
+            [['default-linux', 'default-linux/amd64'], ['default-linux/x86']])
+        # use data is still shared across visibility classes
+        self.assertEqual(len(check.profile_evaluate_dict['x86']), 1)
+
+        l = check.identify_profiles(
+            FakePkg("dev-util/masked-1", data={'KEYWORDS': '~x86'}))
+        self.assertEqual(
+            [sorted(x.name for x in y) for y in l],
+            [['default-linux', 'default-linux/amd64']])
+        l = check.identify_profiles(
+            FakePkg("dev-util/foo-1", data={'KEYWORDS': 'x86'}))
+        self.assertEqual(
+            [sorted(x.name for x in y) for y in l],
+            [['default-linux', 'default-linux/amd64', 'default-linux/x86']])
+
+
 class TestEvaluateDepSetAddon(profile_mixin):
 
     addon_kls = addons.EvaluateDepSetAddon
@@ -475,6 +668,82 @@ class TestEvaluateDepSetAddon(profile_mixin):
         self.assertEqual(sorted(x.name for x in l1), ["3"])
         self.assertEqual(sorted(x.name for x in l2), ["1", "2"])
 
+    def test_memoization(self):
+        self.mk_profiles({
+            "1": ["x86"],
+            "2": ["x86"]},
+            base='profiles')
+        with open(pjoin(self.dir, 'profiles', '2', 'package.use.force'), 'w') as f:
+            f.write('>=dev-util/diffball-2 foo')
+
+        check = self.get_check('1', '2')
+        rdepend = "foo? ( dev-util/foo ) !foo? ( dev-util/nofoo )"
+
+        def get_rets(ver, **data):
+            data["KEYWORDS"] = "x86"
+            pkg = FakePkg("dev-util/diffball-%s" % ver, data=data)
+            check.feed(pkg, None)
+            return check.collapse_evaluate_depset(pkg, "rdepends", pkg.rdepends)
+
+        l = get_rets("0.1", RDEPEND=rdepend)
+        self.assertEqual(len(l), 1)
+        self.assertEqual(len(check.evaluated_cache), 1)
+        # identical dependencies of other versions reuse the evaluated depset
+        l2 = get_rets("0.2", RDEPEND=rdepend)
+        self.assertIs(l2[0][0], l[0][0])
+        self.assertEqual(len(check.evaluated_cache), 1)
+        # equal strings of different attributes are evaluated separately
+        pkg = FakePkg("dev-util/diffball-0.2", data={
+            "KEYWORDS": "x86", "RDEPEND": rdepend, "DEPEND": rdepend})
+        check.feed(pkg, None)
+        l3 = check.collapse_evaluate_depset(pkg, "depends", pkg.depends)
+        self.assertIsNot(l3[0][0], l[0][0])
+        self.assertEqual(len(check.evaluated_cache), 2)
+
+        # but not when the use flags or dependencies differ
+        l = get_rets("2", RDEPEND=rdepend)
+        self.assertEqual(
+            sorted((str(depset).strip(), [x.name for x in profiles])
+                   for depset, profiles in l),
+            [("dev-util/foo", ["2"]), ("dev-util/foo dev-util/nofoo", ["1"])])
+        self.assertEqual(len(check.evaluated_cache), 3)
+        get_rets("3", RDEPEND="dev-util/bar")
+        self.assertEqual(len(check.evaluated_cache), 4)
+
+        # the cache is bounded, dropping the least recently used entries
+        check.evaluated_cache_size = 2
+        get_rets("4", RDEPEND=rdepend)
+        get_rets("5", RDEPEND="dev-util/baz")
+        self.assertEqual(
+            [key[0] for key in check.evaluated_cache], [rdepend, "dev-util/baz"])
+
+
+class TestKeywordsAddon(TestCase):
+
+    def test_matrix(self):
+        addon = addons.KeywordsAddon(Options())
+        pkgs = (
+            FakePkg("dev-util/foo-1", data={"KEYWORDS": "x86 ~amd64 -ppc"}),
+            FakePkg("dev-util/foo-2", data={"KEYWORDS": "~x86 ~amd64"}),
+            FakePkg("dev-util/foo-3", data={"KEYWORDS": ""}),
+        )
+        matrix = addon.matrix(pkgs)
+        self.assertIdentical(matrix.pkgs, pkgs)
+        self.assertEqual(
+            [addon.names(x) for x in matrix.stable], [['x86'], [], []])
+        self.assertEqual(
+            [addon.names(x) for x in matrix.unstable],
+            [['amd64'], ['amd64', 'x86'], []])
+        self.assertEqual(
+            [addon.names(x) for x in matrix.disabled], [['ppc'], [], []])
+        self.assertEqual(
+            addon.mask(['~x86', 'x86', '-ppc']),
+            matrix.stable[0] | matrix.disabled[0])
+        # the matrix of the last sequence gets reused
+        self.assertIdentical(addon.matrix(pkgs), matrix)
+        self.assertNotIdentical(addon.matrix(pkgs[:1]), matrix)
+        self.assertEqual(addon.matrix(()).stable, ())
+
 
 class TestUseAddon(mixins.TempDirMixin, base_test):
 
@@ -0,0 +1,50 @@
+# License: BSD/GPL2
+
+from pkgcore.ebuild.atom import MalformedAtom, atom
+from pkgcore.test import TestCase
+
+from pkgcheck import atoms
+
+
+class TestAtomCache(TestCase):
+
+    def test_atom(self):
+        cache = atoms.AtomCache()
+        a = cache.atom('=dev-util/foo-1')
+        self.assertEqual(a, atom('=dev-util/foo-1'))
+        self.assertIdentical(cache.atom('=dev-util/foo-1'), a)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # failures get cached as well
+        for i in range(2):
+            self.assertRaises(MalformedAtom, cache.atom, 'dev-util')
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        self.assertEqual(len(cache), 2)
+
+    def test_strip_use(self):
+        cache = atoms.AtomCache()
+        a = atom('dev-util/foo')
+        self.assertIdentical(cache.strip_use(a), a)
+        for s, expected in (
+                ('>=dev-util/foo-1[bar,-baz]', '>=dev-util/foo-1'),
+                ('=dev-util/foo-1*:2[bar]', '=dev-util/foo-1*:2'),
+                ('!!dev-util/foo[bar]', '!!dev-util/foo'),
+                ):
+            stripped = cache.strip_use(atom(s))
+            self.assertEqual(str(stripped), expected)
+            self.assertIdentical(cache.strip_use(atom(s)), stripped)
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        self.assertEqual(str(cache), 'atom cache: 3 hits, 3 misses, 0 evictions')
+
+    def test_eviction(self):
+        cache = atoms.AtomCache(max_size=2)
+        for s in ('dev-util/a', 'dev-util/b', 'dev-util/a', 'dev-util/c'):
+            cache.atom(s)
+        self.assertEqual(cache.evictions, 1)
+        # b was the least recently used one
+        self.assertEqual(cache.misses, 3)
+        cache.atom('dev-util/a')
+        cache.atom('dev-util/b')
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (2, 4, 2))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
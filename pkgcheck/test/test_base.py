@@ -1,6 +1,8 @@
 # Copyright: 2006 Marien Zwart <marienz@gentoo.org>
 # License: BSD/GPL2
 
+import logging
+
 from pkgcore.test import TestCase
 
 from pkgcheck import base
@@ -295,3 +297,53 @@ class PlugTest(TestCase):
             [source],
             (source, base.CheckRunner([
                 trans_fast(base.CheckRunner([sinks[2]]))])))
+
+    def test_cached_plan(self):
+        # plans get reused for sinks and sources with the same signature,
+        # the resulting pipes have to use the instances passed in though
+        for i in xrange(2):
+            sink = DummySink(dummies[2])
+            source = DummySource(dummies[0])
+            bad_sinks, pipes = base.plug([sink], trans_up, [source])
+            self.assertEqual(bad_sinks, [])
+            self.assertEqual(len(pipes), 1)
+            self.assertIdentical(pipes[0][0], source)
+            self.assertEqual(list(base.collect_checks(pipes[0][1])), [sink])
+
+    def test_unreachable(self):
+        sink = DummySink(dummies[3], base.repository_scope)
+        self.assertPipes(
+            [sinks[2], sink],
+            trans_everything,
+            [sources[0]],
+            (sources[0], base.CheckRunner([
+                trans(0, 2)(base.CheckRunner([sinks[2]]))])),
+            bad_sinks=[sink])
+
+
+class FailingSink(DummySink):
+
+    def __init__(self, dummy):
+        DummySink.__init__(self, dummy)
+        self.seen = []
+
+    def feed(self, item, reporter):
+        self.seen.append(item)
+        if item == 2:
+            raise ValueError(item)
+
+
+class CheckRunnerTest(TestCase):
+
+    def test_feed_batch(self):
+        sink = FailingSink(dummies[0])
+        other = FailingSink(dummies[0])
+        runner = base.CheckRunner([sink, other])
+        logging.disable(logging.CRITICAL)
+        try:
+            runner.feed_batch([1, 2, 3], None)
+        finally:
+            logging.disable(logging.NOTSET)
+        # failures for single items don't affect the rest of the batch
+        self.assertEqual(sink.seen, [1, 2, 3])
+        self.assertEqual(other.seen, [1, 2, 3])
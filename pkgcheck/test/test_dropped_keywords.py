@@ -3,6 +3,7 @@
 
 from itertools import chain
 
+from pkgcheck.addons import KeywordsAddon
 from pkgcheck.test import misc
 from pkgcheck.dropped_keywords import DroppedKeywordsReport as drop_keys
 
@@ -17,7 +18,8 @@ class TestDroppedKeywords(misc.ReportTestCase):
 
     def test_it(self):
         # single version, shouldn't yield.
-        check = drop_keys(misc.Options((("arches", ["x86", "amd64"]),)))
+        options = misc.Options((("arches", ["x86", "amd64"]),))
+        check = drop_keys(options, KeywordsAddon(options))
         self.assertNoReport(check, [self.mk_pkg('1')])
         reports = self.assertReports(
             check, [self.mk_pkg("1", "x86 amd64"), self.mk_pkg("2")])
@@ -0,0 +1,134 @@
+# License: BSD/GPL2
+
+import os
+
+from pkgcore.ebuild.atom import atom
+from pkgcore.repository.util import SimpleTree
+from pkgcore.test import TestCase
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcheck import eclass_index
+from pkgcheck.test.test_result_cache import PathPkg
+
+
+class CountingPkg(PathPkg):
+
+    __slots__ = ()
+
+    loaded = []
+
+    @property
+    def inherited(self):
+        self.loaded.append(self.cpvstr)
+        return tuple(sorted(self.data['_eclasses_']))
+
+
+class FakeRepo(SimpleTree):
+
+    def __init__(self, location, inherits):
+        self.location = location
+        cpv_dict = {}
+        for cpvstr in inherits:
+            pkg = atom('=' + cpvstr)
+            cpv_dict.setdefault(pkg.category, {}).setdefault(
+                pkg.package, []).append(pkg.fullver)
+
+        def pkg_klass(category, package, version):
+            cpvstr = '%s/%s-%s' % (category, package, version)
+            path = pjoin(location, category, package,
+                         '%s-%s.ebuild' % (package, version))
+            eclasses = dict((x, None) for x in inherits[cpvstr])
+            return CountingPkg(cpvstr, path, data={'_eclasses_': eclasses})
+
+        SimpleTree.__init__(self, cpv_dict, pkg_klass=pkg_klass)
+
+    def path_restrict(self, path):
+        return atom(os.path.relpath(path, self.location).replace(os.sep, '/'))
+
+
+class TestEclassIndex(TempDirMixin, TestCase):
+
+    inherits = {
+        'dev-util/foo-1': ('eutils',),
+        'dev-util/foo-2': ('eutils', 'git-r3'),
+        'dev-util/bar-1': ('git-r3',),
+        'app-misc/baz-0.1': (),
+    }
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.index_path = pjoin(self.dir, 'index')
+        self.repo_dir = pjoin(self.dir, 'repo')
+        for cpvstr in self.inherits:
+            pkg = atom('=' + cpvstr)
+            self.write('%s/%s-%s.ebuild' % (pkg.key, pkg.package, pkg.fullver))
+        self.write('eclass/eutils.eclass')
+        self.write('eclass/git-r3.eclass')
+        self.repo = FakeRepo(self.repo_dir, self.inherits)
+        del CountingPkg.loaded[:]
+
+    def write(self, path, data='data'):
+        path = pjoin(self.repo_dir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def update(self, advance=True):
+        index = eclass_index.EclassIndex(self.index_path)
+        index.update(self.repo)
+        changed = index.changed_eclasses()
+        index.save(advance)
+        return index, changed
+
+    def test_inheriting(self):
+        index, changed = self.update()
+        self.assertEqual(changed, frozenset())
+        self.assertEqual(sorted(CountingPkg.loaded), sorted(self.inherits))
+        self.assertEqual(
+            sorted(index.inheriting(['eutils'])), ['dev-util/foo'])
+        self.assertEqual(
+            sorted(index.inheriting(['git-r3', 'nonexistent'])),
+            ['dev-util/bar', 'dev-util/foo'])
+        self.assertEqual(index.inheriting([]), frozenset())
+        self.assertEqual(index.restrict(self.repo, ['nonexistent']), None)
+        restrict = index.restrict(self.repo, ['git-r3'])
+        self.assertEqual(
+            sorted(x.cpvstr for x in self.repo.itermatch(restrict)),
+            ['dev-util/bar-1', 'dev-util/foo-1', 'dev-util/foo-2'])
+
+    def test_incremental(self):
+        self.update()
+        del CountingPkg.loaded[:]
+        index, changed = self.update()
+        self.assertEqual(CountingPkg.loaded, [])
+        self.assertEqual(str(index), 'eclass index: 4 versions, 0 reloaded')
+
+        self.write('dev-util/bar/bar-1.ebuild', 'changed')
+        self.write('metadata/md5-cache/app-misc/baz-0.1', 'new entry')
+        index, changed = self.update()
+        self.assertEqual(
+            sorted(CountingPkg.loaded), ['app-misc/baz-0.1', 'dev-util/bar-1'])
+        self.assertEqual(changed, frozenset())
+
+    def test_changed_eclasses(self):
+        self.update()
+        self.write('eclass/eutils.eclass', 'edited')
+        self.write('eclass/new.eclass')
+        os.remove(pjoin(self.repo_dir, 'eclass', 'git-r3.eclass'))
+        index, changed = self.update(advance=False)
+        self.assertEqual(sorted(changed), ['eutils', 'git-r3', 'new'])
+        self.assertEqual(
+            sorted(index.inheriting(changed)), ['dev-util/bar', 'dev-util/foo'])
+        # changes are reported until the baseline is moved forward
+        self.assertEqual(
+            sorted(self.update()[1]), ['eutils', 'git-r3', 'new'])
+        self.assertEqual(self.update()[1], frozenset())
+
+    def test_corrupted(self):
+        with open(self.index_path, 'w') as f:
+            f.write('garbage')
+        index, changed = self.update()
+        self.assertEqual(changed, frozenset())
+        self.assertEqual(sorted(index.inheriting(['eutils'])), ['dev-util/foo'])
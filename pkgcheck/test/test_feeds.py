@@ -0,0 +1,176 @@
+# License: BSD/GPL2
+
+import threading
+import time
+
+from pkgcore.repository.util import SimpleTree
+from pkgcore.restrictions import packages
+from pkgcore.test import TestCase
+from pkgcore.util.parserestrict import parse_match
+
+from pkgcheck import base, feeds
+
+
+class TestCombinedRepoSource(TestCase):
+
+    repo = SimpleTree({
+        'dev-util': {'foo': ['1', '2'], 'bar': ['1']},
+        'app-misc': {'baz': ['0.1']},
+        'sys-apps': {'spork': ['3', '4']},
+    })
+
+    def mk_source(self, *targets):
+        return feeds.CombinedRepoSource(
+            self.repo, [parse_match(x) for x in targets])
+
+    def cpvs(self, pkgs):
+        return [x.cpvstr for x in pkgs]
+
+    def test_scope(self):
+        self.assertEqual(
+            self.mk_source('dev-util/foo', 'sys-apps/spork').scope,
+            base.package_scope)
+        self.assertEqual(
+            self.mk_source('dev-util/*', 'sys-apps/*').scope,
+            base.category_scope)
+        self.assertEqual(
+            self.mk_source('dev-util/*', '*').scope,
+            base.category_scope)
+
+    def test_keyed_targets(self):
+        source = self.mk_source(
+            '=dev-util/foo-1', 'sys-apps/spork', '=dev-util/foo-2',
+            'app-misc/nonexistent')
+        targets = [(str(target), self.cpvs(pkgs))
+                   for target, pkgs in source.itertargets()]
+        # limiters for the same package key get merged into one target
+        self.assertEqual(len(targets), 3)
+        self.assertEqual(targets[0][1], ['dev-util/foo-1', 'dev-util/foo-2'])
+        self.assertEqual(targets[1][1], ['sys-apps/spork-3', 'sys-apps/spork-4'])
+        self.assertEqual(targets[2][1], [])
+        self.assertEqual(
+            self.cpvs(source.feed()),
+            ['dev-util/foo-1', 'dev-util/foo-2', 'sys-apps/spork-3',
+             'sys-apps/spork-4'])
+
+    def test_dedupe(self):
+        source = self.mk_source('=dev-util/foo-1', 'dev-util/*', 'dev-util/bar')
+        # every package is fed once, in the first target matching it and
+        # including all versions matched by any target
+        self.assertEqual(
+            [self.cpvs(pkgs) for target, pkgs in source.itertargets()],
+            [['dev-util/foo-1', 'dev-util/foo-2'], ['dev-util/bar-1'], []])
+
+    def test_shards(self):
+        source = self.mk_source('sys-apps/*', '=dev-util/foo-2', 'app-misc/baz')
+        self.assertEqual(
+            self.cpvs(source.feed()),
+            self.cpvs(pkg for shard in source.shards()
+                      for pkg in source.shard_feed(shard)))
+
+
+class RecordingRunner(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def start(self):
+        pass
+
+    def feed(self, item, reporter):
+        self.calls.append(('feed', item))
+
+    def feed_batch(self, items, reporter):
+        self.calls.append(('feed_batch', items))
+
+    def finish(self, reporter):
+        pass
+
+
+class TestBatches(TestCase):
+
+    repo = TestCombinedRepoSource.repo
+
+    def pkgs(self):
+        return list(self.repo.itermatch(packages.AlwaysTrue, sorter=sorted))
+
+    def test_category_batches(self):
+        self.assertEqual(
+            [[x.cpvstr for x in batch]
+             for batch in feeds.category_batches(self.pkgs())],
+            [['app-misc/baz-0.1'],
+             ['dev-util/bar-1', 'dev-util/foo-1', 'dev-util/foo-2'],
+             ['sys-apps/spork-3', 'sys-apps/spork-4']])
+
+    def test_collapse(self):
+        child = RecordingRunner()
+        transform = feeds.VersionToPackage(child)
+        transform.start()
+        pkgs = self.pkgs()
+        # anything pending from single feeds gets flushed before the batch
+        transform.feed(pkgs[0], None)
+        transform.feed_batch(pkgs[1:4], None)
+        transform.feed_batch(pkgs[4:], None)
+        transform.finish(None)
+        self.assertEqual(child.calls, [
+            ('feed', (pkgs[0],)),
+            ('feed_batch', [(pkgs[1],), (pkgs[2], pkgs[3])]),
+            ('feed_batch', [(pkgs[4], pkgs[5])]),
+        ])
+
+    def test_package_to_category(self):
+        child = RecordingRunner()
+        transform = feeds.PackageToCategory(child)
+        transform.start()
+        pkgs = self.pkgs()
+        transform.feed_batch(
+            [(pkgs[0],), (pkgs[1],), (pkgs[2], pkgs[3])], None)
+        transform.finish(None)
+        self.assertEqual(child.calls, [
+            ('feed_batch', [(pkgs[0],), (pkgs[1], pkgs[2], pkgs[3])]),
+        ])
+
+
+class TestPrefetcher(TestCase):
+
+    def test_disabled(self):
+        warmed = []
+        prefetch = feeds.Prefetcher(0, paths=str, warm=warmed.append)
+        self.assertEqual(list(prefetch(xrange(5))), range(5))
+        self.assertEqual(warmed, [])
+        self.assertEqual(prefetch.hits + prefetch.stalls, 0)
+
+    def test_prefetch(self):
+        warmed = []
+        def warm(item):
+            time.sleep(0.01)
+            warmed.append(item)
+        threads = set()
+        def paths(item):
+            # resolved in the calling thread
+            threads.add(threading.current_thread())
+            return str(item)
+        prefetch = feeds.Prefetcher(3, paths=paths, warm=warm)
+        try:
+            self.assertEqual(list(prefetch(xrange(10))), range(10))
+            # the pool gets reused for later feeds
+            self.assertEqual(list(prefetch(xrange(10, 12))), [10, 11])
+        finally:
+            prefetch.close()
+        self.assertEqual(sorted(warmed, key=int), map(str, range(12)))
+        self.assertEqual(threads, set([threading.current_thread()]))
+        self.assertEqual(prefetch.hits + prefetch.stalls, 12)
+        # nothing is ready right away
+        self.assertTrue(prefetch.stalls)
+        self.assertTrue(prefetch.stall_time > 0)
+        self.assertTrue(str(prefetch).startswith('prefetched 12 packages'))
+
+    def test_window(self):
+        # never more than the window size gets warmed ahead of the consumer
+        warmed = []
+        prefetch = feeds.Prefetcher(2, paths=str, warm=warmed.append)
+        try:
+            for i in prefetch(xrange(10)):
+                self.assertTrue(len(warmed) <= i + 3, msg=(i, warmed))
+        finally:
+            prefetch.close()
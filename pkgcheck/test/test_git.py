@@ -0,0 +1,299 @@
+# License: BSD/GPL2
+
+import hashlib
+import os
+import subprocess
+
+from pkgcore.ebuild import repository
+from pkgcore.ebuild.atom import atom
+from pkgcore.package.errors import MetadataException
+from pkgcore.repository.util import SimpleTree
+from pkgcore.restrictions import packages
+from pkgcore.test import TestCase
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcheck import base, deprecated, errors, feeds, git
+from pkgcheck.test.misc import FakePkg, fake_reporter
+
+
+class FakeRepo(SimpleTree):
+
+    def __init__(self, location, cpv_dict, inherits):
+        self.location = location
+
+        def pkg_klass(category, package, version):
+            cpvstr = '%s/%s-%s' % (category, package, version)
+            eclasses = dict(
+                (x, None) for x in inherits.get('%s/%s' % (category, package), ()))
+            return FakePkg(cpvstr, data={'_eclasses_': eclasses})
+
+        SimpleTree.__init__(self, cpv_dict, pkg_klass=pkg_klass)
+
+    def path_restrict(self, path):
+        return atom(os.path.relpath(path, self.location).replace(os.sep, '/'))
+
+
+class TestChanges(TempDirMixin, TestCase):
+
+    cpv_dict = {
+        'dev-util': {'foo': ['1'], 'bar': ['1']},
+        'app-misc': {'baz': ['0.1'], 'spork': ['2']},
+    }
+    inherits = {'app-misc/baz': ('eutils',), 'dev-util/bar': ('git-r3',)}
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        for category, pkgs in self.cpv_dict.iteritems():
+            for package, versions in pkgs.iteritems():
+                for version in versions:
+                    self.write('%s/%s/%s-%s.ebuild' % (
+                        category, package, package, version))
+        self.write('eclass/eutils.eclass')
+        self.write('profiles/repo_name')
+        self.git('init', '-q')
+        self.git('add', '.')
+        self.git('-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                 'commit', '-q', '-m', 'initial')
+        self.repo = FakeRepo(self.dir, self.cpv_dict, self.inherits)
+
+    def git(self, *args):
+        with open(os.devnull, 'w') as null:
+            subprocess.check_call(('git',) + args, cwd=self.dir, stdout=null)
+
+    def write(self, path, data='data'):
+        path = pjoin(self.dir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'a') as f:
+            f.write(data)
+
+    def targets(self, ref='HEAD'):
+        restrict = git.changed_restrict(self.repo, ref)
+        if restrict is None:
+            return None
+        return sorted(x.key for x in self.repo.itermatch(restrict))
+
+    def test_unchanged(self):
+        self.assertEqual(git.changed_paths(self.dir, 'HEAD'), [])
+        self.assertEqual(self.targets(), None)
+
+    def test_changed(self):
+        self.write('dev-util/foo/files/foo.patch')
+        self.write('app-misc/spork/spork-2.ebuild')
+        self.git('add', 'app-misc')
+        self.write('profiles/repo_name')
+        self.assertEqual(
+            sorted(git.changed_paths(self.dir, 'HEAD')),
+            ['app-misc/spork/spork-2.ebuild', 'dev-util/foo/files/foo.patch',
+             'profiles/repo_name'])
+        self.assertEqual(self.targets(), ['app-misc/spork', 'dev-util/foo'])
+
+    def test_committed(self):
+        self.write('dev-util/foo/foo-1.ebuild')
+        self.git('-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                 'commit', '-q', '-a', '-m', 'change')
+        self.assertEqual(self.targets(), None)
+        self.assertEqual(self.targets('HEAD~1'), ['dev-util/foo'])
+
+    def test_eclass(self):
+        self.write('eclass/eutils.eclass')
+        self.assertEqual(self.targets(), ['app-misc/baz'])
+
+    def test_eclass_index(self):
+        class FakeIndex(object):
+            def inheriting(self, eclasses):
+                self.eclasses = eclasses
+                return frozenset(['dev-util/bar'])
+
+        index = FakeIndex()
+        self.write('eclass/eutils.eclass')
+        restrict = git.changed_restrict(self.repo, 'HEAD', index=index)
+        self.assertEqual(index.eclasses, set(['eutils']))
+        self.assertEqual(
+            sorted(x.key for x in self.repo.itermatch(restrict)), ['dev-util/bar'])
+
+    def test_removed_package(self):
+        self.git('rm', '-q', '-r', 'dev-util/foo')
+        self.assertEqual(self.targets(), None)
+
+    def test_bad_ref(self):
+        self.assertRaises(
+            errors.GitError, git.changed_paths, self.dir, 'nonexistent')
+
+
+class TestGitTree(TempDirMixin, TestCase):
+
+    ebuild = 'EAPI=5\n\ninherit eutils\n\nKEYWORDS="~amd64 x86"\n'
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.write('profiles/categories', 'dev-util\napp-misc\n')
+        self.write('dev-util/foo/foo-1.ebuild', self.ebuild)
+        self.write('dev-util/foo/foo-2.ebuild', self.ebuild)
+        self.write('dev-util/foo/metadata.xml', (
+            '<pkgmetadata><maintainer type="person">'
+            '<email>dev@example.com</email></maintainer></pkgmetadata>\n'))
+        self.write('dev-util/foo/Manifest', 'DIST foo-1.tar.gz 10 SHA256 abc\n')
+        self.write('app-misc/bar/bar-0.1.ebuild', 'EAPI=6\n')
+        self.write('eclass/eutils.eclass', '')
+        for version in ('1', '2'):
+            self.write('metadata/md5-cache/dev-util/foo-%s' % version, (
+                'EAPI=5\nKEYWORDS=~amd64 x86\n'
+                '_eclasses_=eutils\td41d8cd98f00b204e9800998ecf8427e\n'
+                '_md5_=%s\n' % hashlib.md5(self.ebuild.encode()).hexdigest()))
+        self.git('init', '-q')
+        self.commit('initial')
+
+    def git(self, *args):
+        return TestChanges.__dict__['git'](self, *args)
+
+    def commit(self, msg, date=None):
+        self.git('add', '-A', '.')
+        args = ()
+        if date is not None:
+            args = ('--date', date)
+            os.environ['GIT_COMMITTER_DATE'] = date
+        try:
+            self.git('-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                     'commit', '-q', '-m', msg, *args)
+        finally:
+            os.environ.pop('GIT_COMMITTER_DATE', None)
+
+    def write(self, path, data):
+        path = pjoin(self.dir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def test_packages(self):
+        repo = git.GitTree(self.dir, 'HEAD')
+        self.assertEqual(sorted(repo.categories), ['app-misc', 'dev-util'])
+        self.assertEqual(
+            sorted(pkg.cpvstr for pkg in repo.itermatch(packages.AlwaysTrue)),
+            ['app-misc/bar-0.1', 'dev-util/foo-1', 'dev-util/foo-2'])
+        pkg = repo.match(atom('=dev-util/foo-1'))[0]
+        self.assertEqual(pkg.repo, repo)
+        self.assertEqual(pkg.keywords, ('~amd64', 'x86'))
+        self.assertEqual(pkg.inherited, ('eutils',))
+        self.assertEqual(pkg.maintainers[0].email, 'dev@example.com')
+        self.assertEqual(
+            list(pkg.manifest.distfiles),
+            ['foo-1.tar.gz'])
+        self.assertEqual(pkg.ebuild.text_fileobj().read(), self.ebuild)
+
+        # no md5-cache entry for this one
+        pkg = repo.match(atom('app-misc/bar'))[0]
+        self.assertRaises(MetadataException, getattr, pkg, 'keywords')
+        self.assertEqual(pkg.maintainers, ())
+        repo.close()
+
+    def test_source(self):
+        repo = git.GitTree(self.dir, 'HEAD')
+        source = feeds.RestrictedRepoSource(
+            repo, repo.path_restrict(pjoin(self.dir, 'dev-util/foo')))
+        self.assertEqual(
+            [pkg.cpvstr for pkg in source.feed()],
+            ['dev-util/foo-1', 'dev-util/foo-2'])
+        self.assertEqual(
+            [pkg.cpvstr for pkg in source.shard_feed('dev-util')],
+            ['dev-util/foo-1', 'dev-util/foo-2'])
+        restrict = repo.path_restrict(pjoin(self.dir, 'dev-util/foo/foo-2.ebuild'))
+        self.assertEqual(
+            [pkg.cpvstr for pkg in repo.itermatch(restrict)], ['dev-util/foo-2'])
+
+        fed = []
+        collector = base.CheckRunner([])
+        collector.feed_batch = lambda items, reporter: fed.extend(items)
+        transform = feeds.VersionToEbuild(collector)
+        transform.feed_batch(list(source.feed()), None)
+        self.assertEqual(
+            [(pkg.cpvstr, ''.join(lines)) for pkg, lines in fed],
+            [('dev-util/foo-1', self.ebuild), ('dev-util/foo-2', self.ebuild)])
+
+    def test_old_revision(self):
+        self.write('dev-util/foo/foo-2.ebuild', 'EAPI=6\n')
+        os.remove(pjoin(self.dir, 'dev-util/foo/foo-1.ebuild'))
+        self.commit('change')
+        repo = git.GitTree(self.dir, 'HEAD~1')
+        pkgs = sorted(repo.itermatch(atom('dev-util/foo')))
+        self.assertEqual([pkg.fullver for pkg in pkgs], ['1', '2'])
+        self.assertEqual(pkgs[1].ebuild.text_fileobj().read(), self.ebuild)
+        self.assertEqual(pkgs[1].keywords, ('~amd64', 'x86'))
+
+        # the md5-cache entry is stale for the new ebuild
+        repo = git.GitTree(self.dir, 'HEAD')
+        pkg = repo.match(atom('=dev-util/foo-2'))[0]
+        self.assertRaises(MetadataException, getattr, pkg, 'keywords')
+
+        self.assertEqual(
+            sorted(git.changed_paths(self.dir, 'HEAD~1', 'HEAD')),
+            ['dev-util/foo/foo-1.ebuild', 'dev-util/foo/foo-2.ebuild'])
+        restrict = git.changed_restrict(repo, 'HEAD~1', 'HEAD')
+        self.assertEqual(
+            [pkg.cpvstr for pkg in repo.itermatch(restrict)], ['dev-util/foo-2'])
+
+    def test_base_repo(self):
+        self.write('profiles/repo_name', 'test\n')
+        self.write('metadata/layout.conf', 'masters =\neapis-deprecated = 5\n')
+        self.write('licenses/GPL-2', 'GPL-2')
+        self.commit('repo config')
+        base_repo = repository._UnconfiguredTree(self.dir)
+        repo = git.GitTree(self.dir, 'HEAD', base_repo=base_repo)
+        self.assertIdentical(repo.config, base_repo.config)
+        self.assertEqual(list(repo.licenses), ['GPL-2'])
+        self.assertEqual(repo.trees, (repo,))
+
+        # checks reading repo wide settings work on packages of the revision
+        results = []
+        check = deprecated.DeprecatedEAPIReport(None)
+        for pkg in sorted(repo.itermatch(atom('dev-util/foo'))):
+            check.feed(pkg, fake_reporter(results.append))
+        self.assertEqual(
+            [(x.version, str(x.eapi)) for x in results], [('1', '5'), ('2', '5')])
+        repo.close()
+
+        repo = git.GitTree(self.dir, 'HEAD')
+        self.assertRaises(AttributeError, getattr, repo, 'config')
+        repo.close()
+
+    def test_stale_eclasses(self):
+        self.write('eclass/eutils.eclass', 'changed')
+        self.commit('change')
+        repo = git.GitTree(self.dir, 'HEAD')
+        self.assertEqual(
+            repo.eclass_md5('eutils'), hashlib.md5(b'changed').hexdigest())
+        pkg = repo.match(atom('=dev-util/foo-1'))[0]
+        self.assertRaises(MetadataException, getattr, pkg, 'keywords')
+
+        os.remove(pjoin(self.dir, 'eclass/eutils.eclass'))
+        self.commit('remove')
+        repo = git.GitTree(self.dir, 'HEAD')
+        self.assertEqual(repo.eclass_md5('eutils'), None)
+        pkg = repo.match(atom('=dev-util/foo-1'))[0]
+        self.assertRaises(MetadataException, getattr, pkg, 'keywords')
+
+    def test_ebuild_mtime(self):
+        self.write('dev-util/foo/foo-2.ebuild', 'EAPI=6\n')
+        self.commit('change', date='@1500000000 +0000')
+        self.write('app-misc/bar/metadata.xml', '<pkgmetadata/>\n')
+        self.commit('unrelated', date='@1600000000 +0000')
+        repo = git.GitTree(self.dir, 'HEAD')
+        self.assertEqual(repo.commit_time, 1600000000)
+        initial = int(subprocess.check_output(
+            ('git', 'log', '-1', '--format=%ct', 'HEAD~2'), cwd=self.dir))
+        self.assertEqual(
+            [pkg._mtime_ for pkg in sorted(repo.itermatch(atom('dev-util/foo')))],
+            [initial, 1500000000])
+        repo.close()
+
+    def test_cat_file(self):
+        cat_file = git.CatFile(self.dir)
+        self.assertEqual(cat_file.read('HEAD:nonexistent'), None)
+        oid, kind, data = cat_file.read('HEAD:profiles/categories')
+        self.assertEqual((kind, data), ('blob', b'dev-util\napp-misc\n'))
+        cat_file.close()
+
+    def test_bad_rev(self):
+        self.assertRaises(errors.GitError, git.GitTree, self.dir, 'nonexistent')
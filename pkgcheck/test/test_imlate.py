@@ -1,6 +1,7 @@
 # Copyright: 2006 Brian Harring <ferringb@gmail.com>
 # License: BSD/GPL2
 
+from pkgcheck.addons import KeywordsAddon
 from pkgcheck.test import misc
 from pkgcheck.imlate import ImlateReport
 
@@ -15,12 +16,11 @@ class TestImlateReport(misc.ReportTestCase):
 
     def test_it(self):
         mk_pkg = self.mk_pkg
-        check = ImlateReport(
-            misc.Options(
-                selected_arches=("x86", "ppc", "amd64"),
-                arches=("x86", "ppc", "amd64"),
-                reference_arches=("x86", "ppc", "amd64")),
-            None)
+        options = misc.Options(
+            selected_arches=("x86", "ppc", "amd64"),
+            arches=("x86", "ppc", "amd64"),
+            reference_arches=("x86", "ppc", "amd64"))
+        check = ImlateReport(options, None, KeywordsAddon(options))
 
         self.assertNoReport(
             check,
@@ -2,10 +2,15 @@
 # License: BSD/GPL2
 
 from functools import partial
+import logging
 import os
 import tempfile
 
 from pkgcore.ebuild import repository
+from pkgcore.ebuild.atom import atom
+from pkgcore.ebuild.cpv import versioned_CPV
+from pkgcore.package.errors import MetadataException
+from pkgcore.repository.util import SimpleTree
 from pkgcore.test.misc import FakePkg, FakeRepo
 from snakeoil import fileutils
 from snakeoil.currying import post_curry
@@ -60,6 +65,26 @@ class TestKeywordsReport(misc.ReportTestCase):
         self.assertNoReport(check, self.mk_pkg("-* ~arch"),
             metadata_checks.StupidKeywords)
 
+    def test_batch_failures(self):
+        class BrokenPkg(misc.FakePkg):
+            @property
+            def keywords(self):
+                raise MetadataException(self, 'keywords', 'broken')
+
+        check = metadata_checks.KeywordsReport(None, None)
+        reports = []
+        broken = BrokenPkg("dev-util/diffball-0.7")
+        logging.disable(logging.CRITICAL)
+        try:
+            check.feed_batch(
+                [broken, self.mk_pkg("-*")], misc.fake_reporter(reports.append))
+        finally:
+            logging.disable(logging.NOTSET)
+        # the broken version is skipped, the others still get checked
+        self.assertEqual([x.version for x in reports], ["0.7.1"])
+        self.assertRaises(
+            MetadataException, check.feed, broken, misc.fake_reporter(reports.append))
+
 
 class iuse_options(TempDirMixin):
 
@@ -81,6 +106,7 @@ class iuse_options(TempDirMixin):
         fileutils.write_file(pjoin(repo_base, 'metadata', 'layout.conf'), 'w',
             "masters = ")
         kwds['target_repo'] = repository._UnconfiguredTree(repo_base)
+        kwds.setdefault('repo_index', None)
         return misc.Options(**kwds)
 
 
@@ -216,6 +242,47 @@ class TestDependencyReport(use_based(), misc.ReportTestCase):
     del x
 
 
+class TestMissingSlotDepReport(use_based(), misc.ReportTestCase):
+
+    check_kls = metadata_checks.MissingSlotDepReport
+
+    def test_dep_slots(self):
+        queries = []
+
+        class CountingRepo(SimpleTree):
+            def itermatch(self, restrict, **kwargs):
+                queries.append(str(restrict))
+                return SimpleTree.itermatch(self, restrict, **kwargs)
+
+        slots = {'1': '1', '1.5': '1', '2': '2'}
+        repo = CountingRepo(
+            {'dev-libs': {'foo': list(slots), 'bar': ['1', '2']}},
+            pkg_klass=lambda cat, pkg, ver: misc.FakePkg(
+                '%s/%s-%s' % (cat, pkg, ver),
+                data={'SLOT': slots.get(ver, '0') if pkg == 'foo' else '0'}))
+        chk = self.mk_check()
+        for dep, expected in (
+                ('dev-libs/foo', ['1', '2']),
+                ('<dev-libs/foo-2', ['1']),
+                ('>=dev-libs/foo-1.5', ['1', '2']),
+                ('=dev-libs/foo-3', []),
+                ('dev-libs/bar', ['0']),
+                ('dev-libs/nonexistent', []),
+                ):
+            self.assertEqual(sorted(chk.dep_slots(repo, atom(dep))), expected)
+        # each package key is only queried once
+        self.assertEqual(
+            sorted(queries), ['dev-libs/bar', 'dev-libs/foo', 'dev-libs/nonexistent'])
+        self.assertEqual(
+            chk.key_slots(repo, 'dev-libs/bar'),
+            {versioned_CPV('dev-libs/bar-1'): '0', versioned_CPV('dev-libs/bar-2'): '0'})
+
+        # use deps require matching the packages themselves
+        self.assertEqual(
+            sorted(chk.dep_slots(repo, atom('dev-libs/foo[bar]'))), [])
+        self.assertEqual(queries[-1], 'dev-libs/foo[bar]')
+
+
 class TestSrcUriReport(use_based(), misc.ReportTestCase):
 
     check_kls = metadata_checks.SrcUriReport
@@ -0,0 +1,221 @@
+# License: BSD/GPL2
+
+import os
+
+from pkgcore.ebuild.atom import atom
+from pkgcore.repository.util import SimpleTree
+from pkgcore.restrictions import packages, values
+from pkgcore.test import TestCase
+
+from pkgcheck import base, feeds, parallel
+from pkgcheck.test.misc import FakePkg
+
+
+class SeenResult(base.Warning):
+
+    __slots__ = ('check', 'items')
+    __attrs__ = __slots__
+
+    threshold = base.versioned_feed
+
+    def __init__(self, check, items):
+        super(SeenResult, self).__init__()
+        self.check = check
+        self.items = items
+
+
+def _cpvs(item):
+    if isinstance(item, FakePkg):
+        return item.cpvstr
+    return tuple(x.cpvstr for x in item)
+
+
+class RecordingCheck(base.Template):
+
+    def __init__(self, feed_type, scope):
+        self.feed_type = feed_type
+        self.scope = scope
+
+    def feed(self, item, reporter):
+        reporter.add_report(SeenResult(repr(self), _cpvs(item)))
+
+    def finish(self, reporter):
+        reporter.add_report(SeenResult(repr(self), None))
+
+    def __repr__(self):
+        return 'RecordingCheck(%s, %s)' % (self.feed_type, self.scope)
+
+
+class UnusedPackagesCheck(base.Template):
+
+    feed_type = base.versioned_feed
+    scope = base.repository_scope
+    mergeable = True
+
+    candidates = ('foo', 'bar', 'fork', 'unused', 'missing')
+
+    def __init__(self):
+        self.unused = None
+
+    def start(self):
+        self.unused = set(self.candidates)
+
+    def feed(self, pkg, reporter):
+        self.unused.discard(pkg.package)
+
+    def partial_state(self):
+        return self.unused
+
+    def merge_state(self, unused):
+        self.unused.intersection_update(unused)
+
+    def finish(self, reporter):
+        reporter.add_report(
+            SeenResult(repr(self), tuple(sorted(self.unused))))
+
+    def __repr__(self):
+        return 'UnusedPackagesCheck'
+
+
+class PidTransform(feeds.VersionToPackage):
+    """Transform remembering the processes it ran in."""
+
+    pids = set()
+
+    def feed_batch(self, pkgs, reporter):
+        self.pids.add(os.getpid())
+        feeds.VersionToPackage.feed_batch(self, pkgs, reporter)
+
+
+class FakeSource(object):
+
+    feed_type = base.versioned_feed
+    scope = base.repository_scope
+    cost = 10
+
+    def __init__(self, pkgs):
+        self.pkgs = sorted(pkgs)
+
+    def feed(self):
+        return iter(self.pkgs)
+
+    def shards(self):
+        return sorted(set(x.category for x in self.pkgs))
+
+    def shard_feed(self, category):
+        return (x for x in self.pkgs if x.category == category)
+
+
+class Collector(object):
+
+    def __init__(self):
+        self.results = []
+
+    def add_report(self, result):
+        self.results.append((result.check, result.items))
+
+
+class TestParallel(TestCase):
+
+    pkgs = [FakePkg(x) for x in (
+        'dev-util/foo-1', 'dev-util/foo-2', 'dev-util/bar-1',
+        'app-misc/baz-0.1', 'app-misc/baz-0.2', 'sys-apps/spork-3',
+        'sys-apps/spork-4', 'sys-apps/fork-1')]
+
+    def mk_pipe(self):
+        version = RecordingCheck(base.versioned_feed, base.version_scope)
+        package = RecordingCheck(base.package_feed, base.package_scope)
+        category = RecordingCheck(base.category_feed, base.category_scope)
+        repo = RecordingCheck(base.versioned_feed, base.repository_scope)
+        repo_feed = RecordingCheck(base.repository_feed, base.repository_scope)
+        return base.CheckRunner([
+            feeds.VersionToPackage(base.CheckRunner([
+                package,
+                feeds.PackageToCategory(base.CheckRunner([category])),
+                feeds.PackageToRepo(base.CheckRunner([repo_feed])),
+            ])),
+            version,
+            repo,
+            UnusedPackagesCheck(),
+        ])
+
+    def run_pipe(self, jobs):
+        reporter = Collector()
+        parallel.run(FakeSource(self.pkgs), self.mk_pipe(), reporter, jobs)
+        return reporter.results
+
+    def test_shardable(self):
+        self.assertTrue(parallel.shardable(
+            RecordingCheck(base.package_feed, base.category_scope)))
+        self.assertFalse(parallel.shardable(
+            RecordingCheck(base.versioned_feed, base.repository_scope)))
+        self.assertFalse(parallel.shardable(
+            RecordingCheck(base.repository_feed, base.repository_scope)))
+        self.assertTrue(parallel.shardable(UnusedPackagesCheck()))
+
+    def test_results_match_serial_order(self):
+        serial = self.run_pipe(1)
+        # sanity check the test pipeline itself
+        self.assertEqual(len(serial), 8 + 5 + 3 + 8 + 5 + 5 + 1)
+        self.assertEqual(
+            serial[-1], ('UnusedPackagesCheck', ('missing', 'unused')))
+        for jobs in (2, 3, 16):
+            self.assertEqual(serial, self.run_pipe(jobs))
+
+    def test_streamed_repo_feed(self):
+        results = self.run_pipe(1)
+        repo_feed = 'RecordingCheck(repo, 3)'
+        # repo feed sinks get fed each package as soon as it's complete
+        # instead of everything at the end
+        self.assertEqual(
+            [x for x in results if x[0] == repo_feed],
+            [(repo_feed, ('app-misc/baz-0.1', 'app-misc/baz-0.2')),
+             (repo_feed, ('dev-util/bar-1',)),
+             (repo_feed, ('dev-util/foo-1', 'dev-util/foo-2')),
+             (repo_feed, ('sys-apps/fork-1',)),
+             (repo_feed, ('sys-apps/spork-3', 'sys-apps/spork-4')),
+             (repo_feed, None)])
+        self.assertTrue(
+            results.index((repo_feed, ('app-misc/baz-0.1', 'app-misc/baz-0.2'))) <
+            results.index(('RecordingCheck(cat/pkg-ver, 0)', 'dev-util/bar-1')))
+
+    def test_repo_source_shards(self):
+        repo = SimpleTree({
+            'dev-util': {'foo': ['1', '2'], 'bar': ['1']},
+            'app-misc': {'baz': ['0.1']},
+            'sys-apps': {'spork': ['3']},
+        })
+        for limiter, shards in (
+                (packages.AlwaysTrue, ['app-misc', 'dev-util', 'sys-apps']),
+                (atom('dev-util/foo'), ['dev-util']),
+                (atom('dev-util/nonexistent'), ['dev-util']),
+                (atom('dev-foo/bar'), []),
+                (packages.PackageRestriction(
+                    'package', values.StrExactMatch('spork')), ['sys-apps']),
+                ):
+            source = feeds.RestrictedRepoSource(repo, limiter)
+            self.assertEqual(source.shards(), shards)
+            self.assertEqual(
+                list(source.feed()),
+                [pkg for shard in source.shards()
+                 for pkg in source.shard_feed(shard)])
+
+    def test_pruned_transforms(self):
+        def mk_pipe():
+            return base.CheckRunner([
+                PidTransform(base.CheckRunner([
+                    RecordingCheck(base.package_feed, base.package_scope),
+                    UnusedPackagesCheck(),
+                ])),
+                RecordingCheck(base.versioned_feed, base.repository_scope),
+            ])
+
+        results = []
+        for jobs in (1, 2):
+            PidTransform.pids.clear()
+            reporter = Collector()
+            parallel.run(FakeSource(self.pkgs), mk_pipe(), reporter, jobs)
+            results.append(reporter.results)
+        self.assertEqual(results[0], results[1])
+        # transforms only feeding shardable sinks only run in the workers
+        self.assertNotIn(os.getpid(), PidTransform.pids)
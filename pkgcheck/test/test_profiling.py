@@ -0,0 +1,97 @@
+# License: BSD/GPL2
+
+import time
+
+from pkgcore.test import TestCase
+
+from pkgcheck import base, feeds, parallel, profiling
+from pkgcheck.test.test_parallel import (
+    Collector, FakeSource, RecordingCheck, TestParallel, UnusedPackagesCheck)
+
+
+class SlowCheck(base.Template):
+
+    feed_type = base.versioned_feed
+
+    def __init__(self):
+        pass
+
+    def feed(self, pkg, reporter):
+        time.sleep(0.01)
+
+
+class TestProfiler(TestCase):
+
+    pkgs = TestParallel.pkgs
+    mk_pipe = TestParallel.__dict__['mk_pipe']
+
+    def run_pipe(self, jobs):
+        profiler = profiling.Profiler()
+        reporter = Collector()
+        parallel.run(
+            FakeSource(self.pkgs), self.mk_pipe(), reporter, jobs,
+            profiler=profiler)
+        return reporter.results, profiler
+
+    def test_counts(self):
+        results, profiler = self.run_pipe(1)
+        stats = profiler.stats
+        self.assertEqual(
+            sorted(stats),
+            ['PackageToCategory', 'PackageToRepo',
+             'RecordingCheck', 'UnusedPackagesCheck', 'VersionToPackage'])
+        # one batch per category
+        self.assertEqual(stats['VersionToPackage'].calls, 3)
+        self.assertEqual(stats['VersionToPackage'].items, 8)
+        self.assertEqual(stats['VersionToPackage'].results, 0)
+        self.assertEqual(stats['UnusedPackagesCheck'].items, 8)
+        self.assertEqual(stats['UnusedPackagesCheck'].results, 1)
+        self.assertEqual(
+            sum(x.results for x in stats.itervalues()), len(results))
+
+    def test_parallel(self):
+        serial = self.run_pipe(1)[1].as_dict()
+        for jobs in (2, 16):
+            results, profiler = self.run_pipe(jobs)
+            stats = profiler.as_dict()
+            self.assertEqual(sorted(serial), sorted(stats))
+            # transforms feeding both kinds of sinks run in the parent and
+            # the workers, so only the checks get fed the same as in a
+            # serial run
+            for name in ('RecordingCheck', 'UnusedPackagesCheck'):
+                counts = serial[name]
+                for attr in ('calls', 'items', 'results'):
+                    self.assertEqual(
+                        counts[attr], stats[name][attr], msg=(jobs, name, attr))
+
+    def test_exclusive_times(self):
+        profiler = profiling.Profiler()
+        pipe = base.CheckRunner([
+            feeds.VersionToPackage(base.CheckRunner([
+                feeds.PackageToCategory(base.CheckRunner([
+                    RecordingCheck(base.category_feed, base.category_scope)]))
+            ])),
+            SlowCheck(),
+        ])
+        parallel.run(FakeSource(self.pkgs[:3]), pipe, Collector(), 1,
+                     profiler=profiler)
+        stats = profiler.stats
+        self.assertTrue(stats['SlowCheck'].wall >= 0.03)
+        # the transforms don't get charged for the time spent in their children
+        self.assertTrue(stats['VersionToPackage'].wall < 0.03)
+        self.assertEqual(profiler.sorted_stats()[0][0], 'SlowCheck')
+        lines = list(profiler.format())
+        self.assertEqual(len(lines), len(stats) + 1)
+        self.assertTrue(lines[1].startswith('SlowCheck '))
+
+    def test_pop_stats(self):
+        profiler = profiling.Profiler()
+        pipe = profiler.instrument(base.CheckRunner([UnusedPackagesCheck()]))
+        pipe.start()
+        pipe.feed_batch(self.pkgs[:2], Collector())
+        popped = profiler.pop_stats()
+        pipe.feed_batch(self.pkgs[2:], Collector())
+        self.assertEqual(popped['UnusedPackagesCheck'].items, 2)
+        self.assertEqual(profiler.stats['UnusedPackagesCheck'].items, 6)
+        profiler.merge(popped)
+        self.assertEqual(profiler.stats['UnusedPackagesCheck'].items, 8)
@@ -0,0 +1,70 @@
+# License: BSD/GPL2
+
+import threading
+
+from pkgcore.ebuild.atom import atom
+from pkgcore.package.errors import MetadataException
+from pkgcore.repository.util import SimpleTree
+from pkgcore.restrictions import packages
+from pkgcore.test import TestCase
+
+from pkgcheck import regen
+from pkgcheck.test.misc import FakePkg
+
+
+class FakeRegen(regen.Regen):
+
+    def __init__(self, stale, broken=(), **kwargs):
+        regen.Regen.__init__(self, **kwargs)
+        self.stale_cpvs = set(stale)
+        self.broken = frozenset(broken)
+        self.regenerated_cpvs = []
+        self.threads = set()
+
+    def stale(self, pkg):
+        return pkg.cpvstr in self.stale_cpvs
+
+    def update(self, pkg):
+        self.threads.add(threading.current_thread().name)
+        if pkg.cpvstr in self.broken:
+            raise MetadataException(pkg, 'data', 'broken')
+        self.stale_cpvs.discard(pkg.cpvstr)
+        self.regenerated_cpvs.append(pkg.cpvstr)
+
+
+class TestRegen(TestCase):
+
+    repo = SimpleTree({
+        'dev-util': {'foo': ['1', '2'], 'bar': ['1']},
+        'app-misc': {'baz': ['0.1']},
+    }, pkg_klass=lambda *args: FakePkg('%s/%s-%s' % args))
+
+    def test_regen(self):
+        stale = ['dev-util/foo-2', 'dev-util/bar-1', 'app-misc/baz-0.1']
+        for jobs in (1, 4):
+            r = FakeRegen(stale, jobs=jobs)
+            r.run(self.repo, [atom('dev-util/foo'), atom('dev-util/bar')])
+            self.assertEqual(
+                sorted(r.regenerated_cpvs), ['dev-util/bar-1', 'dev-util/foo-2'])
+            self.assertEqual((r.total, r.regenerated, r.failed), (3, 2, 0))
+            self.assertTrue(str(r).startswith(
+                'metadata regen: 2 of 3 cache entries regenerated in '))
+            # the main thread doesn't do any work when running in parallel
+            self.assertEqual('MainThread' in r.threads, jobs == 1)
+
+            # nothing left to do
+            r.run(self.repo, [packages.AlwaysTrue])
+            self.assertEqual(r.regenerated, 3)
+
+    def test_overlapping_limiters(self):
+        r = FakeRegen(['dev-util/foo-1'])
+        r.run(self.repo, [atom('dev-util/foo'), atom('=dev-util/foo-1')])
+        self.assertEqual(r.total, 2)
+        self.assertEqual(r.regenerated_cpvs, ['dev-util/foo-1'])
+
+    def test_failures(self):
+        r = FakeRegen(['dev-util/foo-1', 'dev-util/foo-2'],
+                      broken=['dev-util/foo-2'], jobs=2)
+        r.run(self.repo, [packages.AlwaysTrue])
+        self.assertEqual((r.total, r.regenerated, r.failed), (4, 1, 1))
+        self.assertTrue(str(r).endswith(', 1 failed'))
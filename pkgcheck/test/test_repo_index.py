@@ -0,0 +1,189 @@
+# License: BSD/GPL2
+
+import hashlib
+import os
+
+from pkgcore.ebuild.atom import atom
+from pkgcore.restrictions import packages, values
+from pkgcore.test import TestCase
+from pkgcore.test.misc import FakeRepo
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcheck import metadata_checks, repo_index
+from pkgcheck.test.misc import FakePkg, Options
+
+
+class TestRepoIndex(TempDirMixin, TestCase):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.index_path = pjoin(self.dir, 'index')
+        self.repo = FakeRepo(
+            repo_id='gentoo', location=pjoin(self.dir, 'repo'),
+            categories=('app-misc', 'dev-util'))
+        for eclass in ('eutils', 'git-r3'):
+            self.write('eclass/%s.eclass' % (eclass,), eclass)
+        self.add('dev-util/foo-1', KEYWORDS='x86 ~amd64', IUSE='+bar baz',
+                 SLOT='0/1', RDEPEND='dev-libs/bar',
+                 _eclasses_='eutils\t%s\tgit-r3\t%s' % (
+                     hashlib.md5('eutils').hexdigest(),
+                     hashlib.md5('git-r3').hexdigest()))
+        self.add('dev-util/foo-1.10-r2', KEYWORDS='~x86', SLOT='2')
+        self.add('dev-util/foo-1.9', KEYWORDS='~x86', SLOT='0')
+        self.add('app-misc/baz-0.1', EAPI='5', LICENSE='GPL-2', SLOT='0')
+
+    def write(self, path, data='data'):
+        path = pjoin(self.repo.location, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def add(self, cpvstr, ebuild='data', cache=True, **metadata):
+        pkg = atom('=' + cpvstr)
+        self.write('%s/%s-%s.ebuild' % (pkg.key, pkg.package, pkg.fullver),
+                   ebuild)
+        if not cache:
+            return
+        metadata.setdefault('_md5_', hashlib.md5(ebuild).hexdigest())
+        self.write('metadata/md5-cache/' + cpvstr, ''.join(
+            '%s=%s\n' % x for x in sorted(metadata.items())))
+
+    def update(self):
+        index = repo_index.RepoIndex(self.index_path)
+        index.update(self.repo)
+        return index
+
+    def test_entries(self):
+        index = self.update()
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.reindexed, 4)
+        self.assertEqual(
+            [x.cpvstr for x in index],
+            ['app-misc/baz-0.1', 'dev-util/foo-1', 'dev-util/foo-1.9',
+             'dev-util/foo-1.10-r2'])
+
+        foo = index.versions('dev-util/foo')[0]
+        self.assertEqual(
+            (foo.category, foo.package, foo.key, foo.version, foo.revision),
+            ('dev-util', 'foo', 'dev-util/foo', '1', None))
+        self.assertEqual((foo.slot, foo.subslot), ('0', '1'))
+        self.assertEqual(foo.keywords, ('x86', '~amd64'))
+        self.assertEqual(foo.iuse, ('+bar', 'baz'))
+        self.assertEqual(foo.inherited, ('eutils', 'git-r3'))
+        self.assertEqual(foo.eapi, '0')
+        self.assertEqual((foo.rdepend, foo.depend, foo.license),
+                         ('dev-libs/bar', '', ''))
+        self.assertEqual(
+            foo.mtime,
+            os.stat(pjoin(self.repo.location, 'dev-util/foo/foo-1.ebuild')).st_mtime)
+
+        rev = index.versions('dev-util/foo')[-1]
+        self.assertEqual((rev.version, rev.revision, rev.fullver),
+                         ('1.10', 2, '1.10-r2'))
+        self.assertEqual(rev.subslot, '2')
+        # equal strings are only stored once
+        self.assertIdentical(rev.keywords[0], index.versions('dev-util/foo')[1].keywords[0])
+        self.assertEqual(index.versions('dev-util/nonexistent'), [])
+
+    def test_itermatch(self):
+        index = self.update()
+        for restrict, expected in (
+                (atom('>=dev-util/foo-1.9'), ['dev-util/foo-1.9', 'dev-util/foo-1.10-r2']),
+                (atom('dev-util/foo:0'), ['dev-util/foo-1', 'dev-util/foo-1.9']),
+                (packages.PackageRestriction(
+                    'category', values.StrExactMatch('app-misc')), ['app-misc/baz-0.1']),
+                (packages.PackageRestriction(
+                    'keywords', values.ContainmentMatch('x86')), ['dev-util/foo-1']),
+                # entries don't have USE flags, same as unconfigured packages
+                (atom('<dev-util/foo-1.9[bar]'), ['dev-util/foo-1']),
+                (atom('dev-util/foo::test'), []),
+                ):
+            self.assertEqual([x.cpvstr for x in index.itermatch(restrict)], expected)
+
+    def test_incremental(self):
+        self.update().close()
+        st = os.stat(self.index_path)
+        index = self.update()
+        self.assertEqual(index.reindexed, 0)
+        self.assertEqual(str(index), 'repo index: 4 versions, 0 reindexed')
+        index.close()
+        # unchanged indexes don't get rewritten
+        self.assertEqual(os.stat(self.index_path).st_ino, st.st_ino)
+
+        self.add('dev-util/foo-1.9', KEYWORDS='x86 ~amd64', SLOT='0')
+        self.add('dev-util/new-1', SLOT='0')
+        # cache entries of removed ebuilds are dropped
+        os.remove(pjoin(self.repo.location, 'app-misc/baz/baz-0.1.ebuild'))
+        index = self.update()
+        self.assertEqual(index.reindexed, 2)
+        self.assertEqual(
+            [(x.cpvstr, x.keywords) for x in index],
+            [('dev-util/foo-1', ('x86', '~amd64')),
+             ('dev-util/foo-1.9', ('x86', '~amd64')),
+             ('dev-util/foo-1.10-r2', ('~x86',)),
+             ('dev-util/new-1', ())])
+
+    def test_corrupted(self):
+        for data in ('', 'garbage', 'PKGCKIDX' + '\xff' * 20):
+            with open(self.index_path, 'w') as f:
+                f.write(data)
+            index = self.update()
+            self.assertEqual(index.reindexed, 4)
+            self.assertEqual(len(index), 4)
+
+    def test_valid(self):
+        self.add('dev-util/stale-1', ebuild='changed', _md5_='abc', SLOT='1')
+        self.add('dev-util/uncached-1', cache=False)
+        self.write('dev-util/uncached/metadata.xml', '<pkgmetadata/>')
+        index = self.update()
+        self.assertEqual(
+            [(x.cpvstr, x.valid) for x in index],
+            [('app-misc/baz-0.1', True), ('dev-util/foo-1', True),
+             ('dev-util/foo-1.9', True), ('dev-util/foo-1.10-r2', True),
+             ('dev-util/stale-1', False), ('dev-util/uncached-1', False)])
+        uncached = index.versions('dev-util/uncached')[0]
+        self.assertEqual((uncached.slot, uncached.keywords, uncached.cache_mtime),
+                         ('', (), -1))
+        index.close()
+
+        # changed eclasses invalidate the entries inheriting them
+        self.write('eclass/eutils.eclass', 'edited')
+        index = self.update()
+        self.assertEqual(index.reindexed, 0)
+        self.assertFalse(index.versions('dev-util/foo')[0].valid)
+        self.assertTrue(index.versions('dev-util/foo')[1].valid)
+
+    def test_slots(self):
+        index = self.update()
+        self.assertTrue(index.covers(self.repo))
+        self.assertFalse(index.covers(FakeRepo(location=self.dir)))
+        # the repo has no packages, everything has to come from the index
+        check = metadata_checks.MissingSlotDepReport.__new__(
+            metadata_checks.MissingSlotDepReport)
+        check.options = Options(repo_index=index)
+        check.slot_index = {}
+        self.assertEqual(
+            sorted(check.dep_slots(self.repo, atom('dev-util/foo'))), ['0', '2'])
+        self.assertEqual(
+            sorted(check.dep_slots(self.repo, atom('>dev-util/foo-1.9'))), ['2'])
+
+    def test_slots_fallback(self):
+        # without cache entries slots have to come from the packages
+        self.repo.pkgs = [
+            FakePkg('dev-util/foo-1', data={'SLOT': '0'}),
+            FakePkg('dev-util/foo-2', data={'SLOT': '2'}),
+            FakePkg('dev-util/bar-1', data={'SLOT': '1'}),
+        ]
+        self.add('dev-util/bar-1', cache=False)
+        self.add('dev-util/foo-2', ebuild='changed', _md5_='abc', SLOT='0')
+        check = metadata_checks.MissingSlotDepReport.__new__(
+            metadata_checks.MissingSlotDepReport)
+        check.options = Options(repo_index=self.update())
+        check.slot_index = {}
+        self.assertEqual(
+            sorted(check.dep_slots(self.repo, atom('dev-util/bar'))), ['1'])
+        # stale entries too
+        self.assertEqual(
+            sorted(check.dep_slots(self.repo, atom('dev-util/foo'))), ['0', '2'])
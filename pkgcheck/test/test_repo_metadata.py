@@ -0,0 +1,64 @@
+# License: BSD/GPL2
+
+from pkgcheck.test import misc
+from pkgcheck import repo_metadata
+
+
+class FakeRepo(object):
+
+    def __init__(self, licenses=(), masters=()):
+        self.licenses = licenses
+        self.masters = masters
+
+
+class TestUnusedLicensesCheck(misc.ReportTestCase):
+
+    check_kls = repo_metadata.UnusedLicensesCheck
+
+    def mk_check(self):
+        master = FakeRepo(licenses=('GPL-2',))
+        repo = FakeRepo(licenses=('GPL-2', 'BSD', 'MIT', 'foo'), masters=(master,))
+        return self.check_kls(misc.Options(target_repo=repo))
+
+    def mk_pkg(self, cpv, license):
+        return misc.FakePkg(cpv, data={'LICENSE': license})
+
+    def run_check(self, check, pkgs):
+        l = []
+        r = misc.fake_reporter(l.append)
+        check.start()
+        for pkg in pkgs:
+            check.feed(pkg, r)
+        check.finish(r)
+        return l
+
+    def test_serial(self):
+        reports = self.run_check(self.mk_check(), [
+            self.mk_pkg('dev-util/foo-1', 'BSD'),
+            self.mk_pkg('dev-util/bar-1', 'GPL-2'),
+        ])
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0].licenses, ('MIT', 'foo'))
+
+    def test_merged(self):
+        shards = (
+            [self.mk_pkg('dev-util/foo-1', 'BSD')],
+            [self.mk_pkg('sys-apps/bar-1', 'GPL-2 foo')],
+            [],
+        )
+        states = []
+        for pkgs in shards:
+            check = self.mk_check()
+            check.start()
+            for pkg in pkgs:
+                check.feed(pkg, None)
+            states.append(check.partial_state())
+
+        check = self.mk_check()
+        check.start()
+        for state in states:
+            check.merge_state(state)
+        l = []
+        check.finish(misc.fake_reporter(l.append))
+        self.assertEqual(len(l), 1)
+        self.assertEqual(l[0].licenses, ('MIT',))
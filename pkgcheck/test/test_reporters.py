@@ -0,0 +1,124 @@
+# License: BSD/GPL2
+
+import threading
+
+from pkgcore.test import TestCase
+
+from pkgcheck import base, reporters
+
+
+class RecordingReporter(base.Reporter):
+
+    def __init__(self, out=None):
+        base.Reporter.__init__(self)
+        self.calls = []
+
+    def start(self):
+        self.calls.append(('start',))
+
+    def add_report(self, result):
+        self.calls.append(('add_report', result))
+
+    def start_check(self, source, target):
+        self.calls.append(('start_check', source, target))
+
+    def end_check(self):
+        self.calls.append(('end_check',))
+
+    def finish(self):
+        self.calls.append(('finish',))
+
+
+class FailingReporter(RecordingReporter):
+
+    def add_report(self, result):
+        raise ValueError(result)
+
+
+def run_reporter(reporter, results=xrange(100)):
+    reporter.start()
+    reporter.start_check(['check'], 'target')
+    for result in results:
+        reporter.add_report(result)
+    reporter.end_check()
+    reporter.finish()
+
+
+class TestMultiplexReporter(TestCase):
+
+    def test_forwarding(self):
+        subs = [RecordingReporter(), RecordingReporter()]
+        run_reporter(reporters.MultiplexReporter(*subs), [1, 2])
+        expected = [
+            ('start',), ('start_check', ['check'], 'target'),
+            ('add_report', 1), ('add_report', 2), ('end_check',), ('finish',)]
+        for sub in subs:
+            self.assertEqual(sub.calls, expected)
+
+
+class TestAsyncReporter(TestCase):
+
+    def test_order(self):
+        serial = RecordingReporter()
+        run_reporter(serial)
+        for maxsize in (1, 10, 0):
+            wrapped = RecordingReporter()
+            run_reporter(reporters.AsyncReporter(wrapped, maxsize))
+            self.assertEqual(serial.calls, wrapped.calls)
+
+    def test_multiplex(self):
+        subs = [RecordingReporter(), RecordingReporter()]
+        run_reporter(reporters.AsyncReporter(
+            reporters.MultiplexReporter(*subs), 5))
+        serial = RecordingReporter()
+        run_reporter(serial)
+        for sub in subs:
+            self.assertEqual(sub.calls, serial.calls)
+
+    def test_backpressure(self):
+        release = threading.Event()
+
+        class BlockingReporter(RecordingReporter):
+            def add_report(self, result):
+                release.wait()
+                RecordingReporter.add_report(self, result)
+
+        wrapped = BlockingReporter()
+        reporter = reporters.AsyncReporter(wrapped, 2)
+        reporter.start()
+        blocked = []
+
+        def feed():
+            for i in xrange(5):
+                reporter.add_report(i)
+            blocked.append(False)
+
+        thread = threading.Thread(target=feed)
+        thread.daemon = True
+        thread.start()
+        # the writer blocks on the first result, the queue holds two more
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+        release.set()
+        thread.join()
+        self.assertEqual(blocked, [False])
+        reporter.finish()
+        self.assertEqual(
+            [x[1] for x in wrapped.calls if x[0] == 'add_report'], range(5))
+
+    def test_exceptions(self):
+        reporter = reporters.AsyncReporter(FailingReporter(), 1)
+        self.assertRaises(ValueError, run_reporter, reporter)
+
+    def test_finish_after_failure(self):
+        reporter = reporters.AsyncReporter(FailingReporter(), 1)
+        reporter.start()
+        reporter.add_report(1)
+        # with a single queue slot the failure is recorded by the time the
+        # third call is made
+        self.assertRaises(
+            ValueError, lambda: [reporter.end_check() for i in xrange(3)])
+        thread = reporter._thread
+        self.assertRaises(ValueError, reporter.finish)
+        self.assertFalse(thread.is_alive())
+        self.assertIdentical(reporter._thread, None)
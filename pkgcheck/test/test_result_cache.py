@@ -0,0 +1,197 @@
+# License: BSD/GPL2
+
+import argparse
+import logging
+import os
+
+from pkgcore.test.misc import FakeRepo
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcheck import base, parallel, result_cache
+from pkgcheck.test import misc
+from pkgcheck.test.test_parallel import FakeSource
+
+
+class PkgResult(base.Warning):
+
+    __slots__ = ('category', 'package', 'version', 'text')
+    __attrs__ = __slots__
+
+    threshold = base.versioned_feed
+
+    def __init__(self, pkg, text):
+        super(PkgResult, self).__init__()
+        self._store_cpv(pkg)
+        self.text = text
+
+
+class CountingCheck(base.Template):
+
+    feed_type = base.versioned_feed
+    cacheable = True
+
+    def __init__(self):
+        self.fed = []
+
+    def feed(self, pkg, reporter):
+        self.fed.append(pkg.cpvstr)
+        reporter.add_report(PkgResult(pkg, 'checked'))
+
+
+class FailingCheck(CountingCheck):
+
+    def feed(self, pkg, reporter):
+        CountingCheck.feed(self, pkg, reporter)
+        if pkg.cpvstr == 'dev-util/foo-2':
+            raise Exception('failed')
+
+
+class Eclass(object):
+
+    def __init__(self, path):
+        self.path = path
+
+
+class PathPkg(misc.FakePkg):
+
+    __slots__ = ('_path',)
+
+    def __init__(self, cpvstr, path, data=None):
+        misc.FakePkg.__init__(self, cpvstr, data=data)
+        object.__setattr__(self, '_path', path)
+
+    path = property(lambda self: self._path)
+
+
+class TestResultCache(TempDirMixin, misc.ReportTestCase):
+
+    cpvs = ('app-misc/baz-1', 'dev-util/foo-1', 'dev-util/foo-2',
+            'sys-apps/spork-3')
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.cache_path = pjoin(self.dir, 'cache')
+        self.eclass = pjoin(self.dir, 'foo.eclass')
+        self.write(self.eclass, 'inherit me')
+
+    def write(self, path, data):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def ebuild_path(self, cpvstr):
+        pkg = misc.FakePkg(cpvstr)
+        return pjoin(self.dir, 'repo', pkg.key, '%s-%s.ebuild' % (
+            pkg.package, pkg.fullver))
+
+    def mk_pkgs(self):
+        pkgs = []
+        for cpvstr in self.cpvs:
+            path = self.ebuild_path(cpvstr)
+            if not os.path.exists(path):
+                self.write(path, 'EAPI=5\n')
+            pkgs.append(PathPkg(cpvstr, path, data={
+                '_eclasses_': {'foo': Eclass(self.eclass)}}))
+        return pkgs
+
+    def run_check(self, selection='selection', jobs=1, check_cls=CountingCheck):
+        cache = result_cache.ResultCache(self.cache_path, selection)
+        check = check_cls()
+        results = []
+        pipe = cache.wrap(base.CheckRunner([check]))
+        parallel.run(FakeSource(self.mk_pkgs()), pipe,
+                     misc.fake_reporter(results.append), jobs)
+        cache.save()
+        return cache, check.fed, [(x.category, x.package, x.version, x.text)
+                                  for x in results]
+
+    def test_replay(self):
+        cache, fed, results = self.run_check()
+        self.assertEqual(fed, list(self.cpvs))
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+        cache, fed, cached_results = self.run_check()
+        self.assertEqual(fed, [])
+        self.assertEqual((cache.hits, cache.misses), (3, 0))
+        self.assertEqual(results, cached_results)
+
+    def test_changed_package(self):
+        self.run_check()
+        path = self.ebuild_path('dev-util/foo-2')
+        self.write(path, 'EAPI=6\n\n')
+        cache, fed, results = self.run_check()
+        # all versions get rechecked
+        self.assertEqual(fed, ['dev-util/foo-1', 'dev-util/foo-2'])
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(len(results), 4)
+
+        # files other than ebuilds count too
+        self.write(pjoin(os.path.dirname(path), 'files', 'foo.patch'), 'patch')
+        self.assertEqual(
+            self.run_check()[1], ['dev-util/foo-1', 'dev-util/foo-2'])
+
+    def test_changed_eclass(self):
+        self.run_check()
+        self.write(self.eclass, 'inherit something else')
+        self.assertEqual(self.run_check()[1], list(self.cpvs))
+
+    def test_changed_selection(self):
+        self.run_check()
+        self.assertEqual(self.run_check('other')[1], list(self.cpvs))
+        self.assertEqual(self.run_check('other')[1], [])
+
+    def test_parallel(self):
+        cache, fed, results = self.run_check(jobs=2)
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+        cache, fed, cached_results = self.run_check()
+        self.assertEqual(fed, [])
+        self.assertEqual(results, cached_results)
+        cache, fed, cached_results = self.run_check(jobs=2)
+        self.assertEqual((cache.hits, cache.misses), (3, 0))
+        self.assertEqual(results, cached_results)
+
+    def test_failures(self):
+        logging.disable(logging.CRITICAL)
+        try:
+            cache, fed, results = self.run_check(check_cls=FailingCheck)
+            self.assertEqual(fed, list(self.cpvs))
+            self.assertEqual(len(results), 4)
+            # packages the check raised on don't get cached
+            cache, fed, results = self.run_check(check_cls=FailingCheck)
+            self.assertEqual(fed, ['dev-util/foo-1', 'dev-util/foo-2'])
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+            self.assertEqual(len(results), 4)
+        finally:
+            logging.disable(logging.NOTSET)
+
+    def test_selection_fingerprint(self):
+        options = argparse.Namespace(
+            target_repo=FakeRepo(location=pjoin(self.dir, 'repo')))
+        selection = result_cache.selection_fingerprint(options)
+        self.assertEqual(selection, result_cache.selection_fingerprint(options))
+        # e.g. eapis-deprecated in layout.conf changes results
+        self.write(pjoin(self.dir, 'repo', 'metadata', 'layout.conf'),
+                   'eapis-deprecated = 5\n')
+        self.assertNotEqual(
+            selection, result_cache.selection_fingerprint(options))
+        options.arches = ('amd64',)
+        self.assertNotEqual(
+            selection, result_cache.selection_fingerprint(options))
+
+    def test_pruned_file_hashes(self):
+        self.run_check()
+        path = self.ebuild_path('dev-util/foo-2')
+        cache = result_cache.ResultCache(self.cache_path, 'selection')
+        self.assertIn(path, cache._file_hashes)
+        os.remove(path)
+        cache.save()
+        cache = result_cache.ResultCache(self.cache_path, 'selection')
+        self.assertNotIn(path, cache._file_hashes)
+        self.assertIn(self.ebuild_path('dev-util/foo-1'), cache._file_hashes)
+
+    def test_corrupted(self):
+        self.write(self.cache_path, 'garbage')
+        self.assertEqual(self.run_check()[1], list(self.cpvs))
+        self.assertEqual(self.run_check()[1], [])
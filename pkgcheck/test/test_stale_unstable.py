@@ -3,6 +3,7 @@
 
 import time
 
+from pkgcheck.addons import KeywordsAddon
 from pkgcheck.stale_unstable import StaleUnstableReport
 from pkgcheck.test import misc
 
@@ -19,11 +20,10 @@ class TestStaleUnstableReport(misc.ReportTestCase):
     def test_it(self):
         now = time.time()
         mk_pkg = self.mk_pkg
-        check = StaleUnstableReport(
-            misc.Options(
-                selected_arches=("x86", "ppc", "amd64"),
-                arches=("x86", "ppc", "amd64")),
-            None)
+        options = misc.Options(
+            selected_arches=("x86", "ppc", "amd64"),
+            arches=("x86", "ppc", "amd64"))
+        check = StaleUnstableReport(options, None, KeywordsAddon(options))
 
         check.start()
 
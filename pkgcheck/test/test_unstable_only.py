@@ -0,0 +1,34 @@
+# License: BSD/GPL2
+
+from pkgcheck.addons import KeywordsAddon
+from pkgcheck.test import misc
+from pkgcheck.unstable_only import UnstableOnlyReport
+
+
+class TestUnstableOnlyReport(misc.ReportTestCase):
+
+    check_kls = UnstableOnlyReport
+
+    def mk_pkg(self, ver, keywords=""):
+        return misc.FakePkg(
+            "dev-util/diffball-%s" % ver, data={"KEYWORDS": keywords})
+
+    def test_it(self):
+        options = misc.Options(
+            selected_arches=("x86", "ppc", "amd64"),
+            arches=("x86", "ppc", "amd64"))
+        check = UnstableOnlyReport(options, None, KeywordsAddon(options))
+
+        self.assertNoReport(check, [self.mk_pkg("0.1", "x86 ppc")])
+        # stable on an older version
+        self.assertNoReport(
+            check, [self.mk_pkg("0.1", "x86"), self.mk_pkg("0.2", "~x86")])
+        # arches that aren't checked are ignored
+        self.assertNoReport(check, [self.mk_pkg("0.1", "~foo")])
+
+        reports = self.assertReports(
+            check,
+            [self.mk_pkg("0.1", "~x86 ~amd64"), self.mk_pkg("0.2", "~x86 amd64"),
+             self.mk_pkg("0.3", "ppc")])
+        self.assertEqual(
+            [(x.arch, x.version) for x in reports], [('x86', ('0.1', '0.2'))])
@@ -0,0 +1,47 @@
+# License: BSD/GPL2
+
+from pkgcore.ebuild.atom import atom
+from pkgcore.repository import multiplex
+from pkgcore.repository.util import SimpleTree
+from pkgcore.test import TestCase
+
+from pkgcheck import addons, visibility
+from pkgcheck.test.misc import Options
+
+
+class TestPackageKeys(TestCase):
+
+    def test_package_keys(self):
+        master = SimpleTree({
+            'dev-util': {'foo': ['1'], 'bar': ['1']},
+            'app-misc': {'baz': ['0.1']},
+        })
+        overlay = SimpleTree({'dev-util': {'foo': ['2'], 'new': ['1']}})
+        self.assertEqual(
+            sorted(visibility.package_keys(master)),
+            ['app-misc/baz', 'dev-util/bar', 'dev-util/foo'])
+        self.assertEqual(
+            sorted(visibility.package_keys(multiplex.tree(overlay, master))),
+            ['app-misc/baz', 'dev-util/bar', 'dev-util/foo', 'dev-util/new'])
+
+
+class TestVisibilityQueries(TestCase):
+
+    def test_evicted_queries(self):
+        repo = SimpleTree({'dev-util': {'foo': ['1', '2'], 'bar': ['1']}})
+        check = object.__new__(visibility.VisibilityReport)
+        check.options = Options(search_repo=repo)
+        check.package_keys = visibility.package_keys(repo)
+        check.query_cache = addons.QueryCache(max_weight=1)
+        check.pkg_queries = {}
+
+        foo = atom('dev-util/foo')
+        check.query_cache[foo] = check.search(foo)
+        check.query_cache[atom('dev-util/bar')] = check.search(atom('dev-util/bar'))
+        self.assertNotIn(foo, check.query_cache)
+        # evicted entries are searched for again instead of matching nothing
+        self.assertEqual(
+            sorted(x.cpvstr for x in check.query(foo)),
+            ['dev-util/foo-1', 'dev-util/foo-2'])
+        self.assertIn(foo, check.pkg_queries)
+        self.assertEqual(tuple(check.query(atom('dev-util/nonexistent'))), ())
@@ -1,9 +1,7 @@
 # Copyright: 2006 Brian Harring <ferringb@gmail.com>
 # License: BSD/GPL2
 
-from pkgcore.restrictions import packages, values
-
-from pkgcheck.addons import ArchesAddon, StableCheckAddon
+from pkgcheck.addons import ArchesAddon, KeywordsAddon, StableCheckAddon
 from pkgcheck.base import package_feed, Warning
 
 
@@ -30,36 +28,26 @@ class UnstableOnlyReport(StableCheckAddon):
     """scan for pkgs that have just unstable keywords"""
 
     feed_type = package_feed
-    required_addons = (ArchesAddon,)
+    cacheable = True
+    required_addons = (ArchesAddon, KeywordsAddon)
     known_results = (UnstableOnly,)
 
-    def __init__(self, options, arches, *args):
+    def __init__(self, options, arches, keywords, *args):
         super(UnstableOnlyReport, self).__init__(options)
-        arches = set(x.strip().lstrip("~") for x in self.arches)
-
-        # stable, then unstable, then file
-        self.arch_restricts = {}
-        for arch in arches:
-            self.arch_restricts[arch] = [
-                packages.PackageRestriction(
-                    "keywords", values.ContainmentMatch(arch)),
-                packages.PackageRestriction(
-                    "keywords", values.ContainmentMatch("~%s" % arch))
-                ]
+        self.keywords = keywords
+        self.arch_mask = keywords.mask(x.strip() for x in self.arches)
 
     def feed(self, pkgset, reporter):
-        # stable, then unstable, then file
-        for k, v in self.arch_restricts.iteritems():
-            stable = unstable = None
-            for x in pkgset:
-                if v[0].match(x):
-                    stable = x
-                    break
-            if stable is not None:
-                continue
-            unstable = [x for x in pkgset if v[1].match(x)]
-            if unstable:
-                reporter.add_report(UnstableOnly(unstable, k))
-
-    def finish(self, reporter):
-        self.arch_restricts.clear()
+        matrix = self.keywords.matrix(pkgset)
+        stable = unstable = 0
+        for bits in matrix.stable:
+            stable |= bits
+        for bits in matrix.unstable:
+            unstable |= bits
+        # arches lacking stable keywords on all versions, with unstable ones
+        unstable_only = self.arch_mask & unstable & ~stable
+        for arch in self.keywords.names(unstable_only):
+            bit = self.keywords.mask((arch,))
+            reporter.add_report(UnstableOnly(
+                [pkg for pkg, bits in zip(pkgset, matrix.unstable) if bits & bit],
+                arch))
@@ -6,7 +6,7 @@ from snakeoil import klass
 from snakeoil.iterables import caching_iter
 from snakeoil.sequences import stable_unique, iflatten_instance, iflatten_func
 
-from pkgcheck import base, addons
+from pkgcheck import atoms, base, addons
 
 vcs_eclasses = frozenset([
     "bzr", "cvs", "darcs", "git-2", "git-r3", "golang-vcs", "mercurial", "subversion"
@@ -75,19 +75,16 @@ def visit_atoms(pkg, stream):
 
 
 def strip_atom_use(inst):
-    if not inst.use:
-        return inst
-    if '=*' == inst.op:
-        s = '=%s*' % inst.cpvstr
-    else:
-        s = inst.op + inst.cpvstr
-    if inst.blocks:
-        s = '!' + s
-        if not inst.blocks_temp_ignorable:
-            s = '!' + s
-    if inst.slot:
-        s += ':%s' % inst.slot
-    return atom(s)
+    return atoms.cache.strip_use(inst)
+
+
+def package_keys(repo):
+    """Return the keys of all packages in a repo, including multiplexed ones."""
+    keys = set()
+    for tree in getattr(repo, 'trees', (repo,)):
+        for category, pkgs in tree.packages.iteritems():
+            keys.update('%s/%s' % (category, pkg) for pkg in pkgs)
+    return frozenset(keys)
 
 
 class VisibleVcsPkg(base.Error):
@@ -189,18 +186,25 @@ class VisibilityReport(base.Template):
         self.depset_cache = depset_cache
         self.profiles = profiles
         self.arches = frozenset(x.lstrip("~") for x in options.arches)
+        # deps on packages that don't exist anywhere are common enough to
+        # reject them without searching the repo
+        self.package_keys = package_keys(options.search_repo)
+        # matches of the nodes queried for the current package, the run wide
+        # query cache may evict them before the package is done with
+        self.pkg_queries = {}
 
     def feed(self, pkg, reporter):
         # query_cache gets caching_iter partial repo searches shoved into it-
-        # reason is simple, it's likely that versions of this pkg probably
-        # use similar deps- so we're forcing those packages that were
-        # accessed for atom matching to remain in memory.
+        # reason is simple, popular deps get used by lots of packages across
+        # the tree- so we're forcing those packages that were accessed for
+        # atom matching to remain in memory for the whole run.
         # end result is less going to disk
 
         if vcs_eclasses.intersection(pkg.inherited):
             # vcs ebuild that better not be visible
             self.check_visibility_vcs(pkg, reporter)
 
+        self.pkg_queries = pkg_queries = {}
         suppressed_depsets = []
         for attr, depset in (("depends", pkg.depends),
                              ("rdepends", pkg.rdepends),
@@ -208,15 +212,15 @@ class VisibilityReport(base.Template):
             nonexistent = set()
             for orig_node in visit_atoms(pkg, depset):
                 node = strip_atom_use(orig_node)
-                if node not in self.query_cache:
+                matches = self.query_cache.get(node)
+                if matches is None:
                     if node in self.profiles.global_insoluble:
                         nonexistent.add(node)
                         # insert an empty tuple, so that tight loops further
                         # on don't have to use the slower get method
-                        self.query_cache[node] = ()
+                        self.query_cache[node] = pkg_queries[node] = ()
                     else:
-                        matches = caching_iter(
-                            self.options.search_repo.itermatch(node))
+                        matches = pkg_queries[node] = self.search(node)
                         if matches:
                             self.query_cache[node] = matches
                             if orig_node is not node:
@@ -225,8 +229,10 @@ class VisibilityReport(base.Template):
                             nonexistent.add(node)
                             self.query_cache[node] = ()
                             self.profiles.global_insoluble.add(node)
-                elif not self.query_cache[node]:
-                    nonexistent.add(node)
+                else:
+                    pkg_queries[node] = matches
+                    if not matches:
+                        nonexistent.add(node)
             if nonexistent:
                 reporter.add_report(NonExistentDeps(pkg, attr, nonexistent))
 
@@ -239,6 +245,27 @@ class VisibilityReport(base.Template):
                 continue
             for edepset, profiles in self.depset_cache.collapse_evaluate_depset(pkg, attr, depset):
                 self.process_depset(pkg, attr, edepset, profiles, reporter)
+        self.pkg_queries = {}
+
+    def search(self, node):
+        """Search the repo for the packages matching a node."""
+        if node.key not in self.package_keys:
+            return ()
+        return caching_iter(self.options.search_repo.itermatch(node))
+
+    def query(self, node):
+        """Return the packages matching a node, preferring cached queries.
+
+        A node missing from the caches is searched for again, it may have
+        been evicted from the query cache since it was primed.
+        """
+        matches = self.pkg_queries.get(node)
+        if matches is None:
+            matches = self.query_cache.get(node)
+            if matches is None:
+                matches = self.search(node)
+            self.pkg_queries[node] = matches
+        return matches
 
     def check_visibility_vcs(self, pkg, reporter):
         for profile in self.profiles:
@@ -246,7 +273,7 @@ class VisibilityReport(base.Template):
                 reporter.add_report(VisibleVcsPkg(pkg, profile.key, profile.name))
 
     def process_depset(self, pkg, attr, depset, profiles, reporter):
-        get_cached_query = self.query_cache.get
+        query = self.query
 
         csolutions = []
         for required in depset.iter_cnf_solutions():
@@ -281,7 +308,7 @@ class VisibilityReport(base.Template):
                         # get is required since there is an intermix between old style
                         # virtuals and new style- thus the cache priming doesn't get
                         # all of it.
-                        src = get_cached_query(strip_atom_use(node), ())
+                        src = query(strip_atom_use(node))
                         if node.use:
                             src = (pkg for pkg in src if node.force_True(
                                    FakeConfigurable(pkg, profile)))
@@ -101,6 +101,7 @@ class WhitespaceCheck(base.Template):
     """checking ebuild for (useless) whitespaces"""
 
     feed_type = base.ebuild_feed
+    cacheable = True
     known_results = (
         WhitespaceFound, WrongIndentFound, DoubleEmptyLine,
         TrailingEmptyLine, NoFinalNewline)